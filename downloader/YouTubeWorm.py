@@ -2,31 +2,44 @@ import sys
 import os
 from typing import Callable, Literal
 from ast import literal_eval
+from functools import partial
 from urllib.error import URLError
-from time import sleep, time
-from queue import Queue
-from threading import Thread
 
 from PyQt5.QtWidgets import QApplication, QMainWindow, QShortcut, QPushButton, \
     QLabel, QLineEdit, QWidget, QSizePolicy, QCheckBox, QMdiSubWindow, \
-    QFrame, QTextEdit, QDialog, QHBoxLayout, qApp, QGridLayout
-from PyQt5.QtCore import QRect, Qt, QTimer
+    QFrame, QTextEdit, QDialog, QHBoxLayout, qApp, QGridLayout, QComboBox
+from PyQt5.QtCore import QRect, Qt, QTimer, QThread, pyqtSignal
 from PyQt5.QtGui import QKeySequence, QFont, QIcon, QPixmap, QPalette, QBrush, QColor
 from qroundprogressbar import QRoundProgressBar
 
-from pytube import YouTube
-from pytube.streams import Stream
 from pytube.exceptions import RegexMatchError, VideoUnavailable
 
-from moviepy.editor import AudioFileClip
+from bandwidth import parse_rate, set_limit
+from disk_space import NotEnoughSpace, set_preallocation, DEFAULT_CHECK
+from progress import ProgressSummary, get_bus, format_size
+from metrics import serve_metrics, dump_json
+from stream_selection import parse_bitrate
+from scheduling import DEFAULT_POLICY, POLICIES
+from expansion import DEFAULT_PAGE_LOOKAHEAD
+from connection_pool import get_connection_pool, DEFAULT_PER_HOST, DEFAULT_KEEP_ALIVE
+from job_store import JobStore, DEFAULT_STORE_LOCATION
+from stream_cache import StreamCache, DEFAULT_CACHE_SIZE
+from transcoding import ConversionError
+import engine
+from engine import DownloadPool, InvalidResolution, shutdown_pool, \
+    DEFAULT_WORKERS, DEFAULT_LOOKAHEAD
 
 
-class InvalidResolution(AttributeError):
-    ...
+DEFAULT_SEGMENTS = 8
 
 
 class CircularProgressBar(QWidget):
-    """A widget to display downloading progress."""
+    """A widget to display downloading progress.
+    The progress events arrive from the downloading
+    threads, the progress_received signal passes
+    them to the GUI thread."""
+    progress_received = pyqtSignal(list)
+
     def __init__(self) -> None:
         super().__init__()
         self.setObjectName("TestWidget")
@@ -69,35 +82,41 @@ class CircularProgressBar(QWidget):
         self.RoundBar6.setBarStyle(QRoundProgressBar.BarStyle.LINE)
         self.RoundBar6.setOutlinePenWidth(18)
         self.RoundBar6.setDataPenWidth(10)
-        self.timer = Timer()
+        self.summary = ProgressSummary()
+        self.following = False
+        self.progress_received.connect(self._show_progress)
 
-    def set_progress(self, progress: int) -> None:
+    def set_progress(self, progress: float) -> None:
         """Set the QRoundProgressBar progress."""
         self.RoundBar6.setValue(progress)
-        qApp.processEvents()
-
-    def quick_progress(self, start_point: int,
-                       stop_point: int,
-                       step: int,
-                       waiting_time: int) -> None:
-        """Function to create an illusion of
-        displaying the progress. Use this to
-        quickly fill the progress bar.
-        :param start_point:
-                the initial progress,
-                from which progress bar will
-                be filled in.
-        :param stop_point:
-                the value of progress bar
-                on which the function should end.
-        :param step:
-                progress that will be made
-                on one step.
-        :param waiting_time: time between each step."""
-        for i in range(start_point, stop_point, step):
-            self.RoundBar6.setValue(i)
-            qApp.processEvents()
-            self.timer.start_timer(waiting_time)
+
+    def follow_progress(self) -> None:
+        """Start showing the progress events
+        published to the ProgressBus."""
+        self.summary = ProgressSummary()
+        self.following = True
+        self.set_progress(0)
+        get_bus().subscribe(self._receive_progress)
+
+    def stop_following(self) -> None:
+        """Stop showing the progress events, the
+        ones still on their way are dropped."""
+        self.following = False
+        get_bus().unsubscribe(self._receive_progress)
+
+    def _receive_progress(self, events: list) -> None:
+        """Called by the ProgressBus in a downloading thread."""
+        self.progress_received.emit(events)
+
+    def _show_progress(self, events: list) -> None:
+        """Show the progress of the whole request."""
+        if not self.following:
+            return
+        self.summary.update(events)
+        self.set_progress(self.summary.get_fraction() * 100)
+        self.set_label_text(f'Receiving and saving...\n'
+                            f'{self.summary.count("done", "failed")}/{self.summary.get_total()} files, '
+                            f'{format_size(self.summary.get_rate())}/s')
 
     def set_label_text(self, text: str) -> None:
         """Set the text of the label at the bottom
@@ -105,11 +124,6 @@ class CircularProgressBar(QWidget):
         self.label.setText(text)
         self.label.update()
 
-    @property
-    def get_current_progress(self) -> int:
-        """Get the current progress."""
-        return self.RoundBar6.m_value.real
-
 
 class Settings:
     """The user's app settings, taken from
@@ -128,6 +142,12 @@ class Settings:
                     default_download_path dict."""
         return self.default_download_path.get(f_type, None)
 
+    def get_option(self, key: str, default=None):
+        """Get a top-level setting, such as 'Workers'.
+        :param default: the value returned if the
+                    setting is absent from the file."""
+        return self.all_settings.get(key, default)
+
     @classmethod
     def change_settings(cls, key: str, value: str) -> None:
         """Change the default download_path.
@@ -136,9 +156,23 @@ class Settings:
                 that needs to be change
         :param value: the new value of a setting."""
         cls.default_download_path[key] = value
+        cls._write_settings()
+
+    @classmethod
+    def change_option(cls, key: str, value) -> None:
+        """Change or add a top-level setting.
+        :param key: the key of a setting
+                that needs to be change
+        :param value: the new value of a setting,
+                it should be a python literal."""
+        cls.all_settings[key] = value
+        cls._write_settings()
+
+    @classmethod
+    def _write_settings(cls) -> None:
+        """Write all the settings back to the file."""
         with open('pronamka_downloader_settings.txt', mode='w') as settings_file:
-            settings_file.write("{'DefaultDownloadPath': " +
-                                f'{cls.default_download_path}' + '}')
+            settings_file.write(f'{cls.all_settings}')
 
 
 class Label(QLabel):
@@ -227,6 +261,21 @@ class SettingsWindow(QMdiSubWindow):
         self.main_menu_label.setAlignment(Qt.AlignTop)
         Label(self, QRect(165, 30, 200, 50), 'Video:', QFont('Roboto', 16, QFont.StyleItalic))
         Label(self, QRect(165, 180, 200, 50), 'Audio', QFont('Roboto', 16, QFont.StyleItalic))
+        Label(self, QRect(110, 340, 110, 40), 'Workers:', QFont('Roboto', 16, QFont.StyleItalic))
+        self.workers = LineEdit(self, QRect(215, 347, 60, 30), 'Threads')
+        self.workers.setText(str(Settings().get_option('Workers', DEFAULT_WORKERS)))
+        Label(self, QRect(285, 340, 130, 40), 'Lookahead:', QFont('Roboto', 16, QFont.StyleItalic))
+        self.lookahead = LineEdit(self, QRect(410, 347, 50, 30), 'Links')
+        self.lookahead.setText(str(Settings().get_option('Lookahead', DEFAULT_LOOKAHEAD)))
+        Label(self, QRect(10, 250, 130, 40), 'Speed limit:',
+              QFont('Roboto', 14, QFont.StyleItalic))
+        self.bandwidth_limit = LineEdit(self, QRect(10, 290, 120, 30), 'e.g. 20M')
+        self.bandwidth_limit.setText(str(Settings().get_option('BandwidthLimit', '') or ''))
+        Label(self, QRect(10, 170, 90, 40), 'Order:', QFont('Roboto', 14, QFont.StyleItalic))
+        self.schedule = QComboBox(self)
+        self.schedule.setGeometry(QRect(10, 210, 80, 30))
+        self.schedule.addItems(POLICIES)
+        self.schedule.setCurrentText(Settings().get_option('Schedule', DEFAULT_POLICY))
         PushButton(self, QRect(470, 350, 100, 30), 'OK', lambda: self.__save_changes())
         self.sep = QFrame(self)
         self.sep.setFrameShape(QFrame.VLine)
@@ -238,6 +287,11 @@ class SettingsWindow(QMdiSubWindow):
         new_audio_path = self.audio_default_path.toPlainText()
         self._save_video(new_video_path)
         self._save_audio(new_audio_path)
+        self._save_pool_size('Workers', self.workers.text(), DEFAULT_WORKERS)
+        self._save_pool_size('Lookahead', self.lookahead.text(), DEFAULT_LOOKAHEAD)
+        self._save_bandwidth_limit(self.bandwidth_limit.text())
+        if self.schedule.currentText() != Settings().get_option('Schedule', DEFAULT_POLICY):
+            Settings.change_option('Schedule', self.schedule.currentText())
         self.close()
 
     def _save_video(self, path: str) -> None:
@@ -267,6 +321,32 @@ class SettingsWindow(QMdiSubWindow):
         elif path and path != Settings().get_path_for('audio'):
             Settings.change_settings('audio', path)
 
+    @staticmethod
+    def _save_pool_size(key: str, amount: str, default: int) -> None:
+        """Check if the amount of download ('Workers') or
+        resolving ('Lookahead') threads was modified.
+        If it was and the new value is a positive number, save
+        it and resize the running pool, otherwise keep the old one."""
+        if not amount.isdigit() or int(amount) < 1:
+            return
+        if int(amount) != Settings().get_option(key, default):
+            Settings.change_option(key, int(amount))
+            get_pool().resize(**{key.lower(): int(amount)})
+
+    @staticmethod
+    def _save_bandwidth_limit(rate: str) -> None:
+        """Check if the bandwidth limit was modified.
+        If it was and the new value is a valid rate (like
+        20M, an empty field means no limit), save it and apply
+        it to the running downloads, otherwise keep the old one."""
+        try:
+            limit = parse_rate(rate or '0')
+        except ValueError:
+            return
+        if rate != (Settings().get_option('BandwidthLimit', '') or ''):
+            Settings.change_option('BandwidthLimit', rate)
+            set_limit(limit)
+
 
 class WarningDialog(QDialog):
     """Window to inform user that something went
@@ -277,7 +357,10 @@ class WarningDialog(QDialog):
                          FileNotFoundError: 'images/warning_sign.png',
                          RegexMatchError: 'images/broken_link.png',
                          VideoUnavailable: 'images/video_unavailable.png',
-                         InvalidResolution: 'images/invalid_resolution.png'
+                         InvalidResolution: 'images/invalid_resolution.png',
+                         ConversionError: 'images/warning_sign.png',
+                         NotEnoughSpace: 'images/warning_sign.png',
+                         Exception: 'images/warning_sign.png'
                          }
 
     # the dict with the exception messages
@@ -297,8 +380,16 @@ class WarningDialog(QDialog):
                               'does not exist or unavailable for some reason.',
                           InvalidResolution:
                               'The video you chose to download does not have '
-                              'resolution you have given. The video was downloaded '
-                              'with the highest resolution possible.'
+                              'a stream of {}. The video was downloaded '
+                              'in the closest one possible: {}.',
+                          ConversionError:
+                              'The file "{}" could not be converted or muxed: {}',
+                          NotEnoughSpace:
+                              'There is not enough free space on the disk. '
+                              'The file was not downloaded.',
+                          Exception:
+                              'The video could not be downloaded '
+                              'because of an unexpected error.'
                           }
 
     def __init__(self, parent: QWidget = None):
@@ -328,13 +419,20 @@ class WarningDialog(QDialog):
         self.layout.addWidget(self.button_box, alignment=Qt.AlignBottom)
         self.setLayout(self.layout)
 
-    def show_warning(self, exception: Exception) -> None:
+    def show_warning(self, exception: Exception, link: str = None) -> None:
         """Show warning with the right message and a picture.
         :param exception: a class of exception. It is important
         that the exception is described in exception_messages and
         exception_images dicts. If a message requires some
-        information, it is passe through the exception args parameter."""
-        self.set_up_warning(exception.__class__, exception.args)
+        information, it is passe through the exception args parameter.
+        A subclass of a described exception, such as HTTPError,
+        gets the message and the picture of that exception.
+        :param link: the link the exception is about, shown
+        as the title of the window."""
+        described = next(i for i in exception.__class__.__mro__ if i in self.exception_messages)
+        self.set_up_warning(described, exception.args)
+        if link:
+            self.setWindowTitle(link)
         self.show()
 
     def set_up_warning(self, exception_type, info) -> None:
@@ -358,261 +456,101 @@ class WarningDialog(QDialog):
         )
 
 
-class Timer(QTimer):
-    """Timer used to define,
-    how much time should round progress bar
-    wait between adding a percent."""
-
-    def __init__(self) -> None:
-        """Set up the timer."""
+def get_rate_option(key: str, parse: Callable[[str], int] = parse_rate) -> int:
+    """Get a bandwidth setting, such as '20M', in bytes per second.
+    :param parse: the function reading the setting, such
+    as parse_bitrate for a setting in bits per second.
+    :returns: 0 (no limit), if the setting is absent or malformed."""
+    try:
+        return parse(str(Settings().get_option(key, 0) or 0))
+    except ValueError:
+        return 0
+
+
+def get_pool() -> DownloadPool:
+    """Get the process-wide DownloadPool with the amount
+    of threads taken from the settings. The stream cache size
+    is read (in megabytes, 0 turns the cache off) when the pool
+    is created. The shared connection pool and the bandwidth
+    limit are set up along with it."""
+    get_connection_pool(Settings().get_option('ConnectionsPerHost', DEFAULT_PER_HOST),
+                        Settings().get_option('KeepAlive', DEFAULT_KEEP_ALIVE))
+    set_limit(get_rate_option('BandwidthLimit'))
+    cache_size = Settings().get_option('StreamCacheSize', DEFAULT_CACHE_SIZE // 2 ** 20)
+    return engine.get_pool(Settings().get_option('Workers', DEFAULT_WORKERS),
+                           Settings().get_option('Lookahead', DEFAULT_LOOKAHEAD),
+                           lambda: StreamCache(max_size=cache_size * 2 ** 20) if cache_size else None)
+
+
+_store = None
+
+
+def get_store() -> [JobStore, None]:
+    """Get the process-wide JobStore, open it on the first call.
+    :returns: None, if recording the jobs is turned off in the settings."""
+    global _store
+    if _store is None and Settings().get_option('JobStore', False):
+        _store = JobStore(DEFAULT_STORE_LOCATION)
+    return _store
+
+
+def close_store() -> None:
+    """Close the process-wide JobStore, if it was opened."""
+    global _store
+    if _store is not None:
+        _store.close()
+        _store = None
+
+
+class BatchWorker(QThread):
+    """Runs a batch of downloads in the background,
+    so the window stays responsive and more links can
+    be queued meanwhile. The errors and the warnings
+    of the batch are passed to the GUI thread by the batch_finished signal."""
+    batch_finished = pyqtSignal(QThread, list)
+
+    def __init__(self, run_batch: Callable[[], list],
+                 stop: Callable[[], None] = None) -> None:
+        """:param run_batch: the function running the batch,
+                    returning the list of its errors and warnings.
+        :param stop: the function making the batch stop
+                    submitting jobs, if it submits them gradually."""
         super().__init__()
+        self.run_batch = run_batch
+        self.stop = stop
 
-    def start_timer(self, milliseconds: int) -> None:
-        """Measures time)))"""
-        self.start(milliseconds)
-
-
-class FileForDownloading:
-    @staticmethod
-    def _build_location(path: str, filename: str) -> str:
-        """Concatenates path to folder and filename together."""
-        location = os.path.join(path, filename)
-        return location
-
-    @staticmethod
-    def _rebuild_path(path: str) -> str:
-        """Replace all '/' symbols,
-        so path to folder and filename
-        can be concatenated through os.path.join."""
-        new_path = path.replace('/', '\\')
-        return new_path
+    def run(self) -> None:
+        errors = []
+        try:
+            errors = self.run_batch()
+        finally:
+            self.batch_finished.emit(self, errors)
 
 
-class Audio(FileForDownloading):
-    """Class for downloading and converting mp4 files with no frames
-    to mp3 files."""
+class ParallelDownloader(engine.ParallelDownloader):
+    """The engine's ParallelDownloader with the
+    options the window does not ask for taken from the settings."""
+    # the links are typed one per line
+    separator = '\n'
 
-    def __init__(self, audio_file: Stream, path: str) -> None:
-        self.audio = audio_file
-        self.path = self._rebuild_path(path)
-        self.filename = audio_file.default_filename
-        self.mp4_location = self._build_location(self.path, self.filename)
+    def __init__(self, queries: str, options: dict) -> None:
+        options.setdefault('pages', Settings().get_option('PageLookahead', DEFAULT_PAGE_LOOKAHEAD))
+        super().__init__(queries, options, get_pool(), get_store())
 
-    def download_file(self):
-        """General function to handle
-        file downloading."""
-        self._save_as_mp4()
-        self._save_as_mp3()
-
-    def _save_as_mp4(self):
-        """Save file on the disk in mp4 format,
-        so it can be converted to mp3 later."""
-        self.audio.download(self.path)
-
-    def _save_as_mp3(self) -> None:
-        """General function to handle conversion
-        to mp3 and saving process."""
-        if self._check_existence():
-            self._convert_and_write()
-            self._remove_mp4()
-
-    def _convert_and_write(self):
-        """Convert the mp4 file with no frames to mp3,
-        write the audio file to the same folder."""
-        ts = time()
-        audio = AudioFileClip(self.mp4_location)
-        audio.write_audiofile(self._build_mp3_path(),)
-        print(time()-ts)
-
-    def _remove_mp4(self):
-        """Remove the mp4 file with no frames
-        after conversion."""
-        os.remove(self.mp4_location)
-
-    def _check_existence(self) -> bool:
-        """Check if the file to convert exists,
-        and the file that should be created does not.
-        :raises: FileExistError, if the mp3 file, with the
-        designated name already exists in the directory
-        with the mp4 file
-        :raises: FileNotFoundError, if the path to
-        the mp4 file does not actually lead to a file.
-        (should never happen, as the path was checked previously)"""
-        mp3_file = self._build_mp3_path()
-        if os.path.exists(self.mp4_location) and not os.path.exists(mp3_file):
-            return True
-        elif os.path.exists(mp3_file):
-            os.remove(self.mp4_location)
-            mp3_filename = mp3_file.rsplit('\\', maxsplit=1)[1]
-            raise FileExistsError(mp3_filename, self.path)
-        else:
-            print(self.path)
-            raise FileNotFoundError(self.path)
-
-    def _build_mp3_path(self) -> str:
-        """Build the path where mp3 file
-        is going to be saved."""
-        mp3_location = self.mp4_location.rsplit('.', maxsplit=1)[0] + '.mp3'
-        return mp3_location
-
-
-class Video(FileForDownloading):
-    """Class for downloading videos."""
-
-    def __init__(self, video_file: YouTube, path: str, resolution: str):
-        self.video = video_file
-        self.path = self._rebuild_path(path)
-        self.resolution = resolution
-        self.errors = []
-
-    def download_file(self) -> None:
-        """General function to handle downloading process.
-        :raises: InvalidResolution, if the requested video
-        does not have the resolution user provided.
-        (the exception is not raised immediately in order to finish
-        downloading process(with the highest resolution possible))"""
-        video = self._check_resolution()
-        if not video:
-            video = self._get_in_highest_resolution()
-        video.download(self.path)
-        if self.errors:
-            raise self.errors.pop()
-
-    def _check_resolution(self) -> [YouTube, None]:
-        """Check if the user provided a specific
-        resolution and the requested video has that resolution.
-        :returns: Stream, if the requested video has provided resolution"""
-        if self.resolution:
-            if not (video := self.video.streams.get_by_resolution('resolution')):
-                return video
-            else:
-                self.errors.append(InvalidResolution)
-
-    def _get_in_highest_resolution(self) -> Stream:
-        """Get the Stream with the highest resolution."""
-        return self.video.streams.get_highest_resolution()
-
-
-class Downloader(Thread):
-    """A thread to download files,
-    that are of pytube.YouTube or pytube.Stream
-    type, and that are added to the queue"""
-    def __init__(self, queue: Queue, errors: list, progress: int):
-        """Create a new thread.
-        :param queue: queue.Queue instance, can be
-                    empty. The process will start
-                    as soon as something appears in the queue.
-        :param errors: a list to which errors that may
-                    occur during the downloading process are
-                    added.
-        :param progress: int that tells how much progress
-                    should be added to the progress bar
-                    after finishing the task."""
-        Thread.__init__(self)
-        self.queue = queue
-        self.errors = errors
-        self.progress = progress
-
-    def run(self):
-        """Run the thread. If the queue is empty,
-        the thread will be running anyways, waiting
-        for something to appear in the queue."""
-        while True:
+    def download_all(self) -> list:
+        """Download the videos, write the report
+        of the batch to the metrics file, if it is set."""
+        errors = super().download_all()
+        if location := Settings().get_option('MetricsFile'):
             try:
-                self.download_file(self.queue.get())
-            except (FileNotFoundError, FileExistsError, URLError,
-                    RegexMatchError, VideoUnavailable, InvalidResolution) as e:
-                self.errors.append(e)
-            finally:
-                current_progress = downloading_progress.get_current_progress
-                downloading_progress.quick_progress(current_progress,
-                                                    current_progress + self.progress,
-                                                    1, 1000)
-                self.queue.task_done()
+                dump_json(self.batch.get_report(), location)
+            except OSError:
+                pass  # the report is optional, downloading succeeded anyway
+        return errors
 
-    @staticmethod
-    def download_file(download_options: tuple):
-        f_type, path, file, options = download_options
-        if f_type == 'audio':
-            file = file.streams.get_audio_only()
-            Audio(file, path).download_file()
-        else:
-            Video(file, path, options).download_file()
-
-
-class ParallelDownloader:
-    """Class for downloading multiple
-    file at once using threading."""
-    def __init__(self, queries: str, options: dict):
-        """Initialize the downloader.
-        :param queries: a string containing urls
-        that lead to YouTube videos, separated one
-        from another by line breaks."""
-        self.errors = []
-        self.requested_videos = queries.split('\n')
-        self.options = options
-        self.requested_type = self.options.get('type')
-        self.path = self._get_path(self.requested_type)
-        self.queue = Queue()
-
-    def download_all(self):
-        """Download all videos links to
-        which were given when initializing the object."""
-        ts = time()
-        if self.errors:
-            return self.errors
-        for i in range(len(self.requested_videos)):
-            self.start_thread()
-        self._build_queue()
-        print(time() - ts)
-        return self.errors
-
-    def _build_queue(self):
-        """Add task to queue, so active
-        threads can start working with it's contains."""
-        for i in self.get_videos():
-            self.queue.put((self.requested_type, self.path, i,
-                            self.options.get('preferred_resolution', None)))
-        downloading_progress.quick_progress(11, 21, 1, 1000)
-        downloading_progress.set_label_text('Receiving and saving...')
-        self.queue.join()
-
-    def start_thread(self):
-        """Start a thread that will download videos
-        util the queue is empty."""
-        a = Downloader(self.queue, self.errors, 70//len(self.requested_videos))
-        a.daemon = True
-        a.start()
-
-    def get_videos(self):
-        """Get YouTube instances of requested files."""
-        for i in self.requested_videos:
-            yield YouTube(i)
-
-    def _get_path(self, for_type: Literal['audio', 'video']) -> str:
-        """Check the if there user provided a
-        custom downloading path. If he did, the path
-        will be checked in order to make sure it exists.
-        If he did not, default path for downloading the
-        designated file type will be used."""
-        if path := self._check_custom_path():
-            return path
-        else:
-            return Settings().get_path_for(for_type)
-
-    def _check_custom_path(self):
-        """Check if a custom path is provide
-        and if it is real.
-        :returns: None, if the custom path is not provided.
-        :returns: str, if it is and it's valid.
-        :raises: FileNotFoundError, if it is and it's invalid."""
-        if not (location := self.options.get('custom_download_path')):
-            return None
-        if not os.path.isdir(location):
-            self.errors.append(FileNotFoundError(location))
-            return None
-        else:
-            return location
+    def _get_default_path(self) -> str:
+        """Get the folder set for the requested file type."""
+        return Settings().get_path_for(self.requested_type)
 
 
 class MainApp(QMainWindow):
@@ -656,6 +594,16 @@ class MainApp(QMainWindow):
         self.setStyleSheet("""QCheckBox#only_audio:checked
                                       {font-size: 10px; color: green;}""")
 
+        self.native_audio = QCheckBox(self)
+        self.native_audio.setText('Keep original format')
+        self.native_audio.setFont(QFont('Century Gothic', 12, QFont.Normal))
+        self.native_audio.setGeometry(QRect(330, 230, 260, 30))
+
+        self.segmented = QCheckBox(self)
+        self.segmented.setText('Use several connections for big files')
+        self.segmented.setFont(QFont('Century Gothic', 12, QFont.Normal))
+        self.segmented.setGeometry(QRect(20, 355, 500, 30))
+
         self.pref_resolution = LineEdit(self, QRect(330, 275, 150, 30), 'Resolution')
 
         self.custom_download_location = LineEdit(self, QRect(340, 315, 150, 30), 'Location')
@@ -668,6 +616,7 @@ class MainApp(QMainWindow):
         self.settings_window = SettingsWindow()
         self.downloading_progress = CircularProgressBar()
         self.warning_dialog = WarningDialog(self)
+        self.batch_workers = []
 
     def _reload_and_show_settings(self):
         """Reloads the settings window
@@ -678,20 +627,87 @@ class MainApp(QMainWindow):
 
     def download_file(self):
         """General function for downloading
-        any video/audio files."""
+        any video/audio files. The files are downloaded
+        in the background, so more links can be given
+        while they are."""
         try:
-            downloading_progress.show()
+            self._start_progress()
             downloading_progress.set_label_text('Defining query options...')
-            a = ParallelDownloader(*self._build_data_package()).download_all()
-            for i in a:
-                WarningDialog(self).show_warning(i)
+            downloader = ParallelDownloader(*self._build_data_package())
         finally:
             self.restore_default_inputs()
-            downloading_progress.quick_progress(91, 101, 1, 1000)
+        self._start_batch(lambda: downloader.download_all() + downloader.warnings,
+                          downloader.stop)
+
+    def _start_batch(self, run_batch: Callable[[], list],
+                     stop: Callable[[], None] = None) -> None:
+        """Run the batch in a BatchWorker thread."""
+        worker = BatchWorker(run_batch, stop)
+        worker.batch_finished.connect(self._finish_batch)
+        self.batch_workers.append(worker)
+        worker.start()
+
+    def _finish_batch(self, worker: BatchWorker, errors: list) -> None:
+        """Show the errors and the warnings of a finished batch, close
+        the progress bar if it was the last one running."""
+        worker.wait()
+        self.batch_workers.remove(worker)
+        for error, link in errors:
+            WarningDialog(self).show_warning(error, link)
+        if not self.batch_workers:
+            downloading_progress.stop_following()
+            downloading_progress.set_progress(100)
             downloading_progress.set_label_text('Done!')
-            sleep(0.5)
+            QTimer.singleShot(500, self._close_progress)
+
+    def _start_progress(self) -> None:
+        """Show the progress bar, unless
+        it is already showing the running batches."""
+        if not self.batch_workers:
+            downloading_progress.show()
+            downloading_progress.follow_progress()
+
+    def _close_progress(self) -> None:
+        """Close the progress bar, unless
+        another batch was started meanwhile."""
+        if not self.batch_workers:
             downloading_progress.close()
 
+    def wait_for_batches(self) -> None:
+        """Block until the running batches are finished."""
+        for worker in list(self.batch_workers):
+            worker.wait()
+
+    def cancel_batches(self) -> None:
+        """Stop the running batches on quit: no more jobs are
+        submitted, the queued ones are cancelled (and left in the
+        job store to be resumed), only the ones being resolved,
+        downloaded or converted are waited for."""
+        for worker in self.batch_workers:
+            if worker.stop is not None:
+                worker.stop()
+        shutdown_pool(cancel=True)
+        self.wait_for_batches()
+
+    def resume_unfinished(self):
+        """Download the jobs a previous session
+        recorded in the job store but did not finish."""
+        if (store := get_store()) is None:
+            return
+        store.clear_finished()
+        if not (jobs := store.get_unfinished()):
+            return
+        self._start_progress()
+        downloading_progress.set_label_text(f'Resuming {len(jobs)} job(s)...')
+        self._start_batch(partial(self._resume, store, jobs))
+
+    @staticmethod
+    def _resume(store: JobStore, jobs: list) -> list:
+        """Run the resumed jobs in a batch.
+        :returns: the errors and the warnings of the batch."""
+        batch = ParallelDownloader.resume(store, jobs, get_pool())
+        return batch.errors + batch.warnings
+
     def _build_data_package(self):
         """Gather all information user has provided
         before passing it to the ParallelDownloader."""
@@ -699,11 +715,20 @@ class MainApp(QMainWindow):
         options = {}
         if self.only_audio.isChecked():
             options['type'] = 'audio'
+            options['transcode'] = Settings().get_option('Transcode', 'stream')
+            options['format'] = 'native' if self.native_audio.isChecked() else 'mp3'
         else:
             options['type'] = 'video'
-        options['custom_download_path'] = self.custom_download_location.text()
+        options['to'] = self.custom_download_location.text()
         options['preferred_resolution'] = self.pref_resolution.text()
-        downloading_progress.quick_progress(0, 11, 1, 1000)
+        if self.segmented.isChecked():
+            options['segments'] = Settings().get_option('Segments', DEFAULT_SEGMENTS)
+        options['joblimit'] = get_rate_option('JobBandwidthLimit')
+        options['bitrate'] = get_rate_option('MaxBitrate', parse_bitrate)
+        options['maxsize'] = get_rate_option('MaxFileSize')
+        options['schedule'] = Settings().get_option('Schedule', DEFAULT_POLICY)
+        options['adaptive'] = 'on' if Settings().get_option('Adaptive', False) else 'off'
+        options['diskcheck'] = Settings().get_option('DiskCheck', DEFAULT_CHECK)
         downloading_progress.set_label_text('Making requests...')
         return query, options
 
@@ -712,6 +737,8 @@ class MainApp(QMainWindow):
         empty/unchecked."""
         self.custom_download_location.setText('')
         self.only_audio.setChecked(False)
+        self.segmented.setChecked(False)
+        self.native_audio.setChecked(False)
         self.pref_resolution.setText('')
         self.vid_url.setText('')
 
@@ -719,6 +746,13 @@ class MainApp(QMainWindow):
 if __name__ == '__main__':
     app = QApplication(sys.argv)
     downloading_progress = CircularProgressBar()
+    if metrics_port := Settings().get_option('MetricsPort'):
+        serve_metrics(metrics_port)
+    set_preallocation(Settings().get_option('Preallocate', False))
     window = MainApp()
+    # the running batches may still be submitting jobs to the pool
+    app.aboutToQuit.connect(window.cancel_batches)
+    app.aboutToQuit.connect(close_store)
     window.show()
+    QTimer.singleShot(0, window.resume_unfinished)
     sys.exit(app.exec_())
@@ -1,285 +1,82 @@
 import os
-from collections import namedtuple
+import re
+import sys
 from typing import Callable
 from urllib.error import URLError
-from queue import Queue
-from threading import Thread
-
-from pytube import YouTube
-from pytube.streams import Stream
-from pytube.exceptions import RegexMatchError, VideoUnavailable
-
-from moviepy.editor import AudioFileClip
-
-
-class InvalidResolution(AttributeError):
-    ...
-
-
-exception_messages = {FileExistsError:
-                          'File with the name "{}" already exists in "{}"',
-                      URLError:
-                          'The app could not establish internet connection. '
-                          'Please check your network settings, ensure that '
-                          'you have internet and try again.'
-                          'If it did not help, contact me at defender0508@gmail.com',
-                      FileNotFoundError:
-                          'Location "{}" does not exist.',
-                      RegexMatchError:
-                          'The link "{}" does not lead anywhere. '
-                          'It was excluded from the request.',
-                      VideoUnavailable:
-                          'The video "{}" either '
-                          'does not exist or unavailable for some reason. '
-                          'It was excluded from the request.',
-                      InvalidResolution:
-                          'The video you chose to download does not have '
-                          'resolution you have given. The video was downloaded '
-                          'with the highest resolution possible.'
-                      }
-
-
-class FileForDownloading:
-    @staticmethod
-    def _build_location(path: str, filename: str) -> str:
-        """Concatenates path to folder and filename together."""
-        location = os.path.join(path, filename)
-        return location
-
-    @staticmethod
-    def _rebuild_path(path: str) -> str:
-        """Replace all '/' symbols,
-        so path to folder and filename
-        can be concatenated through os.path.join."""
-        new_path = path.replace('/', '\\')
-        return new_path
-
-
-class Audio(FileForDownloading):
-    """Class for downloading and converting mp4 files with no frames
-    to mp3 files."""
-
-    def __init__(self, audio_file: Stream, path: str) -> None:
-        self.audio = audio_file
-        self.path = self._rebuild_path(path)
-        self.filename = audio_file.default_filename
-        self.mp4_location = self._build_location(self.path, self.filename)
-
-    def download_file(self) -> None:
-        """General function to handle
-        file downloading."""
-        self._save_as_mp4()
-        self._save_as_mp3()
-
-    def _save_as_mp4(self) -> None:
-        """Save file on the disk in mp4 format,
-        so it can be converted to mp3 later."""
-        self.audio.download(self.path)
-
-    def _save_as_mp3(self) -> None:
-        """General function to handle conversion
-        to mp3 and saving process."""
-        if self._check_existence():
-            self._convert_and_write()
-            self._remove_mp4()
-
-    def _convert_and_write(self) -> None:
-        """Convert the mp4 file with no frames to mp3,
-        write the audio file to the same folder."""
-        audio = AudioFileClip(self.mp4_location)
-        audio.write_audiofile(self._build_mp3_path(), )
-
-    def _remove_mp4(self) -> None:
-        """Remove the mp4 file with no frames
-        after conversion."""
-        os.remove(self.mp4_location)
-
-    def _check_existence(self) -> bool:
-        """Check if the file to convert exists,
-        and the file that should be created does not.
-        :raises: FileExistError, if the mp3 file, with the
-        designated name already exists in the directory
-        with the mp4 file
-        :raises: FileNotFoundError, if the path to
-        the mp4 file does not actually lead to a file.
-        (should never happen, as the path was checked previously)"""
-        mp3_file = self._build_mp3_path()
-        if os.path.exists(self.mp4_location) and not os.path.exists(mp3_file):
-            return True
-        elif os.path.exists(mp3_file):
-            os.remove(self.mp4_location)
-            mp3_filename = mp3_file.rsplit('\\', maxsplit=1)[1]
-            raise FileExistsError(mp3_filename, self.path)
-        else:
-            print(self.path)
-            raise FileNotFoundError(self.path)
-
-    def _build_mp3_path(self) -> str:
-        """Build the path where mp3 file
-        is going to be saved."""
-        mp3_location = self.mp4_location.rsplit('.', maxsplit=1)[0] + '.mp3'
-        return mp3_location
-
-
-class Video(FileForDownloading):
-    """Class for downloading videos."""
-
-    def __init__(self, video_file: YouTube, path: str, resolution: str) -> None:
-        self.video = video_file
-        self.path = self._rebuild_path(path)
-        self.resolution = resolution
-        self.errors = []
-
-    def download_file(self) -> None:
-        """General function to handle downloading process.
-        :raises: InvalidResolution, if the requested video
-        does not have the resolution user provided.
-        (the exception is not raised immediately in order to finish
-        downloading process(with the highest resolution possible))"""
-        video = self._check_resolution()
-        if not video:
-            video = self._get_in_highest_resolution()
-        video.download(self.path)
-        if self.errors:
-            raise self.errors.pop()
-
-    def _check_resolution(self) -> [YouTube, None]:
-        """Check if the user provided a specific
-        resolution and the requested video has that resolution.
-        :returns: Stream, if the requested video has provided resolution"""
-        if self.resolution:
-            if not (video := self.video.streams.get_by_resolution('resolution')):
-                return video
-            else:
-                self.errors.append((InvalidResolution, self.resolution))
-
-    def _get_in_highest_resolution(self) -> Stream:
-        """Get the Stream with the highest resolution."""
-        return self.video.streams.get_highest_resolution()
-
-
-class Downloader(Thread):
-    """A thread to download files,
-    that are of pytube.YouTube or pytube.Stream
-    type, and that are added to the queue"""
-
-    def __init__(self, queue: Queue, errors: list, progress: int) -> None:
-        """Create a new thread.
-        :param queue: queue.Queue instance, can be
-                    empty. The process will start
-                    as soon as something appears in the queue.
-        :param errors: a list to which errors that may
-                    occur during the downloading process are
-                    added.
-        :param progress: int that tells how much progress
-                    should be added to the progress bar
-                    after finishing the task."""
-        Thread.__init__(self)
-        self.queue = queue
-        self.errors = errors
-        self.progress = progress
-
-    def run(self) -> None:
-        """Run the thread. If the queue is empty,
-        the thread will be running anyways, waiting
-        for something to appear in the queue."""
-        data_form = namedtuple('Data', 'f_type path file url options')
-        while True:
-            options = data_form(*self.queue.get())
-            try:
-                self.download_file(options)
-            except (FileNotFoundError, FileExistsError, URLError,
-                    RegexMatchError, VideoUnavailable, InvalidResolution) as e:
-                self.errors.append((e.__class__, options.url))
-            finally:
-                self.queue.task_done()
-
-    @staticmethod
-    def download_file(download_options: tuple) -> None:
-        f_type, path, file, url, options = download_options
-        if f_type == 'audio':
-            file = file.streams.get_audio_only()
-            Audio(file, path).download_file()
-        else:
-            Video(file, path, options).download_file()
-
-
-class ParallelDownloader:
-    """Class for downloading multiple
-    file at once using threading."""
-
-    def __init__(self, queries: str, options: dict) -> None:
-        """Initialize the downloader.
-        :param queries: a string containing urls
-        that lead to YouTube videos, separated one
-        from another by line breaks."""
-        self.errors = []
-        self.requested_videos = queries.split(', ')
-        self.options = options
-        self.requested_type = self.options.get('type')
-        self.path = self._get_path()
-        self.queue = Queue()
-
-    def download_all(self) -> list:
-        """Download all videos links to
-        which were given when initializing the object."""
-        if self.errors:
-            return self.errors
-        for i in range(len(self.requested_videos)):
-            self.start_thread()
-        self._build_queue()
-        return self.errors
-
-    def _build_queue(self) -> None:
-        """Add task to queue, so active
-        threads can start working with it's contains."""
-        for item, url in self.get_videos():
-            self.queue.put((self.requested_type, self.path, item, url,
-                            self.options.get('preferred_resolution', None)))
-        self.queue.join()
-
-    def start_thread(self) -> None:
-        """Start a thread that will download videos
-        util the queue is empty."""
-        a = Downloader(self.queue, self.errors, 70 // len(self.requested_videos))
-        a.daemon = True
-        a.start()
-
-    def get_videos(self) -> tuple[YouTube, str]:
-        """Get YouTube instances of requested files."""
-        for i in self.requested_videos:
-            try:
-                yield YouTube(i), i
-            except RegexMatchError:
-                self.errors.append((RegexMatchError, i))
-
-    def _get_path(self) -> str:
-        """Check the if there user provided a
-        custom downloading path. If he did, the path
-        will be checked in order to make sure it exists.
-        If he did not, default path for downloading the
-        designated file type will be used."""
-        if path := self._check_custom_path():
-            return path
-        else:
-            return os.path.curdir
-
-    def _check_custom_path(self) -> [None, str]:
-        """Check if a custom path is provide
-        and if it is real.
-        :returns: None, if the custom path is not provided.
-        :returns: str, if it is and it's valid.
-        :raises: FileNotFoundError, if it is and it's invalid."""
-        if not (location := self.options.get('to')):
-            return None
-        if not os.path.isdir(location):
-            self.errors.append((FileNotFoundError, location))
-            return None
-        else:
-            return location
+
+from bandwidth import parse_rate, set_limit
+from disk_space import NotEnoughSpace, set_preallocation, CHECKS, DEFAULT_CHECK
+from progress import ProgressSummary, get_bus
+from metrics import serve_metrics, dump_json
+from stream_selection import parse_resolution, parse_bitrate
+from scheduling import POLICIES, DEFAULT_POLICY
+from links import read_links
+from expansion import DEFAULT_PAGE_LOOKAHEAD
+from job_store import JobStore, DEFAULT_STORE_LOCATION
+from transcoding import ConversionError
+from engine import (ParallelDownloader, AsyncParallelDownloader, InvalidResolution,
+                    get_pool, shutdown_pool, DEFAULT_WORKERS, DEFAULT_LOOKAHEAD,
+                    DEFAULT_CONCURRENCY)
+
+
+def get_exception_messages() -> dict:
+    """Get the messages handle_exception prints,
+    by the type of the exception."""
+    from pytube.exceptions import RegexMatchError, VideoUnavailable
+    return {FileExistsError:
+                'The file of "{}" already exists in the target folder. '
+                'It was not downloaded again.',
+            URLError:
+                'The app could not establish internet connection. '
+                'Please check your network settings, ensure that '
+                'you have internet and try again.'
+                'If it did not help, contact me at defender0508@gmail.com',
+            FileNotFoundError:
+                'Location "{}" does not exist.',
+            RegexMatchError:
+                'The link "{}" does not lead anywhere. '
+                'It was excluded from the request.',
+            VideoUnavailable:
+                'The video "{}" either '
+                'does not exist or unavailable for some reason. '
+                'It was excluded from the request.',
+            InvalidResolution:
+                'The video "{}" does not have a stream of the resolution '
+                '(or within the limits) you have given. It was downloaded '
+                'in the closest one, the -metrics report names it.',
+            ConversionError:
+                'The file of "{}" could not be converted or muxed.',
+            NotEnoughSpace:
+                'There is not enough free space on the disk for "{}". '
+                'It was not downloaded.',
+            Exception:
+                'The link "{}" could not be downloaded '
+                'because of an unexpected error.'
+            }
+
+
+_store = None
+
+
+def get_store() -> JobStore:
+    """Get the process-wide JobStore,
+    open it on the first call."""
+    global _store
+    if _store is None:
+        _store = JobStore(DEFAULT_STORE_LOCATION)
+    return _store
+
+
+def close_store() -> None:
+    """Close the process-wide JobStore, if it was opened."""
+    global _store
+    if _store is not None:
+        _store.close()
+        _store = None
 
 
 def get_help() -> str:
+    from connection_pool import DEFAULT_PER_HOST, DEFAULT_KEEP_ALIVE
     return f"""The download command syntax:
     Optional arguments (in the order they 
     should be described in your requests): 
@@ -295,40 +92,293 @@ def get_help() -> str:
             you are downloading audio. 
             Note that you should put full resolution,
             as it described on YouTube (e.g. 720p or 
-            2160p60, not 720 or 2160.)
+            2160p60, not 720 or 2160.) If the video 
+            does not have it, the closest lower one 
+            is downloaded (the lowest one, if nothing 
+            is lower), and the -metrics report names 
+            the stream that was chosen.
             Default value: highest resolution, the 
             requested video has.
+        -adaptive:
+            on to download the video without sound 
+            and the audio separately, at the same 
+            time, and mux them into one mp4 file with 
+            no re-encoding. Videos have resolutions 
+            above 720p only this way.
+            Default value: off
+        -fps:
+            the highest frame rate of the video, 
+            e.g. 30 to skip 60fps streams.
+            Default value: any
+        -bitrate:
+            the highest bitrate of the video, in bits 
+            per second, K, M and G suffixes can be 
+            used (e.g. 1500K), they are decimal.
+            Default value: any
+        -maxsize:
+            the biggest file a video may be, in bytes, 
+            with the same suffixes (e.g. 200M). The 
+            best stream that is not bigger is chosen.
+            Default value: any
         -to:
             relative or absolute path to a folder 
             on your device, to which you want to
             download file.
             Default value: current directory ({os.getcwd()})
+        -workers:
+            the amount of threads downloading files 
+            at the same time. The threads are shared 
+            by all the following commands, so the 
+            value is kept until it is changed again.
+            Default value: {DEFAULT_WORKERS}
+        -lookahead:
+            the amount of links resolved (turned into 
+            stream lists) ahead of downloading, so the 
+            downloading threads never wait for them. 
+            It is also the amount of resolved files 
+            -schedule chooses the next one from. 
+            Kept for the following commands as well.
+            Default value: {DEFAULT_LOOKAHEAD}
+        -pages:
+            the amount of pages of a playlist or a 
+            channel (up to 100 videos each) listed 
+            ahead of downloading. Videos start being 
+            downloaded after the first page, and at 
+            most this amount of pages is kept waiting.
+            Default value: {DEFAULT_PAGE_LOOKAHEAD}
+        -segments:
+            download every big file (16 MB or more) 
+            in byte ranges over up to this amount of 
+            connections at once. The amount grows 
+            while it makes downloading faster.
+            Default value: 1 (a single connection)
+        -transcode:
+            how audio is converted to mp3. stream 
+            converts it while downloading, without 
+            writing an mp4 file; file downloads the 
+            mp4 first (it can then be resumed if the 
+            download is interrupted) and converts it after.
+            Default value: stream
+        -format:
+            the format audio is saved in. mp3 re-encodes 
+            it; native saves the audio stream as it is 
+            (.m4a) and opus copies the opus stream into 
+            an .opus file, both without re-encoding.
+            Default value: mp3
+        -cache:
+            on to reuse the stream lists of videos 
+            resolved recently (they are kept in the 
+            stream_cache folder until their links 
+            expire), off to always request them again.
+            Default value: on
+        -store:
+            on to record the jobs in {DEFAULT_STORE_LOCATION}, 
+            so the ones that were not finished (if the 
+            program was closed or crashed) are downloaded 
+            again the next time it starts.
+            Default value: off
+        -engine:
+            thread runs the jobs on the shared pool of 
+            downloading threads; async runs every job as 
+            a coroutine on one event loop, which suits 
+            big batches of short videos. With async, 
+            -workers is the amount of files downloaded 
+            at once (default {DEFAULT_CONCURRENCY}), -lookahead 
+            the amount of threads resolving links, and 
+            they are not kept for the following commands.
+            Default value: thread
+        -connections:
+            the maximum amount of connections to one 
+            host used at once. Connections are kept 
+            open and shared by all the downloads, so 
+            they are not opened again for every request. 
+            Kept for the following commands as well.
+            Default value: {DEFAULT_PER_HOST}
+        -keepalive:
+            how many seconds an unused connection is 
+            kept open, 0 closes every connection after 
+            its request. Kept for the following commands.
+            Default value: {DEFAULT_KEEP_ALIVE}
+        -limit:
+            the bandwidth all the downloads may use 
+            together, in bytes per second, K, M and G 
+            suffixes can be used (e.g. 20M); 0 removes 
+            the limit. Kept for the following commands.
+            Default value: 0 (no limit)
+        -joblimit:
+            the bandwidth one file may use, in the 
+            same units as -limit.
+            Default value: 0 (no limit)
+        -diskcheck:
+            what to do when a file does not fit in 
+            the free space of the disk (with the files 
+            being downloaded at the same time): trim 
+            skips that file, refuse skips it and every 
+            file of the request that is not started 
+            yet, off does not check the space.
+            Default value: {DEFAULT_CHECK}
+        -preallocate:
+            on to allocate the whole file on the disk 
+            before downloading it, so big files are not 
+            fragmented (on spinning disks) and a full 
+            disk stops the download before it starts. 
+            Kept for the following commands as well.
+            Default value: off
+        -metrics:
+            a path to write the report of the request 
+            to after it is finished, as json: the time 
+            every file spent parsing, resolving, selecting 
+            the stream, downloading, converting and 
+            cleaning up, with the process-wide counters.
+        -metricsport:
+            serve the process-wide metrics in the 
+            Prometheus text format at 
+            http://127.0.0.1:<port>/metrics, until 
+            the program is closed.
+        -schedule:
+            the order files are downloaded in, once 
+            their sizes are known. fifo keeps the order 
+            of the links; lpt downloads the biggest 
+            files first, so the whole request finishes 
+            sooner; sjf the smallest ones first, so 
+            files are finished sooner on average.
+            Default value: {DEFAULT_POLICY}
+        -progress:
+            on to show a line with the downloaded part, 
+            the amount of finished files, the speed and 
+            the time left while downloading, off to 
+            print only the errors.
+            Default value: on
     Obligatory arguments:
         -links: 
             urls to YouTube videos you want to 
             download. You can provide as many as 
             you want, but it will increase the 
-            downloading time.
+            downloading time. Links to playlists 
+            (youtube.com/playlist?list=...) and channels 
+            (youtube.com/channel/..., /c/..., /user/...) 
+            download all of their videos.
+        -links-file:
+            instead of -links, a path to a text file 
+            with the links, one per line, or - to 
+            read them from the standard input. The 
+            links are read only as fast as they are 
+            downloaded, so the file may be of any size.
     
     Examples of using the 'download' command:
         download -type audio -resolution 720p -links https://youtu.be/video, https://youtu.be/another_video
-        download -links https://youtu.be/video"""
+        download -type audio -format native -links https://youtu.be/video
+        download -links https://youtu.be/video
+        download -type audio -pages 1 -links https://www.youtube.com/playlist?list=playlist
+        download -type audio -links-file links.txt
+    
+    A command can be given when starting the program 
+    as well, it exits after the command is done:
+        python YouTubeWormConsole.py download -links-file - < links.txt"""
 
 
 def handle_exception(exception) -> None:
     """Print an exception message,
     if the exception type is covered in
-    exception_messages dict.
+    get_exception_messages.
     :param exception: a tuple of two:
-        an exception type and optional information."""
-    print(exception_messages.get(exception[0]).format(exception[1]))
-
-
-def download(urls: str, options) -> None:
+        an exception and the link (or the location) it is about.
+        A subclass of a covered type, such as HTTPError,
+        gets the message of that type, any other
+        exception the one of an unexpected error."""
+    messages = get_exception_messages()
+    described = next(i for i in exception[0].__class__.__mro__ if i in messages)
+    print(messages[described].format(exception[1]))
+
+
+class ProgressLine:
+    """Subscriber of the ProgressBus keeping
+    one line with the progress of the request
+    up to date in the console."""
+
+    def __init__(self) -> None:
+        self.summary = ProgressSummary()
+        self._width = 0
+
+    def __call__(self, events: list) -> None:
+        self.summary.update(events)
+        line = self.summary.describe()
+        print('\r' + line.ljust(self._width), end='', flush=True)
+        self._width = len(line)
+
+    def __enter__(self) -> 'ProgressLine':
+        get_bus().subscribe(self)
+        return self
+
+    def __exit__(self, *args) -> None:
+        get_bus().flush()
+        get_bus().unsubscribe(self)
+        if self._width:
+            print()
+
+
+def download(urls: [str, None], options) -> None:
     """General function to handle
-    downloading process."""
-    a = ParallelDownloader(urls, options).download_all()
-    for i in a:
+    downloading process.
+    :param urls: the links given inline, None
+    if they are read from the -links-file."""
+    if (location := options.pop('links-file', None)) is not None:
+        if location != '-' and not os.path.isfile(location):
+            handle_exception((FileNotFoundError(location), location))
+            return
+        urls = read_links(location)
+    from connection_pool import get_connection_pool
+    get_connection_pool(options.pop('connections', None), options.pop('keepalive', None))
+    if (limit := options.pop('limit', None)) is not None:
+        set_limit(limit)
+    if (preallocation := options.pop('preallocate', None)) is not None:
+        set_preallocation(preallocation == 'on')
+    workers, lookahead = options.pop('workers', None), options.pop('lookahead', None)
+    store = get_store() if options.pop('store', 'off') == 'on' else None
+    show_progress = options.pop('progress', 'on') == 'on'
+    report = options.pop('metrics', None)
+    if (port := options.pop('metricsport', None)) is not None:
+        try:
+            serve_metrics(port)
+        except OSError as e:
+            print(f'The metrics could not be served on port {port}: {e.strerror}')
+    if options.pop('engine', 'thread') == 'async':
+        downloader = AsyncParallelDownloader(urls, options, store,
+                                             workers or DEFAULT_CONCURRENCY,
+                                             lookahead or DEFAULT_LOOKAHEAD)
+    else:
+        downloader = ParallelDownloader(urls, options, get_pool(workers, lookahead), store)
+    if show_progress:
+        with ProgressLine():
+            a = downloader.download_all()
+    else:
+        a = downloader.download_all()
+    for i in a + downloader.warnings:
+        handle_exception(i)
+    if summary := downloader.batch.get_timings_summary():
+        print(summary)
+    if report:
+        try:
+            dump_json(downloader.batch.get_report(), report)
+        except OSError as e:
+            print(f'The metrics could not be written to "{report}": {e.strerror}')
+
+
+def resume_unfinished() -> None:
+    """Download the jobs a previous session
+    recorded in the job store but did not finish."""
+    if not os.path.isfile(DEFAULT_STORE_LOCATION):
+        return
+    store = get_store()
+    store.clear_finished()
+    if not (jobs := store.get_unfinished()):
+        return
+    print(f'Resuming {len(jobs)} unfinished job(s) of the previous session...')
+    from connection_pool import get_connection_pool
+    get_connection_pool()
+    with ProgressLine():
+        batch = ParallelDownloader.resume(store, jobs)
+    for i in batch.errors + batch.warnings:
         handle_exception(i)
 
 
@@ -340,7 +390,9 @@ def inspect_parameters(options: str) -> tuple[str, dict]:
         provided in a wrong way.
     :returns: tuple of two: a string, containing
     video urls, and a dict with other parameters."""
-    options = options.split('-')[1:]
+    # only a dash after a space starts a parameter,
+    # video ids and paths may contain dashes as well
+    options = re.split(r'(?:^|\s)-(?=[a-z])', options)[1:]
     params = {}
     for i in options:
         try:
@@ -359,15 +411,59 @@ def check_parameters(parameters: dict) -> tuple[str, dict]:
     :raises: SyntaxError, if there user have not
     provided any video urls.
     :returns: tuple of two: a string, containing
-    video urls, and a dict with other parameters."""
-    default_values = {'type': 'video', 'resolution': None, 'to': os.curdir}
+    video urls (None, if they are read from a
+    -links-file), and a dict with other parameters."""
+    default_values = {'type': 'video', 'to': os.curdir}
     for key, value in default_values.items():
         if key not in parameters.keys():
             parameters[key] = value
-    if (links := parameters.get('links')) is None:
+    links = parameters.pop('links', None)
+    if links is None and 'links-file' not in parameters:
         raise SyntaxError('Syntax Error: '
                           'You have not provided any video urls to download.')
-    parameters.pop('links')
+    if links is not None and 'links-file' in parameters:
+        raise SyntaxError('Syntax Error: -links and -links-file can not be used together.')
+    if (value := parameters.pop('resolution', None)) is not None:
+        try:
+            parse_resolution(value)
+        except ValueError:
+            raise SyntaxError(f'Syntax Error: "{value}" is not a valid resolution.')
+        parameters['preferred_resolution'] = value
+    for key in ('workers', 'lookahead', 'segments', 'connections', 'pages', 'fps'):
+        if (value := parameters.get(key)) is None:
+            continue
+        if not value.isdigit() or int(value) < 1:
+            raise SyntaxError(f'Syntax Error: "{value}" is not '
+                              f'a valid amount of {key}.')
+        parameters[key] = int(value)
+    if parameters.get('transcode', 'stream') not in ('stream', 'file'):
+        raise SyntaxError('Syntax Error: -transcode can be either stream or file.')
+    if parameters.get('format', 'mp3') not in ('mp3', 'native', 'opus'):
+        raise SyntaxError('Syntax Error: -format can be mp3, native or opus.')
+    for key in ('limit', 'joblimit', 'bitrate', 'maxsize'):
+        if (value := parameters.get(key)) is None:
+            continue
+        try:
+            parameters[key] = parse_bitrate(value) if key == 'bitrate' else parse_rate(value)
+        except ValueError:
+            raise SyntaxError(f'Syntax Error: "{value}" is not a valid amount for -{key}.')
+    if (value := parameters.get('metricsport')) is not None:
+        if not value.isdigit() or not 0 < int(value) < 65536:
+            raise SyntaxError(f'Syntax Error: "{value}" is not a valid port.')
+        parameters['metricsport'] = int(value)
+    if (value := parameters.get('keepalive')) is not None:
+        if not value.isdigit():
+            raise SyntaxError(f'Syntax Error: "{value}" is not a valid amount of seconds.')
+        parameters['keepalive'] = int(value)
+    if parameters.get('schedule', DEFAULT_POLICY) not in POLICIES:
+        raise SyntaxError(f'Syntax Error: -schedule can be {", ".join(POLICIES)}.')
+    if parameters.get('engine', 'thread') not in ('thread', 'async'):
+        raise SyntaxError('Syntax Error: -engine can be either thread or async.')
+    if parameters.get('diskcheck', DEFAULT_CHECK) not in CHECKS:
+        raise SyntaxError(f'Syntax Error: -diskcheck can be {", ".join(CHECKS)}.')
+    for key in ('cache', 'store', 'progress', 'preallocate', 'adaptive'):
+        if parameters.get(key, 'on') not in ('on', 'off'):
+            raise SyntaxError(f'Syntax Error: -{key} can be either on or off.')
     return links, parameters
 
 
@@ -405,10 +501,34 @@ def read_command(cmd: str) -> None:
 
 
 if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        try:
+            full_command = ' '.join(sys.argv[1:])
+            if full_command.strip() == 'help':
+                print(get_help())
+            else:
+                read_command(full_command)
+        except KeyboardInterrupt:
+            print()
+            shutdown_pool(cancel=True)
+        finally:
+            shutdown_pool()
+            close_store()
+        sys.exit()
     print("If you don't know what to do, type help.")
-    while True:
-        full_command = input('Enter command: ')
-        if full_command.strip() == 'help':
-            print(get_help())
-        else:
-            read_command(full_command)
+    try:
+        resume_unfinished()
+        while True:
+            full_command = input('Enter command: ')
+            if full_command.strip() == 'help':
+                print(get_help())
+            else:
+                read_command(full_command)
+    except KeyboardInterrupt:
+        print()
+        shutdown_pool(cancel=True)
+    except EOFError:
+        print()
+    finally:
+        shutdown_pool()
+        close_store()
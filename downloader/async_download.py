@@ -0,0 +1,396 @@
+import os
+import asyncio
+import ssl
+from urllib.error import URLError, HTTPError
+from time import monotonic
+from urllib.parse import urlsplit, urljoin
+
+from pytube.streams import Stream
+
+from resumable import CHUNK_SIZE, READ_SIZE, HEADERS, PartFile
+from segmented import SegmentedDownload, CHUNK_SIZE as SEGMENT_SIZE
+from bandwidth import Throttle
+from disk_space import preallocate, is_preallocating
+from progress import JobProgress
+from metrics import get_metrics
+from connection_pool import DEFAULT_PER_HOST, DEFAULT_KEEP_ALIVE
+from transcoding import ConversionError, build_mp3_encoder_command
+
+
+MAX_REDIRECTS = 5
+_ssl_context = None
+
+
+def _get_ssl_context() -> ssl.SSLContext:
+    """Get the SSL context shared by all the connections."""
+    global _ssl_context
+    if _ssl_context is None:
+        _ssl_context = ssl.create_default_context()
+    return _ssl_context
+
+
+async def _read_head(reader: asyncio.StreamReader, url: str) -> tuple[int, str, dict]:
+    """Read the status line and the headers of a response.
+    :returns: tuple of three: the status code, the reason
+    and the headers (their names in lower case)."""
+    if not (status_line := (await reader.readline()).decode('latin-1').rstrip()):
+        raise ConnectionResetError('the connection was closed by the server')
+    parts = status_line.split(' ', 2)
+    if len(parts) < 2 or not parts[1].isdigit():
+        raise URLError(f'malformed response from {urlsplit(url).hostname}: "{status_line}"')
+    headers = {}
+    while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    return int(parts[1]), parts[2] if len(parts) > 2 else '', headers
+
+
+async def _read_body(reader: asyncio.StreamReader, headers: dict, timeout: int):
+    """Yield the body of a response by pieces,
+    whether it has a length, is chunked or lasts
+    until the connection is closed."""
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        while size := int((await asyncio.wait_for(reader.readline(), timeout)).split(b';')[0], 16):
+            yield await asyncio.wait_for(reader.readexactly(size), timeout)
+            await reader.readline()
+        while (await asyncio.wait_for(reader.readline(), timeout)).strip():
+            pass  # the trailer
+        return
+    remaining = int(headers['content-length']) if 'content-length' in headers else None
+    while remaining is None or remaining > 0:
+        size = READ_SIZE if remaining is None else min(READ_SIZE, remaining)
+        if not (data := await asyncio.wait_for(reader.read(size), timeout)):
+            break
+        if remaining is not None:
+            remaining -= len(data)
+        yield data
+
+
+class AsyncConnectionPool:
+    """The coroutine counterpart of connection_pool.ConnectionPool:
+    the connections of one event loop are kept alive after
+    a request and reused by the next request to the same host.
+    At most max_per_host connections to one host are used
+    at once, the other requests wait for one of them."""
+
+    def __init__(self, max_per_host: int = DEFAULT_PER_HOST,
+                 keep_alive: int = DEFAULT_KEEP_ALIVE) -> None:
+        """Create the pool, it should be done
+        in the event loop it is used in."""
+        self.max_per_host = max_per_host
+        self.keep_alive = keep_alive
+        self._condition = asyncio.Condition()
+        self._idle = {}
+        self._busy = {}
+
+    async def acquire(self, key: tuple, timeout: int) -> tuple:
+        """Take an idle connection to the host or open a new
+        one, wait if there are max_per_host of them in use.
+        :param key: tuple of three: whether the connection is
+                    secure, the host and the port.
+        :returns: tuple of three: the reader, the writer and
+        whether the connection was used before."""
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._busy.get(key, 0) < self.max_per_host)
+            self._busy[key] = self._busy.get(key, 0) + 1
+            idle = self._idle.get(key, [])
+            while idle:
+                reader, writer, released_at = idle.pop()
+                if monotonic() - released_at <= self.keep_alive and not reader.at_eof():
+                    return reader, writer, True
+                writer.close()
+        try:
+            return (*await _connect(key, timeout), False)
+        except BaseException:
+            await self.release(key, None, None, False)
+            raise
+
+    async def release(self, key: tuple, reader: [asyncio.StreamReader, None],
+                      writer: [asyncio.StreamWriter, None], reusable: bool) -> None:
+        """Give the connection back, it is kept for the next
+        request if the response was read to the end."""
+        async with self._condition:
+            self._busy[key] -= 1
+            if writer is not None:
+                if reusable and self.keep_alive > 0:
+                    self._idle.setdefault(key, []).append((reader, writer, monotonic()))
+                else:
+                    writer.close()
+            self._condition.notify_all()
+
+    def close(self) -> None:
+        """Close all the idle connections."""
+        for idle in self._idle.values():
+            for _, writer, _ in idle:
+                writer.close()
+        self._idle = {}
+
+
+async def _connect(key: tuple, timeout: int) -> tuple:
+    """Open a new connection.
+    :returns: tuple of two: the reader and the writer."""
+    secure, host, port = key
+    try:
+        return await asyncio.wait_for(asyncio.open_connection(
+            host, port, ssl=_get_ssl_context() if secure else None), timeout)
+    except (OSError, asyncio.TimeoutError) as e:
+        raise URLError(e)
+
+
+async def iter_range(url: str, start: int, end: int, timeout: int = 30,
+                     pool: AsyncConnectionPool = None):
+    """Request bytes from start to end (inclusive) of
+    a stream without blocking the event loop, the same
+    way resumable.open_range does it with a thread.
+    Redirects are followed.
+    Yields the received data by pieces.
+    :param pool: AsyncConnectionPool to take the connection
+                from, without it a new one is opened and
+                closed after the response.
+    :raises: URLError, if the connection failed
+    or the server answered with an error."""
+    url = f'{url}&range={start}-{end}'
+    for _ in range(MAX_REDIRECTS + 1):
+        parts = urlsplit(url)
+        secure = parts.scheme == 'https'
+        key = (secure, parts.hostname, parts.port or (443 if secure else 80))
+        target = parts.path + (f'?{parts.query}' if parts.query else '')
+        head = ''.join(f'{name}: {value}\r\n' for name, value in HEADERS.items())
+        request = (f'GET {target or "/"} HTTP/1.1\r\nHost: {parts.netloc}\r\n{head}'
+                   f'Connection: {"close" if pool is None else "keep-alive"}\r\n\r\n')
+        reader, writer, status, reason, headers = await _send(key, request, url, timeout, pool)
+        reusable = False
+        try:
+            if status in (301, 302, 303, 307, 308) and 'location' in headers:
+                url = urljoin(url, headers['location'])
+                continue
+            if status >= 400:
+                raise HTTPError(url, status, reason, headers, None)
+            async for data in _read_body(reader, headers, timeout):
+                yield data
+            reusable = (headers.get('connection', '').lower() != 'close' and
+                        ('content-length' in headers or 'transfer-encoding' in headers))
+            return
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+            if isinstance(e, URLError):
+                raise
+            raise URLError(e)
+        finally:
+            if pool is None:
+                writer.close()
+            else:
+                await pool.release(key, reader, writer, reusable)
+    raise URLError(f'too many redirects for {urlsplit(url).hostname}')
+
+
+async def _send(key: tuple, request: str, url: str, timeout: int,
+                pool: [AsyncConnectionPool, None]) -> tuple:
+    """Send the request and read the head of the response.
+    If a reused connection turns out to be closed by the
+    server, the request is sent once more over a new one.
+    :returns: tuple of five: the reader, the writer, the status
+    code, the reason and the headers of the response."""
+    while True:
+        if pool is None:
+            reader, writer = await _connect(key, timeout)
+            reused = False
+        else:
+            reader, writer, reused = await pool.acquire(key, timeout)
+        try:
+            writer.write(request.encode('latin-1'))
+            await writer.drain()
+            return (reader, writer,
+                    *await asyncio.wait_for(_read_head(reader, url), timeout))
+        except BaseException as e:
+            if pool is None:
+                writer.close()
+            else:
+                await pool.release(key, reader, writer, False)
+            if reused and isinstance(e, ConnectionError):
+                get_metrics().count('retries_total', reason='stale_connection')
+                continue
+            if isinstance(e, (OSError, asyncio.TimeoutError)) and not isinstance(e, URLError):
+                raise URLError(e)
+            raise
+
+
+async def _wait(throttle: Throttle, amount: int) -> None:
+    """Wait until the amount of received bytes
+    is within the bandwidth limits."""
+    if delay := throttle.reserve(amount):
+        await asyncio.sleep(delay)
+
+
+class AsyncStreamDownload:
+    """The coroutine counterpart of ResumableDownload and
+    SegmentedDownload. The '.part' file and its sidecar
+    are written the same way, so a download started by one
+    engine can be continued by the other."""
+
+    def __init__(self, stream: Stream, connections: int = 1, chunk_size: int = CHUNK_SIZE,
+                 timeout: int = 30, pool: AsyncConnectionPool = None,
+                 throttle: Throttle = None, progress: JobProgress = None) -> None:
+        """:param stream: pytube Stream to download.
+        :param connections: the maximum amount of connections,
+                    0 or 1 means the usual single one.
+        :param pool: AsyncConnectionPool to take the connections from.
+        :param throttle: the bandwidth limit of the download,
+                    only the process-wide one by default.
+        :param progress: JobProgress to count the received bytes in."""
+        self.stream = stream
+        self.connections = connections
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.pool = pool
+        self.throttle = throttle or Throttle()
+        self.progress = progress or JobProgress()
+
+    async def download(self, output_path: str, filename: str = None) -> str:
+        """Download the stream into the output_path folder,
+        the file gets the filename, or the stream's default one.
+        An existing file of the same size is not downloaded again.
+        :returns: the path to the downloaded file."""
+        file_path = os.path.join(output_path, filename or self.stream.default_filename)
+        size = self.stream.filesize
+        if os.path.isfile(file_path) and os.path.getsize(file_path) == size:
+            return file_path
+        part = PartFile(file_path, self.stream)
+        if is_preallocating() or SegmentedDownload.is_worth_it(self.stream, self.connections):
+            await self._download_segmented(part, size)
+        else:
+            await self._download_sequential(part, size)
+        part.finish()
+        return file_path
+
+    async def _download_sequential(self, part: PartFile, size: int) -> None:
+        """Append the missing bytes to the part range by range."""
+        state = part.load()
+        if 'done' in state:
+            part.remove()  # preallocated by a segmented download
+            state = {}
+        part.save(state)
+        with open(part.part_path, 'ab') as file:
+            if (offset := file.tell()) > size:
+                file.truncate(0)
+                offset = 0
+            self.progress.begin(size, offset)
+            while offset < size:
+                end = min(offset + self.chunk_size, size) - 1
+                async for data in iter_range(self.stream.url, offset, end,
+                                             self.timeout, self.pool):
+                    file.write(data)
+                    self.progress.advance(len(data))
+                    await _wait(self.throttle, len(data))
+                file.flush()
+                if file.tell() == offset:
+                    raise URLError(f'no data received for bytes {offset}-{end}')
+                offset = file.tell()
+
+    async def _download_segmented(self, part: PartFile, size: int) -> None:
+        """Fetch the missing ranges of a preallocated part
+        over several connections at once (or over one, if
+        the part is preallocated on request)."""
+        state = part.load()
+        if state.get('chunk_size') != SEGMENT_SIZE:
+            part.remove()
+            state = {'chunk_size': SEGMENT_SIZE, 'done': []}
+        if not os.path.isfile(part.part_path):
+            with open(part.part_path, 'wb') as file:
+                preallocate(file, size)
+        part.save(state)
+        done = set(state['done'])
+        self.progress.begin(size, sum(min(SEGMENT_SIZE, size - i) for i in done))
+        ranges = [(start, min(start + SEGMENT_SIZE, size) - 1)
+                  for start in range(0, size, SEGMENT_SIZE) if start not in done]
+
+        async def fetch() -> None:
+            with open(part.part_path, 'r+b') as file:
+                while ranges:
+                    start, end = ranges.pop(0)
+                    file.seek(start)
+                    async for data in iter_range(self.stream.url, start, end,
+                                                 self.timeout, self.pool):
+                        file.write(data)
+                        self.progress.advance(len(data))
+                        await _wait(self.throttle, len(data))
+                    file.flush()
+                    state['done'].append(start)
+                    part.save(state)
+
+        tasks = [asyncio.ensure_future(fetch())
+                 for _ in range(min(max(self.connections, 1), len(ranges)))]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+class AsyncStreamingTranscoder:
+    """The coroutine counterpart of StreamingTranscoder:
+    the downloaded bytes are written into the stdin of
+    an ffmpeg subprocess as they arrive."""
+
+    def __init__(self, stream: Stream, mp3_location: str, chunk_size: int = CHUNK_SIZE,
+                 timeout: int = 30, pool: AsyncConnectionPool = None,
+                 throttle: Throttle = None, progress: JobProgress = None) -> None:
+        """:param stream: pytube Stream with the audio.
+        :param mp3_location: the path of the mp3 file to create.
+        :param pool: AsyncConnectionPool to take the connections from.
+        :param throttle: the bandwidth limit of the download,
+                    only the process-wide one by default.
+        :param progress: JobProgress to count the received bytes in."""
+        self.stream = stream
+        self.mp3_location = mp3_location
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.pool = pool
+        self.throttle = throttle or Throttle()
+        self.progress = progress or JobProgress()
+
+    async def transcode(self) -> str:
+        """Download and convert the stream.
+        The mp3 is written as '.part' first and renamed
+        only after ffmpeg finished successfully.
+        :returns: the path to the mp3 file.
+        :raises: ConversionError, if ffmpeg failed."""
+        part_location = self.mp3_location + '.part'
+        encoder = await asyncio.create_subprocess_exec(
+            *build_mp3_encoder_command(part_location),
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE)
+        try:
+            await self._feed(encoder)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # ffmpeg exited early, its stderr tells why
+        except BaseException:
+            encoder.kill()
+            await encoder.wait()
+            self._remove(part_location)
+            raise
+        finally:
+            encoder.stdin.close()
+        error = (await encoder.stderr.read()).decode(errors='replace').strip()
+        if await encoder.wait():
+            self._remove(part_location)
+            raise ConversionError(os.path.basename(self.mp3_location), error)
+        os.replace(part_location, self.mp3_location)
+        return self.mp3_location
+
+    async def _feed(self, encoder: asyncio.subprocess.Process) -> None:
+        """Write the stream into the encoder's stdin range by range."""
+        size = self.stream.filesize
+        self.progress.begin(size)
+        for start in range(0, size, self.chunk_size):
+            end = min(start + self.chunk_size, size) - 1
+            async for data in iter_range(self.stream.url, start, end, self.timeout, self.pool):
+                encoder.stdin.write(data)
+                await encoder.stdin.drain()
+                self.progress.advance(len(data))
+                await _wait(self.throttle, len(data))
+
+    @staticmethod
+    def _remove(location: str) -> None:
+        """Remove the unfinished mp3, if ffmpeg created it."""
+        if os.path.exists(location):
+            os.remove(location)
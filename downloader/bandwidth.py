@@ -0,0 +1,93 @@
+import re
+from threading import Lock
+from time import monotonic, sleep
+
+
+UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+RATE_PATTERN = re.compile(r'^(\d+(?:\.\d+)?)([KMG]?)(?:B|B/S)?$')
+
+
+def parse_rate(rate: str) -> int:
+    """Turn a rate like '20M', '512K' or '1000000'
+    into bytes per second, 0 means no limit.
+    :raises: ValueError, if the rate is malformed."""
+    if not (match := RATE_PATTERN.match(rate.strip().upper())):
+        raise ValueError(f'"{rate}" is not a valid rate.')
+    return int(float(match.group(1)) * UNITS[match.group(2)])
+
+
+class TokenBucket:
+    """A token bucket limiting how many bytes per second
+    go through it. The bucket starts empty and holds up to
+    one second of tokens, so after a pause a short burst
+    is let through at full speed. Tokens can be taken
+    in advance: whoever takes more than there are
+    waits until they are earned."""
+
+    def __init__(self, rate: int = 0) -> None:
+        """:param rate: bytes per second, 0 means no limit."""
+        self.rate = rate
+        self._tokens = 0.0
+        self._updated = monotonic()
+        self._lock = Lock()
+
+    def configure(self, rate: int) -> None:
+        """Change the rate, 0 removes the limit."""
+        with self._lock:
+            self.rate = rate
+            self._tokens = min(self._tokens, 0.0)
+            self._updated = monotonic()
+
+    def reserve(self, amount: int) -> float:
+        """Take tokens for the amount of bytes.
+        :returns: how many seconds to wait before
+        the bytes are within the rate."""
+        with self._lock:
+            if not self.rate:
+                return 0.0
+            now = monotonic()
+            self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= amount
+            return max(0.0, -self._tokens / self.rate)
+
+
+_bucket = TokenBucket()
+
+
+def get_bucket() -> TokenBucket:
+    """Get the process-wide TokenBucket
+    all the downloads share."""
+    return _bucket
+
+
+def set_limit(rate: int) -> None:
+    """Limit the bandwidth of all the downloads together,
+    0 removes the limit."""
+    _bucket.configure(rate)
+
+
+class Throttle:
+    """The bandwidth limit of one job: the process-wide
+    bucket and, if the job has a cap of its own,
+    a separate bucket for it. Every received piece of data
+    is passed to consume, which sleeps until it is within
+    both limits."""
+
+    def __init__(self, cap: int = 0) -> None:
+        """:param cap: bytes per second the job may use,
+                    0 means only the process-wide limit applies."""
+        self.buckets = [get_bucket()]
+        if cap:
+            self.buckets.append(TokenBucket(cap))
+
+    def reserve(self, amount: int) -> float:
+        """Take tokens for the amount of bytes from every bucket.
+        :returns: how many seconds to wait, so coroutines
+        can wait without blocking the event loop."""
+        return max(bucket.reserve(amount) for bucket in self.buckets)
+
+    def consume(self, amount: int) -> None:
+        """Block until the amount of bytes is within the limits."""
+        if delay := self.reserve(amount):
+            sleep(delay)
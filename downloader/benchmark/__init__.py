@@ -0,0 +1,20 @@
+"""Offline benchmarks of the download engines.
+
+A local stand-in of YouTube serves synthetic stream manifests
+and media bodies, so batches can be measured reproducibly
+without touching the real site. Run it from the downloader
+folder, as the modules are imported the same way the
+scripts import them:
+
+    python -m benchmark --workers 4 16 64 --files 40
+
+See python -m benchmark --help for the stand-in options
+(sizes, latency, bandwidth and error rate). The watch page and
+the player script are not imitated, so the report names
+resolving as a stage the numbers do not measure.
+
+    python -m benchmark --startup
+
+measures instead how long the console takes to start, against
+the target in benchmark.startup; the stages import pytube,
+asyncio and the process pool only when they need them."""
@@ -0,0 +1,85 @@
+import json
+from argparse import ArgumentParser
+
+from engine import shutdown_pool
+from bandwidth import parse_rate
+from scheduling import POLICIES
+
+from benchmark.standin import StandIn, StandInConfig
+from benchmark.startup import measure_startup, format_startup
+from benchmark.suite import KINDS, ENGINES, UNMEASURED_STAGES, Scenario, Suite, \
+    format_results, format_unmeasured
+
+
+def parse_arguments():
+    parser = ArgumentParser(prog='python -m benchmark',
+                            description='Measure the download engines against '
+                                        'an offline stand-in of YouTube.')
+    parser.add_argument('--kinds', nargs='+', choices=KINDS, default=list(KINDS))
+    parser.add_argument('--engines', nargs='+', choices=ENGINES, default=['thread'])
+    parser.add_argument('--workers', nargs='+', type=int, default=[4, 16, 64])
+    parser.add_argument('--files', type=int, default=40,
+                        help='the amount of files in every batch')
+    parser.add_argument('--video-size', type=parse_rate, default='8M',
+                        help='the size of a video stream, K, M and G suffixes can be used')
+    parser.add_argument('--audio-size', type=parse_rate, default='2M',
+                        help='the size of an audio stream')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds every request waits before it is answered')
+    parser.add_argument('--bandwidth', type=parse_rate, default='0',
+                        help='bytes per second of every response, 0 means no limit')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='the part of the requests answered with 503, from 0 to 1')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='the seed of the media bodies and the failing requests')
+    parser.add_argument('--audio-format', choices=('native', 'mp3'), default='native',
+                        help='mp3 measures the ffmpeg encoding as well')
+    parser.add_argument('--segments', type=int, default=0,
+                        help='the -segments of every job')
+    parser.add_argument('--schedule', choices=POLICIES, default='fifo',
+                        help='the -schedule of every job')
+    parser.add_argument('--startup', action='store_true',
+                        help='measure how long the console takes to start instead')
+    parser.add_argument('--runs', type=int, default=10,
+                        help='the amount of times the console is started with --startup')
+    parser.add_argument('--json', metavar='PATH',
+                        help='write the results to a json file as well')
+    return parser.parse_args()
+
+
+def main() -> None:
+    arguments = parse_arguments()
+    if arguments.startup:
+        result = measure_startup(arguments.runs)
+        print(format_startup(result))
+        if arguments.json:
+            with open(arguments.json, 'w') as file:
+                json.dump(result._asdict(), file, indent=2)
+        return
+    config = StandInConfig(arguments.video_size, arguments.audio_size, arguments.latency,
+                           arguments.bandwidth, arguments.error_rate, arguments.seed)
+    results = []
+    try:
+        with StandIn(config) as standin:
+            suite = Suite(standin, arguments.audio_format, arguments.segments,
+                          arguments.schedule)
+            for engine in arguments.engines:
+                for kind in arguments.kinds:
+                    for workers in arguments.workers:
+                        results.append(suite.run(Scenario(kind, engine, workers,
+                                                          arguments.files)))
+                        print(format_results(results[-1:]).splitlines()[-1], flush=True)
+    finally:
+        shutdown_pool()
+    print()
+    print(format_results(results))
+    print(format_unmeasured())
+    if arguments.json:
+        with open(arguments.json, 'w') as file:
+            json.dump({'config': config._asdict(),
+                       'results': [i._asdict() for i in results],
+                       'unmeasured': UNMEASURED_STAGES}, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+import json
+import random
+from collections import namedtuple
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from multiprocessing import Process, Queue
+from threading import Lock
+from time import sleep, time
+from urllib.parse import urlsplit, parse_qs
+from urllib.request import urlopen
+
+from pytube.monostate import Monostate
+from pytube.query import StreamQuery
+from pytube.streams import Stream
+from pytube.exceptions import VideoUnavailable
+
+from links import get_video_id
+
+
+# the bytes media bodies are cut from, repeated as many times as needed
+PATTERN_SIZE = 1024 * 1024
+WRITE_SIZE = 64 * 1024
+# signed urls of the stand-in expire like the real ones do
+URL_LIFETIME = 6 * 60 * 60
+
+StandInConfig = namedtuple('StandInConfig', 'video_size audio_size latency bandwidth error_rate seed')
+StandInConfig.__new__.__defaults__ = (8 * 1024 ** 2, 2 * 1024 ** 2, 0.0, 0, 0.0, 0)
+
+# itag, mime type, bitrate, fps (None for audio), whether it is a video stream
+STREAM_FORMATS = ((137, 'video/mp4; codecs="avc1.640028"', 4_000_000, 30, True),
+                  (22, 'video/mp4; codecs="avc1.64001F, mp4a.40.2"', 2_000_000, 30, True),
+                  (18, 'video/mp4; codecs="avc1.42001E, mp4a.40.2"', 500_000, 30, True),
+                  (140, 'audio/mp4; codecs="mp4a.40.2"', 128_000, None, False),
+                  (251, 'audio/webm; codecs="opus"', 160_000, None, False))
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Answers the requests the downloader makes:
+    /manifest?v=ID with the stream list of a video,
+    /videoplayback?id=ID&itag=N&range=A-B with a range
+    of its synthetic media body and /stats with the
+    counters of the server. Every request waits for the
+    configured latency, a configured part of the manifest
+    and media requests fails with 503, and media bodies
+    are sent no faster than the configured bandwidth."""
+    protocol_version = 'HTTP/1.1'
+    server: 'StandInServer'
+
+    def do_GET(self) -> None:
+        self._answer(send_body=True)
+
+    def do_HEAD(self) -> None:
+        self._answer(send_body=False)
+
+    def _answer(self, send_body: bool) -> None:
+        parts = urlsplit(self.path)
+        query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+        if parts.path == '/stats':
+            return self._send_json(self.server.get_stats(), send_body)
+        if self.server.config.latency:
+            sleep(self.server.config.latency)
+        if self.server.should_fail():
+            return self._send_empty(503)
+        if parts.path == '/manifest' and 'v' in query:
+            return self._send_json(self.server.build_manifest(query['v']), send_body)
+        if parts.path == '/videoplayback' and query.get('itag', '').isdigit():
+            return self._send_media(int(query['itag']), query, send_body)
+        self._send_empty(404)
+
+    def _send_media(self, itag: int, query: dict, send_body: bool) -> None:
+        """Send a range of the stream, given by the range
+        parameter (the way YouTube takes it) or the header."""
+        size = self.server.get_size(itag)
+        requested = query.get('range') or self.headers.get('Range', '').replace('bytes=', '')
+        start, _, end = requested.partition('-')
+        start = int(start) if start.isdigit() else 0
+        end = min(int(end) if end.isdigit() else size - 1, size - 1)
+        if start > end:
+            return self._send_empty(416)
+        self.send_response(206 if requested else 200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        if not send_body:
+            return
+        bandwidth = self.server.config.bandwidth
+        started = time()
+        sent = 0
+        for offset in range(start, end + 1, WRITE_SIZE):
+            data = self.server.get_data(offset, min(offset + WRITE_SIZE, end + 1))
+            self.wfile.write(data)
+            sent += len(data)
+            if bandwidth and (delay := started + sent / bandwidth - time()) > 0:
+                sleep(delay)
+        self.server.count_bytes(sent)
+
+    def _send_json(self, content: dict, send_body: bool) -> None:
+        body = json.dumps(content).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def _send_empty(self, status: int) -> None:
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args) -> None:
+        pass  # a line for every request would slow the server down
+
+
+class StandInServer(ThreadingHTTPServer):
+    """The HTTP server of the stand-in, a thread per connection."""
+    daemon_threads = True
+    # hundreds of connections may be opened at once by the async engine
+    request_queue_size = 1024
+
+    def __init__(self, address: tuple, config: StandInConfig) -> None:
+        super().__init__(address, StandInHandler)
+        self.config = config
+        self._random = random.Random(config.seed)
+        self._pattern = random.Random(config.seed).randbytes(PATTERN_SIZE)
+        self._lock = Lock()
+        self._stats = {'requests': 0, 'failed': 0, 'bytes': 0}
+
+    def build_manifest(self, video_id: str) -> dict:
+        """Describe the streams of a video in the
+        form pytube builds its Stream objects from."""
+        host, port = self.server_address[:2]
+        expire = int(time()) + URL_LIFETIME
+        streams = []
+        for itag, mime_type, bitrate, fps, _ in STREAM_FORMATS:
+            stream = {'url': f'http://{host}:{port}/videoplayback?id={video_id}'
+                             f'&itag={itag}&expire={expire}',
+                      'itag': itag, 'mimeType': mime_type, 'is_otf': False,
+                      'bitrate': bitrate, 'contentLength': self.get_size(itag)}
+            if fps:
+                stream['fps'] = fps
+            streams.append(stream)
+        return {'title': f'Benchmark {video_id}', 'streams': streams}
+
+    def get_size(self, itag: int) -> int:
+        """Get the size of the stream with the itag."""
+        for i, _, _, _, is_video in STREAM_FORMATS:
+            if i == itag:
+                return self.config.video_size if is_video else self.config.audio_size
+        return 0
+
+    def get_data(self, start: int, end: int) -> bytes:
+        """Get the bytes from start to end (exclusive)
+        of a media body, the pattern repeated."""
+        data = bytearray()
+        while start < end:
+            offset = start % PATTERN_SIZE
+            piece = self._pattern[offset:offset + end - start]
+            data += piece
+            start += len(piece)
+        return bytes(data)
+
+    def should_fail(self) -> bool:
+        """Count the request, decide whether
+        it is one of the failing ones."""
+        with self._lock:
+            self._stats['requests'] += 1
+            failed = self._random.random() < self.config.error_rate
+            self._stats['failed'] += failed
+        return failed
+
+    def count_bytes(self, amount: int) -> None:
+        """Count the sent media bytes."""
+        with self._lock:
+            self._stats['bytes'] += amount
+
+    def get_stats(self) -> dict:
+        """Get the amount of requests, failed
+        requests and sent media bytes so far."""
+        with self._lock:
+            return dict(self._stats)
+
+
+def _serve(config: StandInConfig, address: Queue) -> None:
+    """Run the server, put its address in the queue."""
+    server = StandInServer(('127.0.0.1', 0), config)
+    address.put(server.server_address[:2])
+    server.serve_forever()
+
+
+class StandIn:
+    """The stand-in server run in a separate process,
+    so serving does not compete for the GIL with the
+    downloader being measured. Use it as a context manager."""
+
+    def __init__(self, config: StandInConfig = StandInConfig()) -> None:
+        self.config = config
+        self.url = None
+        self._process = None
+
+    def start(self) -> None:
+        """Start the server process and wait until it listens."""
+        address = Queue()
+        self._process = Process(target=_serve, args=(self.config, address), daemon=True)
+        self._process.start()
+        host, port = address.get()
+        self.url = f'http://{host}:{port}'
+
+    def stop(self) -> None:
+        """Stop the server process."""
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join()
+            self._process = None
+
+    def get_stats(self) -> dict:
+        """Get the counters of the server."""
+        with urlopen(f'{self.url}/stats') as response:
+            return json.loads(response.read())
+
+    def __enter__(self) -> 'StandIn':
+        self.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+
+class StandInVideo:
+    """Stands in for pytube.YouTube, the same way
+    stream_cache.CachedVideo does: the streams are
+    pytube Stream objects built from the manifest of
+    the stand-in, so pytube sends the media requests
+    to it. The watch page and the player script of the
+    real site are not imitated, the cipher pytube reads
+    from them can not be reproduced reliably."""
+
+    def __init__(self, url: str, server_url: str) -> None:
+        """Fetch the manifest of the video the url leads to.
+        :raises: VideoUnavailable, if the url has no video id.
+        :raises: URLError, if the stand-in did not answer."""
+        if (video_id := get_video_id(url)) is None:
+            raise VideoUnavailable(url)
+        with urlopen(f'{server_url}/manifest?v={video_id}') as response:
+            manifest = json.loads(response.read())
+        self.video_id = video_id
+        self.title = manifest['title']
+        monostate = Monostate(on_progress=None, on_complete=None, title=self.title)
+        self.streams = StreamQuery([Stream(i, monostate) for i in manifest['streams']])
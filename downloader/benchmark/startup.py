@@ -0,0 +1,58 @@
+"""How long the console takes to start, measured by running
+it in fresh interpreters, so nothing is imported already."""
+import subprocess
+import sys
+from collections import namedtuple
+from statistics import median
+from time import perf_counter
+
+
+# the seconds python YouTubeWormConsole.py help may take on top
+# of a bare interpreter; it took about 0.12 while pytube, asyncio
+# and the process pool were imported at the start, 0.07 without
+STARTUP_TARGET = 0.1
+# the modules the stages import when they need them,
+# starting the console must not import any of them
+HEAVY_MODULES = ('pytube', 'asyncio', 'moviepy', 'concurrent.futures.process', 'http.server',
+                 'connection_pool', 'urllib.request', 'http.client', 'ssl', 'email')
+
+StartupResult = namedtuple('StartupResult', 'baseline help overhead heavy runs')
+
+
+def time_command(arguments: list, runs: int) -> float:
+    """Get the median seconds the command took to run."""
+    times = []
+    for _ in range(runs):
+        started = perf_counter()
+        subprocess.run(arguments, stdout=subprocess.DEVNULL, check=True)
+        times.append(perf_counter() - started)
+    return median(times)
+
+
+def get_heavy_imports() -> list:
+    """Get the heavy modules importing the console imports."""
+    code = ('import sys, YouTubeWormConsole; '
+            f'print(" ".join(name for name in {HEAVY_MODULES!r} if name in sys.modules))')
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True,
+                            text=True, check=True).stdout
+    return output.split()
+
+
+def measure_startup(runs: int = 10) -> StartupResult:
+    """Run the help of the console and a bare interpreter
+    the amount of times, taking the median of each."""
+    baseline = time_command([sys.executable, '-c', 'pass'], runs)
+    help_time = time_command([sys.executable, 'YouTubeWormConsole.py', 'help'], runs)
+    return StartupResult(baseline, help_time, help_time - baseline, get_heavy_imports(), runs)
+
+
+def format_startup(result: StartupResult) -> str:
+    """Format the result of measure_startup against STARTUP_TARGET."""
+    verdict = 'ok' if result.overhead <= STARTUP_TARGET and not result.heavy else 'too slow'
+    lines = [f'bare interpreter: {result.baseline:.3f}s',
+             f'help:             {result.help:.3f}s (median of {result.runs})',
+             f'console startup:  {result.overhead:.3f}s, '
+             f'the target is {STARTUP_TARGET:.3f}s: {verdict}']
+    if result.heavy:
+        lines.append(f'imported at the start: {", ".join(result.heavy)}')
+    return '\n'.join(lines)
@@ -0,0 +1,173 @@
+import os
+import shutil
+import tempfile
+from collections import namedtuple
+from functools import partial
+from math import ceil
+from threading import Lock, Thread
+from time import monotonic
+from unittest.mock import patch
+
+from engine import Job, ParallelDownloader, AsyncParallelDownloader, get_pool
+from connection_pool import get_connection_pool, DEFAULT_PER_HOST
+from progress import get_bus
+
+from benchmark.standin import StandIn, StandInVideo
+
+
+KINDS = ('video', 'audio', 'mixed')
+ENGINES = ('thread', 'async')
+# the stages the numbers do not stand for, with the reason
+UNMEASURED_STAGES = {'resolve': 'the stand-in serves a stream manifest instead of '
+                                'the watch page and the player script pytube parses'}
+
+Scenario = namedtuple('Scenario', 'kind engine workers files')
+Result = namedtuple('Result', 'kind engine workers files done failed seconds '
+                              'files_per_second megabytes_per_second p50 p99')
+
+
+def resolve(job: Job, cache=None, server_url: str = None) -> Job:
+    """Resolve the job with the stand-in instead of YouTube,
+    in place of engine.resolve. The cache is
+    not used, so every run resolves the same way."""
+    return job._replace(file=StandInVideo(job.url, server_url))
+
+
+class LatencyRecorder:
+    """Subscriber of the ProgressBus measuring how long every
+    job took from being queued to being done or failed."""
+
+    def __init__(self) -> None:
+        self.started = {}
+        self.finished = {}
+        self.failed = set()
+        self._lock = Lock()
+
+    def __call__(self, events: list) -> None:
+        now = monotonic()
+        with self._lock:
+            for event in events:
+                self.started.setdefault(event.job, now)
+                if event.stage in ('done', 'failed') and event.job not in self.finished:
+                    self.finished[event.job] = now
+                    if event.stage == 'failed':
+                        self.failed.add(event.job)
+
+    def get_latencies(self) -> list:
+        """Get the sorted seconds the finished jobs took."""
+        with self._lock:
+            return sorted(end - self.started[job] for job, end in self.finished.items())
+
+
+def get_percentile(values: list, fraction: float) -> float:
+    """Get the nearest-rank percentile of sorted values."""
+    if not values:
+        return 0.0
+    return values[max(ceil(fraction * len(values)) - 1, 0)]
+
+
+def build_links(prefix: str, count: int) -> str:
+    """Build count links to distinct videos, the way
+    the console takes them: separated by ', '."""
+    return ', '.join(f'https://youtu.be/{prefix}{i:0{11 - len(prefix)}d}' for i in range(count))
+
+
+class Suite:
+    """Runs batches of the console downloader against
+    a StandIn and measures them. The stand-in is started
+    once, every scenario downloads into a new temporary folder
+    in the current directory."""
+
+    def __init__(self, standin: StandIn, audio_format: str = 'native',
+                 segments: int = 0, schedule: str = 'fifo') -> None:
+        """:param audio_format: the -format of the audio jobs,
+                    mp3 measures the ffmpeg encoding as well.
+        :param segments: the -segments of every job.
+        :param schedule: the -schedule of every job."""
+        self.standin = standin
+        self.audio_format = audio_format
+        self.segments = segments
+        self.schedule = schedule
+        self._runs = 0
+
+    def run(self, scenario: Scenario) -> Result:
+        """Download a batch and measure it."""
+        get_connection_pool(max(DEFAULT_PER_HOST, scenario.workers))
+        # a folder name without separators, the scripts
+        # rewrite the slashes of a path for Windows
+        path = os.path.basename(tempfile.mkdtemp(prefix='benchmark-', dir=os.curdir))
+        recorder = LatencyRecorder()
+        sent = self.standin.get_stats()['bytes']
+        get_bus().subscribe(recorder)
+        started = monotonic()
+        try:
+            with patch('engine.resolve', partial(resolve, server_url=self.standin.url)):
+                self._download(scenario, path)
+            get_bus().flush()
+        finally:
+            seconds = monotonic() - started
+            get_bus().unsubscribe(recorder)
+            shutil.rmtree(path, ignore_errors=True)
+        megabytes = (self.standin.get_stats()['bytes'] - sent) / 1024 ** 2
+        latencies = recorder.get_latencies()
+        done = len(latencies) - len(recorder.failed)
+        return Result(scenario.kind, scenario.engine, scenario.workers, scenario.files,
+                      done, len(recorder.failed), seconds, done / seconds,
+                      megabytes / seconds, get_percentile(latencies, 0.5),
+                      get_percentile(latencies, 0.99))
+
+    def _download(self, scenario: Scenario, path: str) -> None:
+        """Run the batch, a mixed one as a video and an audio
+        request at once, half of the files each. With the threads
+        engine both requests share the pool of workers, with
+        the async one each of them gets half of the concurrency."""
+        self._runs += 1
+        if scenario.engine == 'thread':
+            get_pool(scenario.workers)
+        if scenario.kind != 'mixed':
+            self._download_kind(scenario.kind, scenario.files, scenario.workers,
+                                scenario.engine, path)
+            return
+        half_files, half_workers = scenario.files // 2, max(scenario.workers // 2, 1)
+        requests = [Thread(target=self._download_kind, args=(
+                        'video', half_files, half_workers, scenario.engine, path)),
+                    Thread(target=self._download_kind, args=(
+                        'audio', scenario.files - half_files,
+                        max(scenario.workers - half_workers, 1), scenario.engine, path))]
+        for request in requests:
+            request.start()
+        for request in requests:
+            request.join()
+
+    def _download_kind(self, kind: str, files: int, concurrency: int,
+                       engine: str, path: str) -> None:
+        """Download files of one kind the way
+        the console download command does."""
+        links = build_links(f'{kind[0]}{self._runs:03d}', files)
+        options = {'type': kind, 'to': path, 'cache': 'off',
+                   'format': self.audio_format, 'segments': self.segments,
+                   'schedule': self.schedule}
+        if engine == 'async':
+            downloader = AsyncParallelDownloader(links, options, concurrency=concurrency)
+        else:
+            downloader = ParallelDownloader(links, options, get_pool())
+        downloader.download_all()
+
+
+def format_results(results: list) -> str:
+    """Lay the results out as a table."""
+    header = ('kind', 'engine', 'workers', 'done', 'failed', 'seconds',
+              'files/s', 'MB/s', 'p50 s', 'p99 s')
+    rows = [header] + [(i.kind, i.engine, str(i.workers), str(i.done), str(i.failed),
+                        f'{i.seconds:.2f}', f'{i.files_per_second:.1f}',
+                        f'{i.megabytes_per_second:.1f}', f'{i.p50:.2f}', f'{i.p99:.2f}')
+                       for i in results]
+    widths = [max(len(row[column]) for row in rows) for column in range(len(header))]
+    return '\n'.join('  '.join(cell.rjust(width) for cell, width in zip(row, widths))
+                     for row in rows)
+
+
+def format_unmeasured() -> str:
+    """List the stages the results do not measure."""
+    return '\n'.join(f'not measured: {stage}, {reason}'
+                     for stage, reason in UNMEASURED_STAGES.items())
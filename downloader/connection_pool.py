@@ -0,0 +1,214 @@
+import ssl
+import socket
+from functools import partial
+from typing import Callable
+from http.client import HTTPConnection, HTTPSConnection, HTTPResponse, BadStatusLine
+from threading import Condition
+from time import monotonic
+from urllib.error import URLError
+from urllib.request import HTTPHandler, HTTPSHandler, Request, build_opener, install_opener
+
+from metrics import get_metrics
+
+
+DEFAULT_PER_HOST = 32
+# seconds an unused connection is kept open
+DEFAULT_KEEP_ALIVE = 60
+# what a reused connection raises if the server
+# closed it while it was waiting in the pool
+STALE_CONNECTION_ERRORS = (ConnectionError, BadStatusLine)
+
+
+class PooledResponse(HTTPResponse):
+    """A response that gives its connection back to
+    the pool as soon as the body is read to the end.
+    A response closed before that takes the connection
+    with it, as the rest of the body is still in the socket."""
+
+    def __init__(self, sock, *args, release: Callable[[bool], None] = None, **kwargs) -> None:
+        super().__init__(sock, *args, **kwargs)
+        self._release = release
+        self._complete = True
+
+    def close(self) -> None:
+        if self.fp is not None and self.length != 0:
+            self._complete = False
+        super().close()
+
+    def _close_conn(self) -> None:
+        super()._close_conn()
+        if self._release is not None:
+            release, self._release = self._release, None
+            release(self._complete and not self.will_close)
+
+
+class ConnectionPool:
+    """Open HTTP(S) connections shared by all the threads
+    of the process. A connection is kept alive after
+    a request and reused by the next request to the same
+    host, so the DNS lookup and the TCP and TLS handshakes
+    are made once instead of for every request.
+    At most max_per_host connections to one host are
+    used at once, the other requests wait for one of them."""
+
+    def __init__(self, max_per_host: int = DEFAULT_PER_HOST,
+                 keep_alive: int = DEFAULT_KEEP_ALIVE) -> None:
+        """:param max_per_host: the maximum amount of
+                    connections to one host used at once.
+        :param keep_alive: how many seconds an unused
+                    connection is kept, 0 closes every
+                    connection after its request."""
+        self.max_per_host = max_per_host
+        self.keep_alive = keep_alive
+        self.context = ssl.create_default_context()
+        self._condition = Condition()
+        self._idle = {}
+        self._busy = {}
+
+    def configure(self, max_per_host: int = None, keep_alive: int = None) -> None:
+        """Change the limits of the pool.
+        :raises: ValueError, if max_per_host is less than one."""
+        with self._condition:
+            if max_per_host is not None:
+                if max_per_host < 1:
+                    raise ValueError('The amount of connections should be at least 1.')
+                self.max_per_host = max_per_host
+            if keep_alive is not None:
+                self.keep_alive = keep_alive
+            self._condition.notify_all()
+
+    def acquire(self, scheme: str, host: str, timeout: float) -> tuple[HTTPConnection, bool]:
+        """Take an idle connection to the host or open a new
+        one, wait if there are max_per_host of them in use.
+        :param host: the host and the port, if it is not the default one.
+        :returns: tuple of two: the connection and whether
+        it was used before."""
+        key = (scheme, host)
+        with self._condition:
+            self._condition.wait_for(lambda: self._busy.get(key, 0) < self.max_per_host)
+            self._busy[key] = self._busy.get(key, 0) + 1
+            idle = self._idle.get(key, [])
+            connection = None
+            while idle and connection is None:
+                connection, released_at = idle.pop()
+                if monotonic() - released_at > self.keep_alive:
+                    connection.close()
+                    connection = None
+        if connection is not None:
+            connection.timeout = timeout
+            if connection.sock is not None:
+                # urlopen passes a sentinel when no timeout is given
+                connection.sock.settimeout(socket.getdefaulttimeout()
+                                           if timeout is socket._GLOBAL_DEFAULT_TIMEOUT
+                                           else timeout)
+            return connection, True
+        if scheme == 'https':
+            return HTTPSConnection(host, timeout=timeout, context=self.context), False
+        return HTTPConnection(host, timeout=timeout), False
+
+    def release(self, scheme: str, host: str, connection: HTTPConnection,
+                reusable: bool) -> None:
+        """Give the connection back. It is kept for the next
+        request, if its response was read to the end and
+        the server did not ask to close it."""
+        key = (scheme, host)
+        with self._condition:
+            self._busy[key] -= 1
+            if reusable and self.keep_alive > 0:
+                self._idle.setdefault(key, []).append((connection, monotonic()))
+            else:
+                connection.close()
+            self._condition.notify_all()
+
+    def close(self) -> None:
+        """Close all the idle connections."""
+        with self._condition:
+            for idle in self._idle.values():
+                for connection, _ in idle:
+                    connection.close()
+            self._idle = {}
+
+
+class PooledHandler(HTTPHandler, HTTPSHandler):
+    """urllib handler sending the http and https
+    requests over the connections of a ConnectionPool.
+    Requests through a proxy tunnel are made the usual way."""
+
+    def __init__(self, pool: ConnectionPool) -> None:
+        HTTPSHandler.__init__(self, context=pool.context)
+        self.pool = pool
+
+    def http_open(self, req: Request) -> HTTPResponse:
+        return self._open(req, 'http')
+
+    def https_open(self, req: Request) -> HTTPResponse:
+        return self._open(req, 'https')
+
+    def _open(self, req: Request, scheme: str) -> HTTPResponse:
+        """Send the request over a pooled connection. If a reused
+        connection turns out to be closed by the server,
+        the request is sent once more over a new one."""
+        if req._tunnel_host:
+            if scheme == 'https':
+                return self.do_open(HTTPSConnection, req, context=self.pool.context)
+            return self.do_open(HTTPConnection, req)
+        if not req.host:
+            raise URLError('no host given')
+        headers = dict(req.unredirected_hdrs)
+        headers.update({k: v for k, v in req.headers.items() if k not in headers})
+        headers['Connection'] = 'keep-alive'
+        headers = {name.title(): value for name, value in headers.items()}
+        while True:
+            connection, reused = self.pool.acquire(scheme, req.host, req.timeout)
+            release = self._lease(scheme, req.host, connection)
+            connection.response_class = partial(PooledResponse, release=release)
+            try:
+                connection.request(req.get_method(), req.selector, req.data, headers,
+                                   encode_chunked=req.has_header('Transfer-encoding'))
+                response = connection.getresponse()
+            except STALE_CONNECTION_ERRORS as e:
+                release(False)
+                if reused:
+                    get_metrics().count('retries_total', reason='stale_connection')
+                    continue
+                raise URLError(e)
+            except OSError as e:
+                release(False)
+                raise URLError(e)
+            except BaseException:
+                release(False)
+                raise
+            response.url = req.get_full_url()
+            response.msg = response.reason
+            return response
+
+    def _lease(self, scheme: str, host: str, connection: HTTPConnection) -> Callable[[bool], None]:
+        """Build the function giving the connection back to
+        the pool, which does nothing when it is called again
+        (a failed response may still be closed later)."""
+        released = []
+
+        def release(reusable: bool) -> None:
+            if not released:
+                released.append(True)
+                self.pool.release(scheme, host, connection, reusable)
+        return release
+
+
+_pool = None
+
+
+def get_connection_pool(max_per_host: int = None, keep_alive: int = None) -> ConnectionPool:
+    """Get the process-wide ConnectionPool. On the first call
+    it is created and installed as the urllib opener, so every
+    urlopen call (pytube's watch page, player and manifest
+    requests as well as the stream ranges) goes through it.
+    Later calls change its limits, if they are given."""
+    global _pool
+    if _pool is None:
+        _pool = ConnectionPool(max_per_host or DEFAULT_PER_HOST,
+                               DEFAULT_KEEP_ALIVE if keep_alive is None else keep_alive)
+        install_opener(build_opener(PooledHandler(_pool)))
+    else:
+        _pool.configure(max_per_host, keep_alive)
+    return _pool
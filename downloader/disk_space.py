@@ -0,0 +1,109 @@
+import os
+import errno
+import shutil
+from contextlib import contextmanager
+from threading import Lock
+
+from progress import JobProgress
+
+
+# space left free on every disk, so the system
+# and other programs do not run out of it
+DEFAULT_MARGIN = 256 * 1024 * 1024
+# what a batch does when a file does not fit on the disk:
+# trim fails only that file, refuse fails every file of
+# the batch that was not started yet, off does not check
+CHECKS = ('trim', 'refuse', 'off')
+DEFAULT_CHECK = 'trim'
+
+
+class NotEnoughSpace(OSError):
+    """There is not enough free space on the disk for a file."""
+
+    def __init__(self, path: str, needed: int = 0, free: int = 0) -> None:
+        super().__init__(errno.ENOSPC, os.strerror(errno.ENOSPC), path)
+        self.needed = needed
+        self.free = free
+
+
+class SpaceLedger:
+    """Keeps the disk space the running downloads are still
+    going to take, for every disk, so a file is only started
+    if it fits together with all of them. A running download
+    holds the part of its file it has not received yet."""
+
+    def __init__(self, margin: int = DEFAULT_MARGIN) -> None:
+        self.margin = margin
+        self._reservations = {}
+        self._lock = Lock()
+
+    @contextmanager
+    def reserve(self, path: str, size: int, progress: JobProgress = None):
+        """Hold the space for a file of the size
+        in the folder while the block runs.
+        :param progress: JobProgress of the download, the
+                    received bytes are already on the disk.
+        :raises: NotEnoughSpace, if the file does not fit."""
+        device = os.stat(path).st_dev
+        reservation = (size, progress or JobProgress())
+        with self._lock:
+            free = shutil.disk_usage(path).free
+            needed = size + self._get_outstanding(device)
+            if needed > free - self.margin:
+                raise NotEnoughSpace(path, needed, free)
+            self._reservations.setdefault(device, []).append(reservation)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._reservations[device].remove(reservation)
+
+    def _get_outstanding(self, device: int) -> int:
+        """Sum the bytes the downloads to the disk have not received yet."""
+        return sum(max(size - progress.done, 0)
+                   for size, progress in self._reservations.get(device, []))
+
+
+_ledger = SpaceLedger()
+
+
+def get_ledger() -> SpaceLedger:
+    """Get the process-wide SpaceLedger."""
+    return _ledger
+
+
+_preallocating = False
+
+
+def set_preallocation(enabled: bool) -> None:
+    """Turn preallocating the files of the downloads on or off."""
+    global _preallocating
+    _preallocating = enabled
+
+
+def is_preallocating() -> bool:
+    """Tell whether the files of the downloads are preallocated."""
+    return _preallocating
+
+
+def preallocate(file, size: int) -> None:
+    """Extend the open file to the size. With preallocation
+    turned on the space is allocated on the disk right away
+    (fallocate where the system has it), so a big file is
+    not fragmented and a full disk fails the download before
+    anything is received; otherwise the file is left sparse.
+    :raises: NotEnoughSpace, if the disk is full."""
+    try:
+        if _preallocating and hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(file.fileno(), 0, size)
+                return
+            except OSError as e:
+                if e.errno not in (errno.EOPNOTSUPP, errno.EINVAL):
+                    raise
+        # NTFS allocates the space of a file extended this way
+        file.truncate(size)
+    except OSError as e:
+        if e.errno == errno.ENOSPC:
+            raise NotEnoughSpace(file.name, size) from e
+        raise
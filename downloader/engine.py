@@ -0,0 +1,1302 @@
+import os
+from collections import namedtuple
+from contextlib import contextmanager
+from functools import partial
+from typing import Callable, Iterable, Iterator, TYPE_CHECKING
+from urllib.error import HTTPError
+from queue import Queue, Empty
+from threading import Thread, Condition, Lock
+from concurrent.futures import Future, ThreadPoolExecutor
+from time import time
+
+from segmented import SegmentedDownload
+from bandwidth import Throttle
+from disk_space import NotEnoughSpace, get_ledger, is_preallocating, DEFAULT_CHECK
+from progress import JobProgress, StreamProgress, get_bus
+from metrics import STAGES, get_metrics
+from retry import RetryBudget, call_with_retries, call_with_retries_async, get_host_key
+from stream_selection import Target, get_target, get_size, select_stream, select_adaptive, \
+    describe_target, describe_stream
+from scheduling import ScheduledQueue, PrioritySemaphore, get_priority, DEFAULT_POLICY
+from resumable import ResumableDownload
+from links import coalesce, split_collections, chunked, RecentSet, LINKS_CHUNK, RECENT_LINKS
+from expansion import Expansion, DEFAULT_PAGE_LOOKAHEAD
+from job_store import JobStore, StoredJob
+from stream_cache import StreamCache, CachedVideo
+from transcoding import StreamingTranscoder, ConversionError, ConverterPool, \
+    convert_to_mp3, remux, mux
+
+# pytube, asyncio and the connection pool (with urllib.request,
+# http.client, ssl and email) take most of the startup of a front end,
+# so they are imported by the stages that use them
+if TYPE_CHECKING:
+    from pytube import YouTube
+    from pytube.streams import Stream
+    from async_download import AsyncConnectionPool
+
+
+DEFAULT_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+DEFAULT_LOOKAHEAD = 8
+# coroutines cost no thread stack, so the async
+# engine runs far more downloads at once
+DEFAULT_CONCURRENCY = 256
+# the amount of unfinished jobs a batch may have
+# before more links are read and turned into jobs
+DEFAULT_BACKLOG = 1024
+# the statuses a media server rejects a signed url with,
+# a job with cached streams is resolved again after them
+REJECTED_STATUSES = (403, 410)
+
+
+class InvalidResolution(AttributeError):
+    ...
+
+
+
+class FileForDownloading:
+    @staticmethod
+    def _build_location(path: str, filename: str) -> str:
+        """Concatenates path to folder and filename together."""
+        location = os.path.join(path, filename)
+        return location
+
+    @staticmethod
+    def _rebuild_path(path: str) -> str:
+        """Replace all '/' symbols,
+        so path to folder and filename
+        can be concatenated through os.path.join."""
+        new_path = path.replace('/', '\\')
+        return new_path
+
+    @staticmethod
+    def _download_stream(stream: 'Stream', path: str, segments: int,
+                         throttle: Throttle = None, progress: JobProgress = None,
+                         filename: str = None) -> str:
+        """Download the stream into a '.part' file, which is
+        continued if a previous attempt was interrupted. The
+        download goes in byte ranges over several connections
+        if it was asked for and the stream is big enough.
+        :param segments: the maximum amount of connections,
+                    0 or 1 means the usual single one.
+        :param throttle: the bandwidth limit of the download.
+        :param progress: JobProgress to count the received bytes in.
+        :param filename: the name of the file, the stream's default one if None.
+        A file that has to be preallocated is downloaded by
+        segments as well, the ranges are then written into
+        the allocated space (over a single connection, if
+        segments were not asked for)."""
+        if is_preallocating() or SegmentedDownload.is_worth_it(stream, segments):
+            return SegmentedDownload(stream, segments, throttle=throttle,
+                                     progress=progress).download(path, filename)
+        return ResumableDownload(stream, throttle=throttle,
+                                 progress=progress).download(path, filename)
+
+
+class Audio(FileForDownloading):
+    """Class for downloading and converting mp4 files with no frames
+    to mp3 files."""
+
+    def __init__(self, audio_file: 'Stream', path: str, segments: int = 0,
+                 transcode: str = 'stream', converter: ConverterPool = None,
+                 throttle: Throttle = None, progress: JobProgress = None) -> None:
+        """:param transcode: 'stream' to convert the audio while it
+                    is downloaded, 'file' to download the mp4 first
+                    and convert it after.
+        :param converter: the process pool the 'file' conversion is
+                    handed to. Without it the conversion runs in
+                    the calling thread.
+        :param throttle: the bandwidth limit of the download.
+        :param progress: JobProgress to count the received bytes in."""
+        self.audio = audio_file
+        self.path = self._rebuild_path(path)
+        self.segments = segments
+        self.throttle = throttle
+        self.progress = progress
+        self.transcode = transcode
+        self.converter = converter
+        self.filename = audio_file.default_filename
+        self.mp4_location = self._build_location(self.path, self.filename)
+
+    def download_file(self) -> [Future, None]:
+        """General function to handle
+        file downloading.
+        :returns: Future of the mp3 conversion,
+        if it was handed to the converter."""
+        if self.transcode == 'stream':
+            self._stream_as_mp3()
+        else:
+            self._save_as_mp4()
+            return self._save_as_mp3()
+
+    def _stream_as_mp3(self) -> None:
+        """Convert the audio to mp3 while downloading it,
+        no mp4 file is written.
+        :raises: FileExistsError, if the mp3 file already exists.
+        :raises: ConversionError, if the encoder failed."""
+        StreamingTranscoder(self.audio, self._check_mp3_target(),
+                            throttle=self.throttle, progress=self.progress).transcode()
+
+    def _check_mp3_target(self) -> str:
+        """Check that the mp3 file does not exist yet.
+        :returns: the path of the mp3 file.
+        :raises: FileExistsError, if it does."""
+        mp3_file = self._build_mp3_path()
+        if os.path.exists(mp3_file):
+            raise FileExistsError(os.path.basename(mp3_file), self.path)
+        return mp3_file
+
+    def _save_as_mp4(self) -> None:
+        """Save file on the disk in mp4 format,
+        so it can be converted to mp3 later."""
+        self._download_stream(self.audio, self.path, self.segments,
+                              self.throttle, self.progress)
+
+    def _save_as_mp3(self) -> [Future, None]:
+        """General function to handle conversion
+        to mp3 and saving process. If there is a converter,
+        the conversion is only submitted to it.
+        :returns: Future of the submitted conversion."""
+        if self._check_existence():
+            if self.converter is not None:
+                return self.converter.submit(convert_to_mp3, self.mp4_location,
+                                             self._build_mp3_path())
+            self._convert_and_write()
+
+    def _convert_and_write(self) -> None:
+        """Convert the mp4 file with no frames to mp3,
+        write the audio file to the same folder
+        and remove the mp4 file."""
+        convert_to_mp3(self.mp4_location, self._build_mp3_path())
+
+    def _check_existence(self) -> bool:
+        """Check if the file to convert exists,
+        and the file that should be created does not.
+        :raises: FileExistError, if the mp3 file, with the
+        designated name already exists in the directory
+        with the mp4 file
+        :raises: FileNotFoundError, if the path to
+        the mp4 file does not actually lead to a file.
+        (should never happen, as the path was checked previously)"""
+        mp3_file = self._build_mp3_path()
+        if os.path.exists(self.mp4_location) and not os.path.exists(mp3_file):
+            return True
+        elif os.path.exists(mp3_file):
+            os.remove(self.mp4_location)
+            mp3_filename = mp3_file.rsplit('\\', maxsplit=1)[1]
+            raise FileExistsError(mp3_filename, self.path)
+        else:
+            print(self.path)
+            raise FileNotFoundError(self.path)
+
+    def _build_mp3_path(self) -> str:
+        """Build the path where mp3 file
+        is going to be saved."""
+        mp3_location = self.mp4_location.rsplit('.', maxsplit=1)[0] + '.mp3'
+        return mp3_location
+
+
+class NativeAudio(FileForDownloading):
+    """Class for downloading audio without re-encoding it.
+    An mp4 audio stream is saved as it is with the
+    .m4a extension, a webm (opus) one is remuxed with
+    stream copy into an .opus file."""
+    extensions = {'mp4': '.m4a', 'webm': '.opus'}
+
+    def __init__(self, audio_file: 'Stream', path: str, segments: int = 0,
+                 throttle: Throttle = None, progress: JobProgress = None) -> None:
+        self.audio = audio_file
+        self.path = self._rebuild_path(path)
+        self.segments = segments
+        self.throttle = throttle
+        self.progress = progress
+        self.location = self._build_location(self.path, audio_file.default_filename)
+        self.target_location = (self.location.rsplit('.', maxsplit=1)[0] +
+                                self.extensions.get(audio_file.subtype, '.m4a'))
+
+    def download_file(self) -> None:
+        """General function to handle
+        file downloading.
+        :raises: FileExistsError, if the file already exists.
+        :raises: ConversionError, if remuxing failed."""
+        self._check_target()
+        self._download_stream(self.audio, self.path, self.segments,
+                              self.throttle, self.progress)
+        self._finish()
+
+    def _check_target(self) -> None:
+        """:raises: FileExistsError, if the file already exists."""
+        if os.path.exists(self.target_location):
+            raise FileExistsError(os.path.basename(self.target_location), self.path)
+
+    def _finish(self) -> None:
+        """Turn the downloaded stream into the target file."""
+        if self.audio.subtype == 'webm':
+            remux(self.location, self.target_location)
+        else:
+            os.replace(self.location, self.target_location)
+
+
+class Video(FileForDownloading):
+    """Class for downloading videos. In the adaptive mode
+    the video-only and the audio-only streams are downloaded
+    at the same time and muxed into one mp4 file, which
+    gives resolutions above 720p the streams with sound
+    do not have."""
+
+    def __init__(self, video_file: 'YouTube', path: str,
+                 target: Target = Target(), segments: int = 0,
+                 throttle: Throttle = None, progress: JobProgress = None,
+                 adaptive: bool = False) -> None:
+        """:param target: the Target the stream is chosen by.
+        :param adaptive: True to download the adaptive streams."""
+        self.video = video_file
+        self.path = self._rebuild_path(path)
+        self.target = target
+        self.segments = segments
+        self.throttle = throttle
+        self.progress = progress
+        self.adaptive = adaptive
+        # the audio to mux the chosen stream with, if it is adaptive
+        self.audio_stream = None
+        # the stream chosen in place of the requested one,
+        # the file is downloaded anyway
+        self.warnings = []
+
+    def download_file(self, stream: 'Stream' = None) -> None:
+        """General function to handle downloading process.
+        :param stream: the Stream to download, if it was
+                    already selected with _select_stream.
+        If the requested video does not have the resolution
+        user provided, the closest one is downloaded and
+        InvalidResolution is left in warnings.
+        :raises: FileExistsError, if the muxed file already exists.
+        :raises: ConversionError, if muxing failed."""
+        stream = stream or self._select_stream()
+        if self.audio_stream is None:
+            self._download_stream(stream, self.path, self.segments,
+                                  self.throttle, self.progress)
+        else:
+            self._download_adaptive(stream)
+
+    def _download_adaptive(self, stream: 'Stream') -> None:
+        """Download the video and the audio at the same time,
+        the audio on a thread of its own, so it takes as long
+        as the slower of them. Then mux them into one file."""
+        self._check_target(stream)
+        progress = self.progress or JobProgress()
+        progress.begin(0)
+        (video, video_name), (audio, audio_name) = self._get_parts(stream)
+        with ThreadPoolExecutor(1) as executor:
+            audio_download = executor.submit(self._download_stream, audio, self.path,
+                                             self.segments, self.throttle,
+                                             StreamProgress(progress), audio_name)
+            self._download_stream(video, self.path, self.segments, self.throttle,
+                                  StreamProgress(progress), video_name)
+            audio_download.result()
+        self._mux(stream)
+
+    def _select_stream(self) -> 'Stream':
+        """Get the best Stream within the target, going down
+        the ladder of the video's streams (see select_stream).
+        In the adaptive mode it is a video-only one, and the
+        audio to go with it is kept in audio_stream.
+        If it is not the one asked for, InvalidResolution
+        naming both is added to warnings.
+        :raises: VideoUnavailable, if the video has no stream to choose."""
+        from pytube.exceptions import VideoUnavailable
+        if self.adaptive:
+            selection, self.audio_stream = select_adaptive(self.video.streams, self.target)
+        else:
+            selection = select_stream(self.video.streams, self.target)
+        if selection.stream is None:
+            raise VideoUnavailable(self.video.video_id)
+        if not selection.exact:
+            self.warnings.append(InvalidResolution(describe_target(self.target),
+                                                 describe_stream(selection.stream)))
+        return selection.stream
+
+    def _get_location(self, stream: 'Stream') -> str:
+        """Build the path of the muxed file."""
+        name = stream.default_filename.rsplit('.', maxsplit=1)[0]
+        return self._build_location(self.path, name + '.mp4')
+
+    def _get_parts(self, stream: 'Stream') -> list:
+        """Get the adaptive streams with the names of the files
+        they are downloaded into before muxing, so the
+        video and the audio (both .mp4) do not share one."""
+        name = stream.default_filename.rsplit('.', maxsplit=1)[0]
+        return [(stream, f'{name}.video.{stream.subtype}'),
+                (self.audio_stream, f'{name}.audio.{self.audio_stream.subtype}')]
+
+    def _check_target(self, stream: 'Stream') -> None:
+        """:raises: FileExistsError, if the muxed file already exists."""
+        if os.path.exists(location := self._get_location(stream)):
+            raise FileExistsError(os.path.basename(location), self.path)
+
+    def _mux(self, stream: 'Stream') -> None:
+        """Mux the downloaded video and audio into the target file."""
+        video, audio = (self._build_location(self.path, name)
+                        for _, name in self._get_parts(stream))
+        mux(video, audio, self._get_location(stream))
+
+
+class Batch:
+    """The jobs of one download command.
+    Several batches can share the same DownloadPool,
+    each of them keeps its own errors and can be
+    waited for separately."""
+
+    def __init__(self, store: JobStore = None, keep_finished: bool = True) -> None:
+        """:param store: JobStore to record the states
+                    of the batch jobs in.
+        :param keep_finished: False to forget the progress and
+                    the timings of every job once it is finished,
+                    so a batch of millions of links does not
+                    grow in memory. Only the totals are reported then."""
+        self.store = store
+        self.keep_finished = keep_finished
+        self.retry_budget = RetryBudget()
+        # set once a file of a batch refusing to go on
+        # without disk space for it did not fit
+        self.out_of_space = False
+        self.errors = []
+        # the problems of the jobs that were downloaded anyway
+        self.warnings = []
+        # the amount, the sum and the maximum of the timings of every stage
+        self.timings = {stage: [0, 0.0, 0.0] for stage in STAGES}
+        self.job_timings = {}
+        # the description of the stream chosen for every job
+        self.streams = {}
+        self.progress = {}
+        self.finished = {'done': 0, 'failed': 0, 'cancelled': 0}
+        self._pending = 0
+        self._condition = Condition()
+
+    def add(self, job) -> None:
+        """Register a job that was put in the pool's queue,
+        add its retries to the retry budget."""
+        with self._condition:
+            self._pending += 1
+        self.retry_budget.deposit()
+        self.get_progress(job).set_stage('queued')
+
+    def get_progress(self, job) -> JobProgress:
+        """Get the JobProgress of the job, publishing
+        to the process-wide ProgressBus."""
+        with self._condition:
+            if job.url not in self.progress:
+                self.progress[job.url] = JobProgress(job.url, get_bus())
+            return self.progress[job.url]
+
+    def task_done(self) -> None:
+        """Mark one of the batch jobs as finished,
+        no matter if it succeeded or not."""
+        with self._condition:
+            self._pending -= 1
+            self._condition.notify_all()
+
+    def add_error(self, error: Exception, job) -> None:
+        """Record the error for every link the job was made of,
+        as the same video may be requested by several links."""
+        self.errors.extend((error, source) for source in job.sources)
+
+    def add_warning(self, warning: Exception, job) -> None:
+        """Record a problem of a job that was finished anyway,
+        such as a stream chosen in place of the requested one,
+        for every link the job was made of."""
+        self.warnings.extend((warning, source) for source in job.sources)
+
+    def set_state(self, job, state: str, error: Exception = None) -> None:
+        """Publish the job's state as its progress stage and
+        record it in the store, if the batch has one."""
+        self.get_progress(job).set_stage(state)
+        if self.store is not None and job.record is not None:
+            self.store.set_state(job.record, state, None if error is None else repr(error))
+
+    def finish(self, job, error: Exception = None) -> None:
+        """Mark the job as finished. If it failed, record
+        the error for every link it was made of."""
+        state = 'done' if error is None else 'failed'
+        with self.timed(job, 'cleanup'):
+            if error is not None:
+                self.add_error(error, job)
+            self.set_state(job, state, error)
+        with self._condition:
+            self.finished[state] += 1
+            if not self.keep_finished:
+                self.progress.pop(job.url, None)
+                self.job_timings.pop(job.url, None)
+                self.streams.pop(job.url, None)
+        get_metrics().count('jobs_total', state=state)
+        if error is not None:
+            get_metrics().count('errors_total', error=error.__class__.__name__)
+        self.task_done()
+
+    def cancel(self, job) -> None:
+        """Mark a job that was not started as finished, without
+        recording it in the store, so it stays unfinished there
+        and is resumed by the next session."""
+        self.get_progress(job).set_stage('cancelled')
+        with self._condition:
+            self.finished['cancelled'] += 1
+            if not self.keep_finished:
+                self.progress.pop(job.url, None)
+        get_metrics().count('jobs_total', state='cancelled')
+        self.task_done()
+
+    @contextmanager
+    def timed(self, job, stage: str):
+        """Measure how long the block takes as
+        the time the job spent in the stage."""
+        ts = time()
+        try:
+            yield
+        finally:
+            self.record_timing(job, stage, time() - ts)
+
+    def record_timing(self, job, stage: str, seconds: float) -> None:
+        """Record the time the job spent in the stage, in the
+        process-wide metrics as well. The job is None for the
+        stages timed for the whole batch, such as parsing the links."""
+        with self._condition:
+            timings = self.timings[stage]
+            timings[:] = timings[0] + 1, timings[1] + seconds, max(timings[2], seconds)
+            if job is not None:
+                timings = self.job_timings.setdefault(job.url, {})
+                timings[stage] = timings.get(stage, 0.0) + seconds
+        get_metrics().observe(stage, seconds)
+
+    def record_stream(self, job, *streams: ['Stream', None]) -> None:
+        """Record which streams were chosen for the job."""
+        with self._condition:
+            self.streams[job.url] = ' + '.join(describe_stream(stream) for stream in streams
+                                               if stream is not None)
+
+    def join(self, timeout: float = None) -> bool:
+        """Block until every job of the batch is finished.
+        :returns: False, if the timeout passed first."""
+        return self.wait_pending(0, timeout)
+
+    def wait_pending(self, limit: int, timeout: float = None) -> bool:
+        """Block until at most `limit` jobs of the batch are unfinished.
+        :returns: False, if the timeout passed first."""
+        with self._condition:
+            return self._condition.wait_for(lambda: self._pending <= limit, timeout)
+
+    def get_report(self) -> dict:
+        """Describe the batch in a form that can be dumped to
+        json: the final state, the chosen stream and the stage timings
+        of every job (of the unfinished ones only, if the finished ones
+        are not kept), the amount of finished jobs, the totals of every stage,
+        the errors, the warnings and the process-wide metrics at the end of the batch."""
+        with self._condition:
+            jobs = [{'url': url, 'state': progress.stage, 'stream': self.streams.get(url),
+                     'timings': self.job_timings.get(url, {})}
+                    for url, progress in self.progress.items()]
+            stages = {stage: {'count': count, 'total': total, 'max': longest}
+                      for stage, (count, total, longest) in self.timings.items() if count}
+            finished = dict(self.finished)
+        return {'jobs': jobs, 'finished': finished, 'stages': stages,
+                'errors': [describe_error(error, link) for error, link in self.errors],
+                'warnings': [describe_error(warning, link) for warning, link in self.warnings],
+                'metrics': get_metrics().get_snapshot()}
+
+    def get_timings_summary(self) -> str:
+        """Describe how much time resolving links
+        and downloading files took, separately."""
+        summary = []
+        for stage, (count, total, longest) in self.timings.items():
+            if count:
+                summary.append(f'{stage}: {count} job(s), '
+                               f'{total / count:.2f}s average, '
+                               f'{longest:.2f}s max')
+        return '; '.join(summary)
+
+
+def describe_error(error: Exception, link: str) -> dict:
+    """Describe an error of a link in a form
+    that can be dumped to json."""
+    return {'error': error.__class__.__name__, 'link': link,
+            'details': list(map(str, error.args))}
+
+
+Job = namedtuple('Job', 'f_type path file url options batch sources record size')
+# the size of the file is only known once it is resolved
+Job.__new__.__defaults__ = (None,)
+
+
+def resolve(job: Job, cache: StreamCache = None) -> Job:
+    """Create the YouTube instance of the job's url and
+    fetch the stream manifest, or take the stream list
+    from the cache, if there is one.
+    :returns: the job with the resolved file."""
+    use_cache = cache is not None and job.options.get('cache') != 'off'
+    if use_cache and (video := cache.get(job.url)) is not None:
+        return job._replace(file=video)
+    from pytube import YouTube
+    video = YouTube(job.url)
+    video.streams  # the property fetches and caches the manifest
+    if use_cache:
+        cache.put(video)
+    return job._replace(file=video)
+
+
+def is_rejected(job: Job, error: Exception) -> bool:
+    """Tell if the job failed because the media server
+    rejected the urls of its cached stream list, which
+    expired early or were revoked."""
+    return (isinstance(job.file, CachedVideo) and isinstance(error, HTTPError)
+            and error.code in REJECTED_STATUSES)
+
+
+def get_audio_stream(video: 'YouTube', audio_format: str = 'mp3') -> 'Stream':
+    """Choose the audio stream to download: the best opus
+    (webm) one for the opus format, if there is one,
+    otherwise the one pytube picks."""
+    if audio_format == 'opus':
+        if stream := video.streams.filter(only_audio=True, subtype='webm').order_by('abr').last():
+            return stream
+    return video.streams.get_audio_only()
+
+
+@contextmanager
+def reserve_space(job: Job, *streams: ['Stream', None]):
+    """Hold the disk space the streams of the job need
+    while they are downloaded, as the diskcheck option says.
+    :raises: NotEnoughSpace, if the file does not fit, or
+    an earlier file of a refusing batch did not."""
+    check = job.options.get('diskcheck', DEFAULT_CHECK)
+    if check == 'off' or (size := get_size(*streams)) is None:
+        yield
+        return
+    if job.batch.out_of_space:
+        raise NotEnoughSpace(job.path)
+    try:
+        with get_ledger().reserve(job.path, size, job.batch.get_progress(job)):
+            yield
+    except NotEnoughSpace:
+        if check == 'refuse':
+            job.batch.out_of_space = True
+        raise
+
+
+def get_stream_host(video: 'YouTube') -> str:
+    """Get the host key of the server the streams
+    of a resolved video are downloaded from."""
+    streams = video.streams
+    return get_host_key(streams[0].url) if len(streams) else ''
+
+
+def measure(job: Job) -> Job:
+    """Find the size of the stream the resolved job is
+    going to download, if its batch is scheduled by size.
+    The size is requested from the server if the manifest
+    did not have it, pytube keeps it for the download.
+    :returns: the job with the size."""
+    if job.options.get('schedule', DEFAULT_POLICY) == 'fifo':
+        return job
+    if job.f_type == 'audio':
+        return job._replace(size=get_size(get_audio_stream(job.file,
+                                                           job.options.get('format', 'mp3'))))
+    video = Video(job.file, job.path, get_target(job.options),
+                  adaptive=job.options.get('adaptive') == 'on')
+    return job._replace(size=get_size(video._select_stream(), video.audio_stream))
+
+
+class Resolver(Thread):
+    """A thread that turns urls of the queued jobs
+    into pytube.YouTube instances and fetches their
+    stream manifests, then passes the jobs to the
+    Downloader threads."""
+
+    def __init__(self, queue: Queue, resolved: Queue, cache: StreamCache = None) -> None:
+        """Create a new thread.
+        :param queue: queue.Queue with jobs that have
+                    only an url. Putting None in the queue
+                    stops the thread.
+        :param resolved: queue.Queue the resolved jobs
+                    are put to. If it has a maxsize, the
+                    thread waits until there is space in it.
+        :param cache: StreamCache to take the streams from
+                    and to save the newly resolved ones to."""
+        Thread.__init__(self)
+        self.queue = queue
+        self.resolved = resolved
+        self.cache = cache
+        self.daemon = True
+
+    def run(self) -> None:
+        """Run the thread until it gets None from the queue."""
+        while (job := self.queue.get()) is not None:
+            job.batch.set_state(job, 'resolving')
+            try:
+                with get_metrics().track_inprogress('active_workers', stage='resolve'), \
+                        job.batch.timed(job, 'resolve'):
+                    job = call_with_retries(partial(self.resolve, job), get_host_key(job.url),
+                                            job.batch.retry_budget, stage='resolve')
+            except Exception as e:
+                # a changed page layout breaks pytube with any kind of
+                # error, the job fails and the thread goes on with the next one
+                job.batch.finish(job, e)
+            else:
+                self.resolved.put(job)
+            finally:
+                self.queue.task_done()
+        self.queue.task_done()
+
+    def resolve(self, job: Job) -> Job:
+        """Create the YouTube instance and fetch
+        the stream manifest, so downloading can start
+        right after the job is taken by a Downloader.
+        A cached stream list is used instead, if there is one.
+        The size of the file is found as well, if the job is
+        scheduled by size, so the queue can order it."""
+        return measure(resolve(job, self.cache))
+
+
+class Downloader(Thread):
+    """A thread to download files,
+    that are of pytube.YouTube or pytube.Stream
+    type, and that are added to the queue"""
+
+    def __init__(self, queue: Queue, converter: ConverterPool = None,
+                 cache: StreamCache = None) -> None:
+        """Create a new thread.
+        :param queue: queue.Queue instance, can be
+                    empty. The process will start
+                    as soon as something appears in the queue.
+                    Putting None in the queue stops the thread.
+        :param converter: the process pool mp3 conversion
+                    is handed to, so the thread can go on
+                    downloading while it runs.
+        :param cache: StreamCache the jobs were resolved with,
+                    a rejected entry is removed from it."""
+        Thread.__init__(self)
+        self.queue = queue
+        self.converter = converter
+        self.cache = cache
+        self.daemon = True
+
+    def run(self) -> None:
+        """Run the thread. If the queue is empty,
+        the thread will be running anyways, waiting
+        for something to appear in the queue."""
+        while (job := self.queue.get()) is not None:
+            conversion = error = None
+            job.batch.set_state(job, 'downloading')
+            try:
+                with get_metrics().track_inprogress('active_workers', stage='download'):
+                    try:
+                        conversion = self.download(job)
+                    except HTTPError as e:
+                        if not is_rejected(job, e):
+                            raise
+                        job = self.resolve_again(job)
+                        conversion = self.download(job)
+            except Exception as e:
+                # the expected errors (FileExistsError, NotEnoughSpace...)
+                # and any other one fail the job, the thread goes on
+                error = e
+            finally:
+                if conversion is None:
+                    job.batch.finish(job, error)
+                else:
+                    job.batch.set_state(job, 'converting')
+                    conversion.add_done_callback(partial(self._finish_conversion, job))
+                self.queue.task_done()
+        self.queue.task_done()
+
+    def download(self, job: Job) -> [Future, None]:
+        """Download the job's file, repeating the attempts
+        that may succeed the next time."""
+        return call_with_retries(partial(self.download_file, job), get_stream_host(job.file),
+                                 job.batch.retry_budget, stage='download')
+
+    def resolve_again(self, job: Job) -> Job:
+        """Remove the job's rejected streams from the cache
+        and resolve it anew, it is not taken from the cache
+        the second time."""
+        self.cache.invalidate(job.url)
+        job.batch.set_state(job, 'resolving')
+        with job.batch.timed(job, 'resolve'):
+            job = call_with_retries(partial(resolve, job, self.cache), get_host_key(job.url),
+                                    job.batch.retry_budget, stage='resolve')
+        job.batch.set_state(job, 'downloading')
+        return job
+
+    @staticmethod
+    def _finish_conversion(job: Job, conversion: Future) -> None:
+        """Record the result of the conversion handed to
+        the converter and mark the job as finished."""
+        try:
+            job.batch.record_timing(job, 'convert', conversion.result())
+        except (FileNotFoundError, ConversionError) as e:
+            job.batch.finish(job, e)
+        except Exception as e:
+            # a crashed worker process, for example
+            job.batch.finish(job, ConversionError(job.url, repr(e)))
+        else:
+            job.batch.finish(job)
+
+    def download_file(self, job: Job) -> [Future, None]:
+        """Download the job's file.
+        :returns: Future of the mp3 conversion,
+        if it was handed to the converter."""
+        audio_format = job.options.get('format', 'mp3')
+        segments = job.options.get('segments', 0)
+        throttle = Throttle(job.options.get('joblimit', 0))
+        progress = job.batch.get_progress(job)
+        if job.f_type == 'audio':
+            with job.batch.timed(job, 'select'):
+                stream = get_audio_stream(job.file, audio_format)
+            job.batch.record_stream(job, stream)
+            with job.batch.timed(job, 'download'), reserve_space(job, stream):
+                if audio_format in ('native', 'opus'):
+                    NativeAudio(stream, job.path, segments, throttle, progress).download_file()
+                    return None
+                return Audio(stream, job.path, segments, job.options.get('transcode', 'stream'),
+                             self.converter, throttle, progress).download_file()
+        file = Video(job.file, job.path, get_target(job.options), segments, throttle, progress,
+                     adaptive=job.options.get('adaptive') == 'on')
+        with job.batch.timed(job, 'select'):
+            stream = file._select_stream()
+        job.batch.record_stream(job, stream, file.audio_stream)
+        with job.batch.timed(job, 'download'), reserve_space(job, stream, file.audio_stream):
+            file.download_file(stream)
+        for warning in file.warnings:
+            job.batch.add_warning(warning, job)
+
+
+class ThreadGroup:
+    """Threads of the same kind reading one queue.
+    Putting None in the queue stops one of them, so
+    the group only counts how many should be running
+    and remembers every started thread to join it later."""
+
+    def __init__(self, queue: Queue, create: Callable[[], Thread]) -> None:
+        self.queue = queue
+        self.create = create
+        self.threads = []
+        self.size = 0
+
+    def resize(self, amount: int) -> None:
+        """Start new threads or stop the extra ones.
+        A stopped thread finishes its current job first.
+        :raises: ValueError, if the amount is less than one."""
+        if amount < 1:
+            raise ValueError('The amount of threads should be at least 1.')
+        self.threads = [i for i in self.threads if i.is_alive()]
+        while self.size < amount:
+            thread = self.create()
+            thread.start()
+            self.threads.append(thread)
+            self.size += 1
+        while self.size > amount:
+            self.queue.put(None)
+            self.size -= 1
+
+    def stop(self) -> None:
+        """Stop all the threads and wait for them."""
+        for i in range(self.size):
+            self.queue.put(None)
+        for i in self.threads:
+            i.join()
+        self.threads = []
+        self.size = 0
+
+
+class DownloadPool:
+    """A fixed number of Resolver and Downloader threads
+    living for the whole process. All the download
+    commands put their jobs in the same queue,
+    so the amount of threads does not grow
+    with the amount of requested links.
+    Links are resolved ahead of downloading: at most
+    `lookahead` resolved jobs wait for a free Downloader."""
+
+    def __init__(self, workers: int = DEFAULT_WORKERS,
+                 lookahead: int = DEFAULT_LOOKAHEAD, cache: StreamCache = None) -> None:
+        self.resolve_queue = Queue()
+        self.queue = ScheduledQueue(lookahead)
+        self.cache = cache
+        self.closed = False
+        self._lock = Lock()
+        self.resolvers = ThreadGroup(
+            self.resolve_queue, lambda: Resolver(self.resolve_queue, self.queue, self.cache)
+        )
+        self.converter = ConverterPool(os.cpu_count())
+        self.workers = ThreadGroup(self.queue,
+                                   lambda: Downloader(self.queue, self.converter, self.cache))
+        self.resize(workers, lookahead)
+        get_metrics().register_gauge('queue_depth', self.resolve_queue.qsize, queue='resolve')
+        get_metrics().register_gauge('queue_depth', self.queue.qsize, queue='download')
+
+    def resize(self, workers: int = None, lookahead: int = None) -> None:
+        """Change the amount of Downloader threads
+        and the amount of Resolver threads, which is also
+        the size of the resolved jobs queue.
+        :raises: ValueError, if an amount is less than one."""
+        if workers is not None:
+            self.workers.resize(workers)
+        if lookahead is not None:
+            self.resolvers.resize(lookahead)
+            with self.queue.mutex:
+                self.queue.maxsize = lookahead
+                self.queue.not_full.notify_all()
+
+    def submit(self, job: Job) -> None:
+        """Add a job to the queue. A job submitted
+        after the pool was shut down is cancelled."""
+        job.batch.add(job)
+        with self._lock:
+            if not self.closed:
+                self.resolve_queue.put(job)
+                return
+        job.batch.cancel(job)
+
+    def shutdown(self, cancel: bool = False) -> None:
+        """Let the threads finish the jobs
+        that are already queued, then stop them.
+        :param cancel: True to cancel the queued jobs instead,
+                    only the ones already being resolved,
+                    downloaded or converted are finished.
+                    The cancelled ones are left unfinished
+                    in the job store."""
+        with self._lock:
+            self.closed = True
+        if cancel:
+            self._cancel_queued(self.resolve_queue)
+        self.resolvers.stop()
+        if cancel:
+            self._cancel_queued(self.queue)
+        self.workers.stop()
+        self.converter.shutdown(cancel_futures=cancel)
+
+    @staticmethod
+    def _cancel_queued(queue: Queue) -> None:
+        """Take every job out of the queue and cancel it.
+        The None put to stop a thread are put back."""
+        stops = 0
+        while True:
+            try:
+                job = queue.get_nowait()
+            except Empty:
+                break
+            if job is None:
+                stops += 1
+            else:
+                job.batch.cancel(job)
+            queue.task_done()
+        for i in range(stops):
+            queue.put(None)
+
+
+_pool = None
+
+
+def get_pool(workers: int = None, lookahead: int = None,
+             cache: Callable[[], [StreamCache, None]] = StreamCache) -> DownloadPool:
+    """Get the process-wide DownloadPool,
+    create it on the first call.
+    :param workers: if given, the pool is resized
+    to this amount of Downloader threads.
+    :param lookahead: if given, the pool is resized
+    to this amount of Resolver threads.
+    :param cache: creates the StreamCache of the pool
+    (or returns None, for no cache) on the first call."""
+    global _pool
+    if _pool is None:
+        _pool = DownloadPool(workers or DEFAULT_WORKERS,
+                             lookahead or DEFAULT_LOOKAHEAD, cache())
+    else:
+        _pool.resize(workers, lookahead)
+    return _pool
+
+
+def shutdown_pool(cancel: bool = False) -> None:
+    """Stop the process-wide DownloadPool, if it was started.
+    :param cancel: True to cancel the queued jobs instead
+    of finishing them, as after an interrupt."""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel)
+        _pool = None
+
+
+class ParallelDownloader:
+    """Class for downloading multiple
+    file at once using threading."""
+    # what the links of a string are separated by
+    separator = ', '
+
+    def __init__(self, queries: [str, Iterable[str]], options: dict,
+                 pool: DownloadPool = None, store: JobStore = None) -> None:
+        """Initialize the downloader.
+        :param queries: a string containing urls
+        that lead to YouTube videos, playlists or
+        channels, separated one from another by the
+        separator, or an iterable of such strings (such as the lines
+        of a links file), read only as jobs are finished.
+        The progress and timings of the finished jobs
+        are only kept for a string.
+        :param pool: the DownloadPool to run the jobs on,
+        the process-wide one is used by default.
+        :param store: JobStore to record the jobs in,
+        so they can be resumed after a restart."""
+        streamed = not isinstance(queries, str)
+        self.requested_videos = queries if streamed else queries.split(self.separator)
+        self.requested_collections = []
+        self.options = options
+        self.requested_type = self.options.get('type')
+        self.page_lookahead = self.options.get('pages', DEFAULT_PAGE_LOOKAHEAD)
+        self.backlog = DEFAULT_BACKLOG
+        self.store = store
+        self._seen = RecentSet(RECENT_LINKS)
+        self.batch = Batch(store, keep_finished=not streamed)
+        self.errors = self.batch.errors
+        self.warnings = self.batch.warnings
+        self.path = self._get_path()
+        self.pool = pool
+        self.stopped = False
+
+    def download_all(self) -> list:
+        """Download all videos links to
+        which were given when initializing the object."""
+        if self.errors:
+            return self.errors
+        if self.pool is None:
+            self.pool = get_pool()
+        self._build_queue()
+        return self.errors
+
+    def _build_queue(self) -> None:
+        """Add task to queue, so active
+        threads can start working with it's contains.
+        The links are resolved by the pool's Resolver threads.
+        Jobs are submitted a chunk at a time, a chunk once
+        at most `backlog` jobs of the batch are unfinished.
+        No more jobs are submitted once the downloader is stopped."""
+        for jobs in self._build_job_chunks():
+            self.batch.wait_pending(self.backlog)
+            if self.stopped:
+                break
+            for job in jobs:
+                self.pool.submit(job)
+        self.batch.join()
+
+    def stop(self) -> None:
+        """Stop submitting jobs, the submitted ones are still
+        waited for. The links that were not turned into jobs
+        are dropped, the jobs the pool cancels are left
+        unfinished in the store."""
+        self.stopped = True
+
+    def _build_job_chunks(self) -> Iterator[list[Job]]:
+        """Turn the requested links into jobs, a chunk of
+        links at a time, then expand the requested playlists
+        and channels. The links are only read when the next
+        chunk is wanted.
+        :returns: a generator of lists of jobs."""
+        for links in chunked(self.requested_videos, LINKS_CHUNK):
+            if jobs := self._build_jobs(links):
+                yield jobs
+        yield from self._expand_jobs()
+
+    def _build_jobs(self, links: list[str]) -> list[Job]:
+        """Turn the video links into jobs, put the
+        playlist and channel links aside to be expanded
+        by _expand_jobs. Malformed links are excluded
+        before any request is made, links to the same video
+        make a single job."""
+        from pytube.exceptions import RegexMatchError
+        with self.batch.timed(None, 'parse'):
+            collections, links = split_collections(links)
+            videos, malformed = coalesce(links)
+        for url in collections:
+            if url not in self.requested_collections:
+                self.requested_collections.append(url)
+        for url in malformed:
+            self.errors.append((RegexMatchError('coalesce', url), url))
+        jobs = []
+        for url, sources in videos.items():
+            if url not in self._seen:
+                self._seen.add(url)
+                jobs.append(self._build_job(url, tuple(sources)))
+        return jobs
+
+    def _expand_jobs(self) -> Iterator[list[Job]]:
+        """Turn the videos of the requested playlists and
+        channels into jobs, a page at a time. A page is
+        only requested when the previous one was taken, so
+        jobs do not wait for the whole collection to be listed.
+        Videos that already have a job in the batch are skipped.
+        A collection that could not be expanded is recorded
+        as an error of the batch, the rest are expanded anyway.
+        :returns: a generator of lists of jobs."""
+        for url in self.requested_collections:
+            try:
+                for page in Expansion(url, self.page_lookahead):
+                    jobs = []
+                    for video in page:
+                        if video not in self._seen:
+                            self._seen.add(video)
+                            jobs.append(self._build_job(video, (video,)))
+                    if jobs:
+                        yield jobs
+            except Exception as e:
+                # pytube breaks with any kind of error on a changed page
+                self.errors.append((e, url))
+
+    def _build_job(self, url: str, sources: tuple) -> Job:
+        """Create a job of the batch, record it in the store."""
+        record = None
+        if self.store is not None:
+            record = self.store.add(self.requested_type, self.path, url,
+                                    self.options, sources)
+        return Job(self.requested_type, self.path, None, url,
+                   self.options, self.batch, sources, record)
+
+    @classmethod
+    def resume(cls, store: JobStore, jobs: list[StoredJob],
+               pool: DownloadPool = None) -> Batch:
+        """Submit the unfinished jobs found in the store
+        and wait until they are finished.
+        :returns: the Batch of the resumed jobs."""
+        batch = Batch(store)
+        pool = pool or get_pool()
+        for stored in jobs:
+            store.set_state(stored.record, 'queued')
+            pool.submit(Job(stored.f_type, stored.path, None, stored.url,
+                            stored.options, batch, stored.sources, stored.record))
+        batch.join()
+        return batch
+
+    def _get_path(self) -> str:
+        """Check the if there user provided a
+        custom downloading path. If he did, the path
+        will be checked in order to make sure it exists.
+        If he did not, default path for downloading the
+        designated file type will be used."""
+        if path := self._check_custom_path():
+            return path
+        else:
+            return self._get_default_path()
+
+    def _get_default_path(self) -> str:
+        """Get the folder the files are downloaded to,
+        if no custom path was given."""
+        return os.path.curdir
+
+    def _check_custom_path(self) -> [None, str]:
+        """Check if a custom path is provide
+        and if it is real.
+        :returns: None, if the custom path is not provided.
+        :returns: str, if it is and it's valid.
+        :raises: FileNotFoundError, if it is and it's invalid."""
+        if not (location := self.options.get('to')):
+            return None
+        if not os.path.isdir(location):
+            self.errors.append((FileNotFoundError(location), location))
+            return None
+        else:
+            return location
+
+
+class AsyncParallelDownloader(ParallelDownloader):
+    """Class for downloading multiple files at once
+    on a single asyncio event loop. Every job is a coroutine
+    and the byte ranges are fetched with non-blocking sockets,
+    so thousands of downloads can wait on the network
+    at the same time without a thread for each of them.
+    pytube resolves links synchronously, so resolving
+    runs on a small thread pool, and mp3 conversion goes
+    to a process pool, the same as with the threads engine."""
+
+    def __init__(self, queries: str, options: dict, store: JobStore = None,
+                 concurrency: int = DEFAULT_CONCURRENCY,
+                 resolvers: int = DEFAULT_LOOKAHEAD) -> None:
+        """Initialize the downloader.
+        :param concurrency: the maximum amount
+                    of files downloaded at once.
+        :param resolvers: the amount of threads resolving links."""
+        super().__init__(queries, options, None, store)
+        self.concurrency = concurrency
+        self.resolvers = resolvers
+        self.cache = StreamCache()
+
+    def download_all(self) -> list:
+        """Download all videos links to
+        which were given when initializing the object."""
+        import asyncio
+        if self.errors:
+            return self.errors
+        asyncio.run(self._run_all())
+        return self.errors
+
+    async def _run_all(self) -> None:
+        """Run every job and wait until they are finished.
+        The links are read (and playlists and channels expanded)
+        on a thread of the loop's executor, a chunk of jobs is
+        started once at most `backlog` jobs are left."""
+        import asyncio
+        from async_download import AsyncConnectionPool
+        from connection_pool import get_connection_pool
+        loop = asyncio.get_running_loop()
+        slots = PrioritySemaphore(self.concurrency)
+        shared = get_connection_pool()
+        connections = AsyncConnectionPool(shared.max_per_host, shared.keep_alive)
+        try:
+            with ThreadPoolExecutor(self.resolvers) as resolver, \
+                    ConverterPool(os.cpu_count()) as converter:
+                run = partial(self._run_job, slots=slots, resolver=resolver,
+                              converter=converter, connections=connections)
+                tasks = set()
+                chunks = self._build_job_chunks()
+                while (jobs := await loop.run_in_executor(None, next, chunks, None)) is not None:
+                    while len(tasks) > self.backlog:
+                        done, tasks = await asyncio.wait(tasks,
+                                                         return_when=asyncio.FIRST_COMPLETED)
+                        for task in done:
+                            task.result()
+                    tasks.update(asyncio.create_task(run(job)) for job in jobs)
+                await asyncio.gather(*tasks)
+        finally:
+            connections.close()
+
+    async def _run_job(self, job: Job, slots: PrioritySemaphore, resolver: ThreadPoolExecutor,
+                       converter: ConverterPool, connections: 'AsyncConnectionPool') -> None:
+        """Resolve, download and convert one file,
+        record its errors and timings in the batch."""
+        import asyncio
+        loop = asyncio.get_running_loop()
+        metrics = get_metrics()
+        self.batch.add(job)
+        self.batch.set_state(job, 'resolving')
+        try:
+            with metrics.track_inprogress('active_workers', stage='resolve'), \
+                    self.batch.timed(job, 'resolve'):
+                job = await call_with_retries_async(
+                    partial(loop.run_in_executor, resolver, self._resolve, job),
+                    get_host_key(job.url), self.batch.retry_budget, stage='resolve'
+                )
+        except Exception as e:
+            # a changed page layout breaks pytube with any kind of
+            # error, the job fails and the rest of the batch goes on
+            self.batch.finish(job, e)
+            return
+        with metrics.track_inprogress('queue_depth', queue='slots'):
+            await slots.acquire(get_priority(job.options.get('schedule', DEFAULT_POLICY),
+                                             job.size))
+        try:
+            self.batch.set_state(job, 'downloading')
+            with metrics.track_inprogress('active_workers', stage='download'):
+                try:
+                    conversion = await self._download(job, converter, connections)
+                except HTTPError as e:
+                    if not is_rejected(job, e):
+                        raise
+                    # the cached urls are dropped and the job is resolved once more
+                    self.cache.invalidate(job.url)
+                    self.batch.set_state(job, 'resolving')
+                    with self.batch.timed(job, 'resolve'):
+                        job = await call_with_retries_async(
+                            partial(loop.run_in_executor, resolver, self._resolve, job),
+                            get_host_key(job.url), self.batch.retry_budget, stage='resolve'
+                        )
+                    self.batch.set_state(job, 'downloading')
+                    conversion = await self._download(job, converter, connections)
+        except Exception as e:
+            # the expected errors (FileExistsError, NotEnoughSpace...)
+            # and any other one fail the job, the batch goes on
+            self.batch.finish(job, e)
+            return
+        finally:
+            slots.release()
+        if conversion is not None:
+            self.batch.set_state(job, 'converting')
+            try:
+                self.batch.record_timing(job, 'convert', await asyncio.wrap_future(conversion))
+            except (FileNotFoundError, ConversionError) as e:
+                self.batch.finish(job, e)
+                return
+            except Exception as e:
+                self.batch.finish(job, ConversionError(job.url, repr(e)))
+                return
+        self.batch.finish(job)
+
+    def _resolve(self, job: Job) -> Job:
+        """Resolve the job on a resolver thread,
+        find its size if it is scheduled by size."""
+        return measure(resolve(job, self.cache))
+
+    async def _download(self, job: Job, converter: ConverterPool,
+                        connections: 'AsyncConnectionPool') -> [Future, None]:
+        """Download the job's file, repeating the attempts
+        that may succeed the next time."""
+        return await call_with_retries_async(
+            partial(self._download_file, job, converter, connections),
+            get_stream_host(job.file), self.batch.retry_budget, stage='download'
+        )
+
+    @staticmethod
+    async def _download_file(job: Job, converter: ConverterPool,
+                             connections: 'AsyncConnectionPool') -> [Future, None]:
+        """Download the job's file, the same way
+        Downloader.download_file does it.
+        :returns: Future of the mp3 conversion,
+        if it was handed to the converter."""
+        import asyncio
+        from async_download import AsyncStreamDownload, AsyncStreamingTranscoder
+        segments = job.options.get('segments', 0)
+        audio_format = job.options.get('format', 'mp3')
+        throttle = Throttle(job.options.get('joblimit', 0))
+        progress = job.batch.get_progress(job)
+        video = None
+        with job.batch.timed(job, 'select'):
+            if job.f_type == 'audio':
+                stream = get_audio_stream(job.file, audio_format)
+            else:
+                video = Video(job.file, job.path, get_target(job.options), segments,
+                              adaptive=job.options.get('adaptive') == 'on')
+                stream = video._select_stream()
+        audio = video.audio_stream if video is not None else None
+        job.batch.record_stream(job, stream, audio)
+        with job.batch.timed(job, 'download'), reserve_space(job, stream, audio):
+            if audio is not None:
+                video._check_target(stream)
+                progress.begin(0)
+                downloads = [asyncio.ensure_future(
+                    AsyncStreamDownload(part, segments, pool=connections, throttle=throttle,
+                                        progress=StreamProgress(progress)).download(video.path, name)
+                ) for part, name in video._get_parts(stream)]
+                try:
+                    await asyncio.gather(*downloads)
+                except BaseException:
+                    for download in downloads:
+                        download.cancel()
+                    raise
+                await asyncio.get_running_loop().run_in_executor(None, video._mux, stream)
+            elif video is not None:
+                await AsyncStreamDownload(stream, segments, pool=connections, throttle=throttle,
+                                          progress=progress).download(video.path)
+            elif audio_format in ('native', 'opus'):
+                file = NativeAudio(stream, job.path, segments)
+                file._check_target()
+                await AsyncStreamDownload(stream, segments, pool=connections, throttle=throttle,
+                                          progress=progress).download(file.path)
+                await asyncio.get_running_loop().run_in_executor(None, file._finish)
+            else:
+                file = Audio(stream, job.path, segments,
+                             job.options.get('transcode', 'stream'), converter)
+                if file.transcode == 'stream':
+                    await AsyncStreamingTranscoder(stream, file._check_mp3_target(),
+                                                   pool=connections, throttle=throttle,
+                                                   progress=progress).transcode()
+                else:
+                    await AsyncStreamDownload(stream, segments, pool=connections,
+                                              throttle=throttle,
+                                              progress=progress).download(file.path)
+                    return file._save_as_mp3()
+        if video is not None:
+            for warning in video.warnings:
+                job.batch.add_warning(warning, job)
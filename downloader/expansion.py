@@ -0,0 +1,88 @@
+from queue import Queue, Full
+from threading import Thread, Event
+from typing import Callable, Iterator
+
+from links import get_collection_kind, canonicalise
+
+
+# the amount of pages of a playlist or a channel fetched
+# ahead of downloading; a page has up to 100 videos
+DEFAULT_PAGE_LOOKAHEAD = 2
+SITE_URL = 'https://www.youtube.com'
+# how often a fetching thread blocked on a full queue
+# checks whether the expansion was closed, in seconds
+CLOSE_CHECK_INTERVAL = 0.5
+
+
+def iter_pages(url: str) -> Iterator[list]:
+    """Page through the videos of a playlist or a channel,
+    one request per page, only when the next page is wanted.
+    :returns: a generator of lists of watch urls.
+    :raises: RegexMatchError, if the link has no playlist
+    id or channel name, or the page could not be parsed.
+    :raises: URLError, if a page could not be requested."""
+    from pytube import Playlist, Channel
+    from pytube.exceptions import RegexMatchError
+    try:
+        collection = Channel(url) if get_collection_kind(url) == 'channel' else Playlist(url)
+        for page in collection._paginate():
+            yield [video for path in page if (video := canonicalise(SITE_URL + path))]
+    except KeyError:
+        raise RegexMatchError('iter_pages', url)
+
+
+class Expansion:
+    """The videos of a playlist or a channel, page by page.
+    Pages are fetched by a background thread, at most
+    `lookahead` of them wait to be taken, so downloading
+    can start after the first page and memory does not grow
+    with the size of the collection. Iterate it to get the
+    pages; errors of the fetching thread are raised there."""
+
+    def __init__(self, url: str, lookahead: int = DEFAULT_PAGE_LOOKAHEAD,
+                 fetch: Callable[[str], Iterator[list]] = iter_pages) -> None:
+        """:param lookahead: the amount of pages fetched ahead.
+        :param fetch: the function paging through the collection."""
+        self.url = url
+        self.fetch = fetch
+        self._pages = Queue(max(lookahead, 1))
+        self._closed = Event()
+        self._thread = None
+
+    def __iter__(self) -> Iterator[list]:
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+        try:
+            while (page := self._pages.get()) is not None:
+                if isinstance(page, Exception):
+                    raise page
+                yield page
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        """Stop fetching pages, if the rest is not needed."""
+        self._closed.set()
+
+    def _run(self) -> None:
+        """Fetch the pages until the collection ends,
+        then put None (or the error, if one happened)."""
+        try:
+            for page in self.fetch(self.url):
+                if not self._put(page):
+                    return
+        except Exception as e:
+            self._put(e)
+        else:
+            self._put(None)
+
+    def _put(self, item) -> bool:
+        """Wait for a free place in the queue.
+        :returns: False, if the expansion was closed first."""
+        while not self._closed.is_set():
+            try:
+                self._pages.put(item, timeout=CLOSE_CHECK_INTERVAL)
+                return True
+            except Full:
+                continue
+        return False
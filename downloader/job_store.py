@@ -0,0 +1,76 @@
+import json
+import sqlite3
+from collections import namedtuple
+from threading import Lock
+from time import time
+
+
+DEFAULT_STORE_LOCATION = 'pronamka_downloader_jobs.sqlite3'
+STATES = ('queued', 'resolving', 'downloading', 'converting', 'done', 'failed')
+FINISHED_STATES = ('done', 'failed')
+
+StoredJob = namedtuple('StoredJob', 'record f_type path url options sources state')
+
+
+class JobStore:
+    """A durable record of the download jobs, kept in
+    an SQLite file. Every job goes through the states
+    queued, resolving, downloading, (converting), and ends
+    either done or failed, so the jobs that were not finished
+    when the process died can be found and started again."""
+
+    def __init__(self, location: str = DEFAULT_STORE_LOCATION) -> None:
+        self.location = location
+        self._lock = Lock()
+        self._connection = sqlite3.connect(location, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'id INTEGER PRIMARY KEY, f_type TEXT, path TEXT, url TEXT, '
+                'options TEXT, sources TEXT, state TEXT, error TEXT, updated REAL)'
+            )
+
+    def add(self, f_type: str, path: str, url: str,
+            options: dict, sources: tuple) -> int:
+        """Record a new queued job.
+        :returns: the id of the job's record."""
+        with self._lock, self._connection:
+            cursor = self._connection.execute(
+                'INSERT INTO jobs (f_type, path, url, options, sources, state, updated) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (f_type, path, url, json.dumps(options), json.dumps(sources), 'queued', time())
+            )
+        return cursor.lastrowid
+
+    def set_state(self, record: int, state: str, error: str = None) -> None:
+        """Move the job to another state.
+        :raises: ValueError, if the state is unknown."""
+        if state not in STATES:
+            raise ValueError(f'Unknown job state "{state}".')
+        with self._lock, self._connection:
+            self._connection.execute(
+                'UPDATE jobs SET state = ?, error = ?, updated = ? WHERE id = ?',
+                (state, error, time(), record)
+            )
+
+    def get_unfinished(self) -> list:
+        """Get the jobs that are neither done nor failed,
+        in the order they were added."""
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT id, f_type, path, url, options, sources, state FROM jobs '
+                'WHERE state NOT IN (?, ?) ORDER BY id', FINISHED_STATES
+            ).fetchall()
+        return [StoredJob(record, f_type, path, url, json.loads(options),
+                          tuple(json.loads(sources)), state)
+                for record, f_type, path, url, options, sources, state in rows]
+
+    def clear_finished(self) -> None:
+        """Remove the records of the done and failed jobs."""
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM jobs WHERE state IN (?, ?)', FINISHED_STATES)
+
+    def close(self) -> None:
+        """Close the database connection."""
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,154 @@
+import re
+import sys
+from collections import OrderedDict
+from itertools import islice
+from typing import Iterable, Iterator
+from urllib.parse import urlsplit
+
+
+# the 11 characters of a video id after any of the
+# prefixes YouTube links are built with
+VIDEO_ID_PATTERN = re.compile(
+    r'(?:youtu\.be/|[?&]v=|/(?:shorts|embed|live|v|e)/)([0-9A-Za-z_-]{11})(?![0-9A-Za-z_-])'
+)
+WATCH_URL = 'https://www.youtube.com/watch?v={}'
+# the hosts video, playlist and channel links are accepted from
+YOUTUBE_HOSTS = frozenset({'youtube.com', 'www.youtube.com', 'm.youtube.com',
+                           'music.youtube.com', 'youtu.be',
+                           'youtube-nocookie.com', 'www.youtube-nocookie.com'})
+# playlist pages and the channel links pytube can page through
+PLAYLIST_PATTERN = re.compile(r'/playlist\?(?:.*&)?list=[0-9A-Za-z_-]+')
+CHANNEL_PATTERN = re.compile(r'/(?:c|channel|u|user)/[%\w-]+')
+# links read and turned into jobs at once
+LINKS_CHUNK = 256
+# the amount of the latest videos a repeated link is
+# recognised among, when the links are read as a stream
+RECENT_LINKS = 100_000
+
+
+def is_youtube_link(url: str) -> bool:
+    """Tell whether the host of a link is one of YOUTUBE_HOSTS.
+    A link without a scheme (youtu.be/X) is taken as it is."""
+    if '//' not in url:
+        url = '//' + url
+    try:
+        return urlsplit(url).hostname in YOUTUBE_HOSTS
+    except ValueError:
+        return False
+
+
+def get_video_id(url: str) -> [str, None]:
+    """Extract the video id from a link without
+    making any requests.
+    :returns: None, if the link is not a YouTube video link."""
+    if not is_youtube_link(url):
+        return None
+    if match := VIDEO_ID_PATTERN.search(url):
+        return match.group(1)
+    return None
+
+
+def get_collection_kind(url: str) -> [str, None]:
+    """Tell whether a link leads to a playlist or a channel.
+    A watch link with a list parameter leads to
+    the video, not to the playlist it was opened from.
+    :returns: 'playlist', 'channel' or None."""
+    if not is_youtube_link(url) or get_video_id(url) is not None:
+        return None
+    if PLAYLIST_PATTERN.search(url):
+        return 'playlist'
+    if CHANNEL_PATTERN.search(url):
+        return 'channel'
+    return None
+
+
+def split_collections(urls) -> tuple[list, list]:
+    """Separate the links to playlists and channels
+    from the rest. Empty lines are skipped.
+    :param urls: an iterable of links.
+    :returns: tuple of two: a list of the playlist
+    and channel links, without repetitions, and
+    a list of the other links."""
+    collections = []
+    others = []
+    for url in urls:
+        if not (url := url.strip()):
+            continue
+        if get_collection_kind(url) is None:
+            others.append(url)
+        elif url not in collections:
+            collections.append(url)
+    return collections, others
+
+
+def canonicalise(url: str) -> [str, None]:
+    """Turn any form of a video link (youtu.be/X,
+    watch?v=X&t=10, /shorts/X, /embed/X...) into
+    the watch url of the video.
+    :returns: None, if the link is malformed."""
+    if (video_id := get_video_id(url.strip())) is None:
+        return None
+    return WATCH_URL.format(video_id)
+
+
+def coalesce(urls) -> tuple[dict, list]:
+    """Canonicalise links and merge the ones
+    leading to the same video. Empty lines are skipped.
+    :param urls: an iterable of links.
+    :returns: tuple of two: a dict, mapping every
+    canonical url to the links it was made of (in the
+    order of their first appearance), and a list of
+    the malformed links."""
+    videos = {}
+    malformed = []
+    for url in urls:
+        if not (url := url.strip()):
+            continue
+        if (canonical := canonicalise(url)) is None:
+            malformed.append(url)
+        else:
+            videos.setdefault(canonical, []).append(url)
+    return videos, malformed
+
+
+def read_links(location: str) -> Iterator[str]:
+    """Read links from a file lazily, one line
+    at a time, so the file is never held in memory.
+    A line may have several links separated by ', '.
+    :param location: the path of the file, '-' reads
+    the standard input.
+    :raises: OSError, if the file can not be opened."""
+    file = sys.stdin if location == '-' else open(location, encoding='utf-8')
+    try:
+        for line in file:
+            yield from line.split(', ')
+    finally:
+        if file is not sys.stdin:
+            file.close()
+
+
+def chunked(items: Iterable, size: int) -> Iterator[list]:
+    """Split an iterable into lists of up to size items,
+    taking the items only when the next list is wanted."""
+    items = iter(items)
+    while chunk := list(islice(items, size)):
+        yield chunk
+
+
+class RecentSet:
+    """A set remembering only the latest `size` items
+    added to it, so it stays of the same size however
+    many items pass through it."""
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self._items = OrderedDict()
+
+    def add(self, item) -> None:
+        self._items[item] = None
+        self._items.move_to_end(item)
+        if len(self._items) > self.size:
+            self._items.popitem(last=False)
+
+    def __contains__(self, item) -> bool:
+        return item in self._items
@@ -0,0 +1,172 @@
+import json
+from contextlib import contextmanager
+from math import inf
+from threading import Lock, Thread
+from typing import Callable
+
+
+STAGES = ('parse', 'resolve', 'select', 'download', 'convert', 'cleanup')
+# the upper bounds of the stage histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, inf)
+PREFIX = 'youtubeworm_'
+# the type and the description of every metric
+DESCRIPTIONS = {'stage_seconds': ('histogram', 'Seconds the jobs spent in every stage.'),
+                'jobs_total': ('counter', 'Finished jobs by their final state.'),
+                'bytes_total': ('counter', 'Bytes of media received.'),
+                'retries_total': ('counter', 'Requests sent again, by the reason.'),
+                'errors_total': ('counter', 'Failed jobs by the class of their error.'),
+                'queue_depth': ('gauge', 'Jobs waiting in the queues of the pool.'),
+                'active_workers': ('gauge', 'Workers busy with a job, by the stage.'),
+                'open_circuits': ('gauge', 'Hosts not reached while they keep failing.')}
+
+
+class Metrics:
+    """Counters, gauges and stage timing histograms
+    of the whole process, so a long-running process
+    can be watched from outside. Every metric may have
+    labels, such as the stage or the class of an error.
+    Gauges are either set, or registered as functions
+    called whenever the metrics are read."""
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._gauge_functions = {}
+        self._histograms = {}
+
+    def count(self, name: str, amount: float = 1, **labels: str) -> None:
+        """Increase a counter, such as 'retries_total'."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def add_gauge(self, name: str, amount: float, **labels: str) -> None:
+        """Increase (or, with a negative amount, decrease) a gauge."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._gauges[key] = self._gauges.get(key, 0) + amount
+
+    @contextmanager
+    def track_inprogress(self, name: str, **labels: str):
+        """Raise the gauge by one while the block runs,
+        such as the amount of busy workers."""
+        self.add_gauge(name, 1, **labels)
+        try:
+            yield
+        finally:
+            self.add_gauge(name, -1, **labels)
+
+    def register_gauge(self, name: str, function: Callable[[], float], **labels: str) -> None:
+        """Read a gauge from the function, such as
+        the qsize of a queue. A later registration
+        with the same labels replaces it."""
+        with self._lock:
+            self._gauge_functions[(name, tuple(sorted(labels.items())))] = function
+
+    def observe(self, stage: str, seconds: float) -> None:
+        """Record how long a job spent in the stage."""
+        with self._lock:
+            buckets, total, count = self._histograms.get(stage, ([0] * len(BUCKETS), 0.0, 0))
+            buckets = [amount + (seconds <= bound) for amount, bound in zip(buckets, BUCKETS)]
+            self._histograms[stage] = (buckets, total + seconds, count + 1)
+
+    def get_snapshot(self) -> dict:
+        """Get the current values of all the metrics,
+        in a form that can be dumped to json."""
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            functions = dict(self._gauge_functions)
+            histograms = dict(self._histograms)
+        gauges.update({key: function() for key, function in functions.items()})
+        snapshot = {}
+        for (name, labels), value in sorted(counters.items()) + sorted(gauges.items()):
+            snapshot.setdefault(name, []).append({'labels': dict(labels), 'value': value})
+        snapshot['stage_seconds'] = [
+            {'labels': {'stage': stage}, 'count': count, 'sum': total,
+             'buckets': dict(zip(map(str, BUCKETS), buckets))}
+            for stage, (buckets, total, count) in sorted(histograms.items())
+        ]
+        return snapshot
+
+    def to_prometheus(self) -> str:
+        """Format the metrics in the Prometheus text exposition format."""
+        lines = []
+        for name, samples in self.get_snapshot().items():
+            kind, description = DESCRIPTIONS.get(name, ('untyped', ''))
+            lines.append(f'# HELP {PREFIX}{name} {description}')
+            lines.append(f'# TYPE {PREFIX}{name} {kind}')
+            for sample in samples:
+                if kind != 'histogram':
+                    lines.append(f'{PREFIX}{name}{_format_labels(sample["labels"])} '
+                                 f'{sample["value"]}')
+                    continue
+                for bound, amount in sample['buckets'].items():
+                    labels = dict(sample['labels'], le='+Inf' if bound == 'inf' else bound)
+                    lines.append(f'{PREFIX}{name}_bucket{_format_labels(labels)} {amount}')
+                labels = _format_labels(sample['labels'])
+                lines.append(f'{PREFIX}{name}_sum{labels} {sample["sum"]}')
+                lines.append(f'{PREFIX}{name}_count{labels} {sample["count"]}')
+        return '\n'.join(lines) + '\n'
+
+
+def _format_labels(labels: dict) -> str:
+    """Format labels like {stage="resolve"}, escaping the values."""
+    if not labels:
+        return ''
+    pairs = []
+    for key, value in labels.items():
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{key}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+_metrics = Metrics()
+
+
+def get_metrics() -> Metrics:
+    """Get the process-wide Metrics."""
+    return _metrics
+
+
+def dump_json(report: dict, location: str) -> None:
+    """Write a report, such as the one of a batch, to a json file."""
+    with open(location, 'w') as file:
+        json.dump(report, file, indent=2)
+
+
+def _answer_metrics(handler) -> None:
+    """Answer GET /metrics with the process-wide metrics."""
+    if handler.path.split('?')[0] != '/metrics':
+        handler.send_error(404)
+        return
+    body = get_metrics().to_prometheus().encode()
+    handler.send_response(200)
+    handler.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+    handler.send_header('Content-Length', str(len(body)))
+    handler.end_headers()
+    handler.wfile.write(body)
+
+
+_server = None
+
+
+def serve_metrics(port: int, host: str = '127.0.0.1'):
+    """Expose the metrics at http://host:port/metrics for
+    Prometheus to scrape. The server runs in a daemon thread
+    and is started once, later calls return the running one.
+    http.server is only imported here, most runs never serve.
+    :returns: the ThreadingHTTPServer.
+    :raises: OSError, if the port can not be listened on."""
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+    global _server
+    if _server is None:
+        handler = type('MetricsHandler', (BaseHTTPRequestHandler,),
+                       {'do_GET': _answer_metrics,
+                        # every scrape would print a line otherwise
+                        'log_message': lambda self, *args: None})
+        _server = ThreadingHTTPServer((host, port), handler)
+        _server.daemon_threads = True
+        Thread(target=_server.serve_forever, daemon=True).start()
+    return _server
@@ -0,0 +1,254 @@
+from collections import namedtuple
+from threading import Lock
+from time import monotonic
+from typing import Callable
+
+from metrics import get_metrics
+
+
+# how often the coalesced events are delivered, in seconds
+DEFAULT_INTERVAL = 0.25
+# the transfer rate is measured over windows of this many seconds
+RATE_WINDOW = 1.0
+# a cancelled job was never started, it is left for the next session
+FINISHED_STAGES = ('done', 'failed', 'cancelled')
+
+ProgressEvent = namedtuple('ProgressEvent', 'job stage done total rate eta')
+
+
+class ProgressBus:
+    """Delivers progress events from the downloading threads
+    (or coroutines) to the subscribers. Only the latest event
+    of every job is kept, and the events are delivered at most
+    once per interval, so a subscriber is not flooded with
+    an event for every received piece of data. A change of
+    stage is delivered right away.
+    Subscribers are called in the thread that published the
+    event (one delivery at a time), a GUI has to pass
+    the events to its own thread."""
+
+    def __init__(self, interval: float = DEFAULT_INTERVAL) -> None:
+        self.interval = interval
+        self._subscribers = []
+        self._pending = {}
+        self._delivered_at = 0.0
+        self._lock = Lock()
+        self._delivery = Lock()
+
+    def subscribe(self, callback: Callable[[list], None]) -> None:
+        """Call the callback with the list of the latest
+        ProgressEvents of the jobs that made progress."""
+        with self._lock:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback: Callable[[list], None]) -> None:
+        """Stop calling the callback."""
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def publish(self, event: ProgressEvent, urgent: bool = False) -> None:
+        """Queue the event, deliver the queued ones if the
+        interval has passed or the event is urgent."""
+        with self._lock:
+            self._pending[event.job] = event
+            now = monotonic()
+            if not urgent and now - self._delivered_at < self.interval:
+                return
+            self._delivered_at = now
+        self.flush()
+
+    def flush(self) -> None:
+        """Deliver the queued events right away. Taking
+        the events and calling the subscribers go under one
+        lock, so older events never arrive after newer ones."""
+        with self._delivery:
+            with self._lock:
+                events, self._pending = list(self._pending.values()), {}
+                subscribers = list(self._subscribers)
+            if events:
+                for callback in subscribers:
+                    callback(events)
+
+
+_bus = ProgressBus()
+
+
+def get_bus() -> ProgressBus:
+    """Get the process-wide ProgressBus."""
+    return _bus
+
+
+class JobProgress:
+    """The progress of one job: its stage and how many bytes
+    of the current stream are received. The download classes
+    call advance for every received piece of data."""
+
+    def __init__(self, job: str = None, bus: ProgressBus = None) -> None:
+        """:param job: the identifier of the job in the events.
+        :param bus: the ProgressBus to publish to, without
+                    it the progress is only counted."""
+        self.job = job
+        self.bus = bus
+        self.stage = 'queued'
+        self.done = 0
+        self.total = 0
+        self.rate = 0.0
+        self._lock = Lock()
+        self._window_start = monotonic()
+        self._window_done = 0
+
+    def set_stage(self, stage: str) -> None:
+        """Move the job to another stage."""
+        with self._lock:
+            self.stage = stage
+        self._publish(urgent=True)
+
+    def begin(self, total: int, done: int = 0) -> None:
+        """Start counting the bytes of a stream.
+        :param total: the size of the stream.
+        :param done: the bytes a previous attempt
+                    already downloaded."""
+        with self._lock:
+            self.total = total
+            self.done = self._window_done = done
+            self._window_start = monotonic()
+            self.rate = 0.0
+        self._publish(urgent=True)
+
+    def advance(self, amount: int) -> None:
+        """Count received bytes, in the process-wide
+        metrics as well."""
+        get_metrics().count('bytes_total', amount)
+        with self._lock:
+            self.done += amount
+            now = monotonic()
+            if now - self._window_start >= RATE_WINDOW:
+                self.rate = (self.done - self._window_done) / (now - self._window_start)
+                self._window_start, self._window_done = now, self.done
+        self._publish()
+
+    def grow(self, total: int, done: int = 0) -> None:
+        """Add to the size of the job and to the bytes received,
+        when it downloads several streams (see StreamProgress).
+        :param total: the bytes added to the size.
+        :param done: the bytes of them already downloaded."""
+        with self._lock:
+            self.total += total
+            self.done += done
+            self._window_done += done
+        self._publish(urgent=True)
+
+    def get_event(self) -> ProgressEvent:
+        """Describe the current progress.
+        The ETA is None while the rate is unknown."""
+        with self._lock:
+            eta = (self.total - self.done) / self.rate if self.rate else None
+            return ProgressEvent(self.job, self.stage, self.done,
+                                 self.total, self.rate, eta)
+
+    def _publish(self, urgent: bool = False) -> None:
+        if self.bus is not None:
+            self.bus.publish(self.get_event(), urgent)
+
+
+class StreamProgress:
+    """The progress of one of the streams a job downloads
+    at once, such as the video and the audio of an adaptive
+    download. It is passed to a download class in place of
+    the JobProgress, the sizes and the received bytes of
+    all the streams add up in the JobProgress of the job."""
+
+    def __init__(self, progress: JobProgress) -> None:
+        self.progress = progress
+        self.total = 0
+        self.done = 0
+        self._lock = Lock()
+
+    def begin(self, total: int, done: int = 0) -> None:
+        """Start counting the bytes of the stream, again
+        if a download of it was started before."""
+        with self._lock:
+            grown, received = total - self.total, done - self.done
+            self.total, self.done = total, done
+        self.progress.grow(grown, received)
+
+    def advance(self, amount: int) -> None:
+        """Count received bytes of the stream."""
+        with self._lock:
+            self.done += amount
+        self.progress.advance(amount)
+
+
+class ProgressSummary:
+    """Sums up the events of several jobs into the
+    progress of the whole request, for a progress bar
+    or a progress line. Only the unfinished jobs are
+    kept, the finished ones are counted, so the memory
+    does not grow with the amount of jobs."""
+
+    def __init__(self) -> None:
+        self.jobs = {}
+        self.finished = {stage: 0 for stage in FINISHED_STAGES}
+
+    def update(self, events: list) -> None:
+        """Remember the latest events of the unfinished jobs,
+        count the jobs that were finished."""
+        for event in events:
+            if event.stage in FINISHED_STAGES:
+                self.jobs.pop(event.job, None)
+                self.finished[event.stage] += 1
+            else:
+                self.jobs[event.job] = event
+
+    def get_total(self) -> int:
+        """Get the amount of jobs, finished or not."""
+        return len(self.jobs) + sum(self.finished.values())
+
+    def get_fraction(self) -> float:
+        """Get the finished part of the request, from 0 to 1.
+        Every job weighs the same, a downloading
+        one counts with its received part."""
+        if not (total := self.get_total()):
+            return 0.0
+        finished = float(sum(self.finished.values()))
+        for event in self.jobs.values():
+            if event.stage == 'converting':
+                finished += 1
+            elif event.total:
+                finished += min(event.done / event.total, 1.0)
+        return finished / total
+
+    def get_rate(self) -> float:
+        """Get the bytes per second of all the downloading jobs."""
+        return sum(i.rate for i in self.jobs.values() if i.stage == 'downloading')
+
+    def get_eta(self) -> [float, None]:
+        """Get the seconds the downloading jobs need to finish,
+        None while it is unknown."""
+        etas = [i.eta for i in self.jobs.values() if i.stage == 'downloading']
+        if not etas or None in etas:
+            return None
+        return max(etas)
+
+    def count(self, *stages: str) -> int:
+        """Count the jobs at the given stages."""
+        return (sum(self.finished.get(stage, 0) for stage in stages)
+                + sum(1 for i in self.jobs.values() if i.stage in stages))
+
+    def describe(self) -> str:
+        """Describe the progress in one line."""
+        line = (f'{self.get_fraction():6.1%}  {self.count(*FINISHED_STAGES)}/{self.get_total()} '
+                f'files  {format_size(self.get_rate())}/s')
+        if (eta := self.get_eta()) is not None:
+            line += f'  ETA {int(eta) // 60}:{int(eta) % 60:02d}'
+        return line
+
+
+def format_size(size: float) -> str:
+    """Format an amount of bytes, like 12.3 MB."""
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return f'{size:.1f} {unit}'
+        size /= 1024
+    return f'{size:.1f} GB'
@@ -0,0 +1,139 @@
+import os
+import json
+from typing import TYPE_CHECKING
+from urllib.error import URLError
+from urllib.parse import urlparse, parse_qs
+
+from bandwidth import Throttle
+from progress import JobProgress
+
+if TYPE_CHECKING:
+    from pytube.streams import Stream
+
+
+CHUNK_SIZE = 9 * 1024 * 1024  # the same range size pytube uses
+READ_SIZE = 64 * 1024
+HEADERS = {'User-Agent': 'Mozilla/5.0', 'accept-language': 'en-US,en'}
+
+
+def open_range(url: str, start: int, end: int, timeout: int = 30):
+    """Request bytes from start to end (inclusive) of a stream.
+    The range is passed as the url parameter, the same way pytube
+    does it, as YouTube treats it like a Range header but does not
+    throttle such requests.
+    :returns: the opened response."""
+    # urllib.request brings in http.client, ssl and email,
+    # importing it here keeps them out of the startup
+    from urllib.request import Request, urlopen
+    request = Request(f'{url}&range={start}-{end}', headers=HEADERS)
+    return urlopen(request, timeout=timeout)
+
+
+class PartFile:
+    """An unfinished download: the '.part' file with the
+    downloaded bytes and a small '.part.json' sidecar that
+    tells which stream they belong to. If the stream changes
+    (another itag, size or encoding), the part is thrown away."""
+
+    def __init__(self, file_path: str, stream: 'Stream') -> None:
+        """:param file_path: the path of the finished file."""
+        self.file_path = file_path
+        self.part_path = file_path + '.part'
+        self.sidecar_path = self.part_path + '.json'
+        self.identity = {'itag': stream.itag,
+                         'filesize': stream.filesize,
+                         'id': self.get_stream_id(stream)}
+
+    @staticmethod
+    def get_stream_id(stream: 'Stream') -> str:
+        """Get an ETag-like identifier of the stream's content.
+        The signed url expires, but its 'lmt' (last modified
+        time) parameter stays the same while the encoding does."""
+        query = parse_qs(urlparse(stream.url).query)
+        return query.get('lmt', [''])[0]
+
+    def load(self) -> dict:
+        """Read the sidecar of a previous attempt.
+        :returns: the saved state, if it belongs to the same
+        stream and the part file still exists, otherwise
+        a fresh state (the stale part is removed)."""
+        try:
+            with open(self.sidecar_path) as sidecar:
+                state = json.load(sidecar)
+        except (OSError, ValueError):
+            state = {}
+        if state.get('stream') == self.identity and os.path.isfile(self.part_path):
+            return state
+        self.remove()
+        return {'stream': self.identity}
+
+    def save(self, state: dict) -> None:
+        """Write the state to the sidecar."""
+        state['stream'] = self.identity
+        with open(self.sidecar_path, 'w') as sidecar:
+            json.dump(state, sidecar)
+
+    def finish(self) -> None:
+        """Turn the part into the finished file."""
+        os.replace(self.part_path, self.file_path)
+        if os.path.exists(self.sidecar_path):
+            os.remove(self.sidecar_path)
+
+    def remove(self) -> None:
+        """Remove the part and its sidecar."""
+        for path in (self.part_path, self.sidecar_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class ResumableDownload:
+    """Download a stream sequentially into a '.part' file.
+    If the download is interrupted, the next attempt of the
+    same stream continues from the last written byte."""
+
+    def __init__(self, stream: 'Stream', chunk_size: int = CHUNK_SIZE, timeout: int = 30,
+                 throttle: Throttle = None, progress: JobProgress = None) -> None:
+        """:param throttle: the bandwidth limit of the download,
+                    only the process-wide one by default.
+        :param progress: JobProgress to count the received bytes in."""
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.throttle = throttle or Throttle()
+        self.progress = progress or JobProgress()
+
+    def download(self, output_path: str, filename: str = None) -> str:
+        """Download the stream into the output_path folder,
+        the file gets the filename, or the stream's default one.
+        An existing file of the same size is not downloaded again.
+        :returns: the path to the downloaded file."""
+        file_path = os.path.join(output_path, filename or self.stream.default_filename)
+        size = self.stream.filesize
+        if os.path.isfile(file_path) and os.path.getsize(file_path) == size:
+            return file_path
+        part = PartFile(file_path, self.stream)
+        state = part.load()
+        if 'done' in state:
+            # the part was preallocated by a segmented download,
+            # its size says nothing about what is written
+            part.remove()
+            state = {}
+        part.save(state)
+        with open(part.part_path, 'ab') as file:
+            if (offset := file.tell()) > size:
+                file.truncate(0)
+                offset = 0
+            self.progress.begin(size, offset)
+            while offset < size:
+                end = min(offset + self.chunk_size, size) - 1
+                with open_range(self.stream.url, offset, end, self.timeout) as response:
+                    while data := response.read(READ_SIZE):
+                        file.write(data)
+                        self.throttle.consume(len(data))
+                        self.progress.advance(len(data))
+                file.flush()
+                if file.tell() == offset:
+                    raise URLError(f'no data received for bytes {offset}-{end}')
+                offset = file.tell()
+        part.finish()
+        return file_path
@@ -0,0 +1,230 @@
+import random
+from threading import Lock
+from time import monotonic, sleep
+from typing import Awaitable, Callable
+from urllib.error import URLError, HTTPError
+from urllib.parse import urlsplit
+
+from metrics import get_metrics
+
+
+# the statuses a server answers with when it is overloaded
+# or restarting, a later attempt may get the right answer
+RETRYABLE_STATUSES = frozenset({408, 429, 500, 502, 503, 504})
+DEFAULT_ATTEMPTS = 4
+DEFAULT_BASE_DELAY = 0.5
+DEFAULT_MAX_DELAY = 30.0
+# every job of a batch adds this many retries to the budget
+# of the batch, which starts with DEFAULT_MIN_BUDGET of them
+DEFAULT_BUDGET_RATIO = 0.2
+DEFAULT_MIN_BUDGET = 10
+# the amount of failed attempts in a row opening the circuit
+# of a host, and how many seconds it is kept open
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_COOLDOWN = 30.0
+# how often the attempts waiting for the trial
+# attempt of a half-open circuit check it again
+HALF_OPEN_POLL = 1.0
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Tell whether an attempt that failed with the error
+    may succeed if it is repeated: the connection failed,
+    was cut or timed out, or the server was overloaded.
+    An answer like 404 or 403, a missing video, an existing
+    file or a failed conversion fail the same way again."""
+    from http.client import HTTPException
+    if isinstance(error, HTTPError):
+        return error.code in RETRYABLE_STATUSES
+    return isinstance(error, (URLError, ConnectionError, TimeoutError, HTTPException))
+
+
+def get_host_key(url: str) -> str:
+    """Get the name circuits are kept under: the last two
+    labels of the host, so the many media servers
+    (r1---sn-xxx.googlevideo.com...) share one circuit.
+    An IP address or a single-label host is used as it is."""
+    host = urlsplit(url).hostname or ''
+    if host.replace('.', '').isdigit() or ':' in host:
+        return host
+    return '.'.join(host.split('.')[-2:])
+
+
+class RetryPolicy:
+    """How many times and how long after a failed
+    attempt it is repeated: exponential backoff
+    with full jitter, so attempts of many jobs
+    failed at once are not repeated at once as well."""
+
+    def __init__(self, attempts: int = DEFAULT_ATTEMPTS, base_delay: float = DEFAULT_BASE_DELAY,
+                 max_delay: float = DEFAULT_MAX_DELAY) -> None:
+        """:param attempts: the amount of attempts, the first one included."""
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def get_delay(self, attempt: int) -> float:
+        """Get the seconds to wait after the failed attempt,
+        counted from 0: a random time up to base_delay * 2^attempt."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+class RetryBudget:
+    """The amount of retries a batch may make. It grows
+    with the amount of jobs, so when most of them fail
+    the batch fails fast instead of retrying every job."""
+
+    def __init__(self, ratio: float = DEFAULT_BUDGET_RATIO,
+                 minimum: int = DEFAULT_MIN_BUDGET) -> None:
+        self.ratio = ratio
+        self._left = float(minimum)
+        self._lock = Lock()
+
+    def deposit(self) -> None:
+        """Add the retries of a new job."""
+        with self._lock:
+            self._left += self.ratio
+
+    def withdraw(self) -> bool:
+        """Take a retry.
+        :returns: False, if the budget is spent."""
+        with self._lock:
+            if self._left < 1:
+                return False
+            self._left -= 1
+            return True
+
+
+class CircuitBreaker:
+    """Stops the attempts to reach a host that keeps failing,
+    for the whole process. After `threshold` failed attempts
+    in a row the circuit of the host opens and every attempt
+    waits for `cooldown` seconds; then a single trial attempt
+    is let through, the circuit closes if it succeeds and
+    opens again if it does not. A trial that never reports
+    back is replaced by another one after the cooldown."""
+
+    def __init__(self, threshold: int = DEFAULT_FAILURE_THRESHOLD,
+                 cooldown: float = DEFAULT_COOLDOWN) -> None:
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._failures = {}
+        self._opened_at = {}
+        self._trials = {}
+        self._lock = Lock()
+
+    def get_wait(self, host: str) -> float:
+        """Get the seconds an attempt to reach the host has
+        to wait, 0 if it can be made right away. The first
+        attempt after the cooldown becomes the trial one."""
+        with self._lock:
+            if (opened_at := self._opened_at.get(host)) is None:
+                return 0.0
+            if (left := opened_at + self.cooldown - monotonic()) > 0:
+                return left
+            if monotonic() - self._trials.get(host, -self.cooldown) < self.cooldown:
+                return HALF_OPEN_POLL
+            self._trials[host] = monotonic()
+            return 0.0
+
+    def record_success(self, host: str) -> None:
+        """The host answered, close its circuit."""
+        with self._lock:
+            self._failures.pop(host, None)
+            self._opened_at.pop(host, None)
+            self._trials.pop(host, None)
+
+    def release_trial(self, host: str) -> None:
+        """An attempt failed before reaching the host, so the
+        next attempt is let through as the trial one instead."""
+        with self._lock:
+            self._trials.pop(host, None)
+
+    def record_failure(self, host: str) -> None:
+        """An attempt to reach the host failed, open its circuit
+        if it was the trial one or the threshold is reached."""
+        with self._lock:
+            self._failures[host] = failures = self._failures.get(host, 0) + 1
+            if host in self._trials or failures >= self.threshold:
+                self._trials.pop(host, None)
+                self._opened_at[host] = monotonic()
+
+    def count_open(self) -> int:
+        """Count the hosts with an open circuit."""
+        with self._lock:
+            return len(self._opened_at)
+
+
+_breaker = CircuitBreaker()
+get_metrics().register_gauge('open_circuits', _breaker.count_open)
+
+
+def get_breaker() -> CircuitBreaker:
+    """Get the process-wide CircuitBreaker."""
+    return _breaker
+
+
+def _get_retry_delay(error: BaseException, attempt: int, host: str, budget: RetryBudget,
+                     policy: RetryPolicy, stage: str) -> float:
+    """Record the failed attempt and decide whether it is repeated.
+    :returns: the seconds to wait before the next attempt.
+    :raises: the error, if it is fatal or there are no attempts
+    or retries of the budget left. A network error that is not
+    a URLError is raised as one, so it is reported the same way."""
+    if not is_retryable(error):
+        if isinstance(error, HTTPError):
+            _breaker.record_success(host)  # the host answered, if with a 404
+        else:
+            # an existing file, no disk space... say nothing of the host
+            _breaker.release_trial(host)
+        raise error
+    _breaker.record_failure(host)
+    if attempt + 1 >= policy.attempts or (budget is not None and not budget.withdraw()):
+        if isinstance(error, URLError):
+            raise error
+        raise URLError(error) from error
+    get_metrics().count('retries_total', reason=stage)
+    return policy.get_delay(attempt)
+
+
+def call_with_retries(function: Callable[[], object], host: str, budget: RetryBudget = None,
+                      policy: RetryPolicy = RetryPolicy(), stage: str = ''):
+    """Call the function until it succeeds, waiting while the
+    circuit of the host is open and between the attempts.
+    :param host: the host key of get_host_key the function reaches.
+    :param budget: the RetryBudget of the batch, if it has one.
+    :param stage: the stage the retries are counted under.
+    :returns: the result of the function.
+    :raises: the error of the last attempt."""
+    attempt = 0
+    while True:
+        while (wait := _breaker.get_wait(host)) > 0:
+            sleep(wait)
+        try:
+            result = function()
+        except Exception as e:
+            sleep(_get_retry_delay(e, attempt, host, budget, policy, stage))
+            attempt += 1
+        else:
+            _breaker.record_success(host)
+            return result
+
+
+async def call_with_retries_async(function: Callable[[], Awaitable], host: str,
+                                  budget: RetryBudget = None,
+                                  policy: RetryPolicy = RetryPolicy(), stage: str = ''):
+    """The same as call_with_retries, for a function returning
+    a coroutine (or a future), waiting without blocking the loop."""
+    import asyncio
+    attempt = 0
+    while True:
+        while (wait := _breaker.get_wait(host)) > 0:
+            await asyncio.sleep(wait)
+        try:
+            result = await function()
+        except Exception as e:
+            await asyncio.sleep(_get_retry_delay(e, attempt, host, budget, policy, stage))
+            attempt += 1
+        else:
+            _breaker.record_success(host)
+            return result
@@ -0,0 +1,80 @@
+from heapq import heappush, heappop
+from itertools import count
+from queue import Queue
+
+
+# fifo downloads the files in the order they were requested,
+# lpt (longest processing time) the biggest ones first, which
+# shortens the whole batch, and sjf (shortest job first) the
+# smallest ones first, so files are finished sooner on average
+POLICIES = ('fifo', 'lpt', 'sjf')
+DEFAULT_POLICY = 'fifo'
+
+
+def get_priority(policy: str, size: [int, None]) -> float:
+    """Get the priority of a file of the size under the
+    policy, the lower it is the sooner the file is downloaded.
+    An unknown size puts the file after the known ones."""
+    if policy == 'lpt':
+        return -size if size else 0
+    if policy == 'sjf':
+        return size if size is not None else float('inf')
+    return 0
+
+
+class ScheduledQueue(Queue):
+    """A queue of resolved jobs giving out first the job
+    with the lowest priority (see get_priority), jobs of the
+    same priority in the order they were put. The priority
+    is taken from the schedule option and the size of the job.
+    None, which stops a thread, is given out after all the jobs."""
+
+    def _init(self, maxsize: int) -> None:
+        self.queue = []
+        self._order = count()
+
+    def _qsize(self) -> int:
+        return len(self.queue)
+
+    def _put(self, job) -> None:
+        if job is None:
+            key = (1, 0)
+        else:
+            key = (0, get_priority(job.options.get('schedule', DEFAULT_POLICY), job.size))
+        heappush(self.queue, (key, next(self._order), job))
+
+    def _get(self):
+        return heappop(self.queue)[2]
+
+
+class PrioritySemaphore:
+    """An asyncio semaphore waking the waiting coroutine with
+    the lowest priority first, the ones of the same priority
+    in the order they started waiting."""
+
+    def __init__(self, value: int) -> None:
+        self._value = value
+        self._waiters = []
+        self._order = count()
+
+    async def acquire(self, priority: float = 0) -> None:
+        import asyncio
+        if self._value > 0 and not self._waiters:
+            self._value -= 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        heappush(self._waiters, (priority, next(self._order), waiter))
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release()  # woken up and cancelled at once, pass the place on
+            raise
+
+    def release(self) -> None:
+        while self._waiters:
+            waiter = heappop(self._waiters)[2]
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._value += 1
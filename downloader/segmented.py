@@ -0,0 +1,157 @@
+import os
+from queue import Queue, Empty
+from threading import Thread, Lock
+from time import time
+from typing import TYPE_CHECKING
+
+from bandwidth import Throttle
+from disk_space import preallocate
+from progress import JobProgress
+from resumable import PartFile, open_range
+
+if TYPE_CHECKING:
+    from pytube.streams import Stream
+
+
+# streams smaller than this are downloaded with the usual
+# single connection, as splitting them costs more than it gives
+MIN_SEGMENTED_SIZE = 16 * 1024 * 1024
+CHUNK_SIZE = 4 * 1024 * 1024
+READ_SIZE = 64 * 1024
+
+
+class SegmentedDownload:
+    """Download one stream over several connections.
+    The stream is split by its filesize into byte ranges,
+    every range is fetched by a separate thread and written
+    at its offset in the output file. The amount of connections
+    starts small and grows while the measured throughput
+    keeps growing with it.
+    The file is written as a '.part' with the list of finished
+    ranges in its sidecar, so an interrupted download
+    fetches only the missing ranges next time."""
+
+    def __init__(self, stream: 'Stream', max_connections: int = 8, chunk_size: int = CHUNK_SIZE,
+                 timeout: int = 30, throttle: Throttle = None,
+                 progress: JobProgress = None) -> None:
+        """:param stream: pytube Stream to download.
+        :param max_connections: the upper limit for the
+                    amount of simultaneous connections.
+        :param chunk_size: the size of one byte range.
+        :param throttle: the bandwidth limit shared by the
+                    connections, only the process-wide one by default.
+        :param progress: JobProgress to count the received bytes in."""
+        self.stream = stream
+        self.throttle = throttle or Throttle()
+        self.progress = progress or JobProgress()
+        self.max_connections = max(1, max_connections)
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.chunks = Queue()
+        self.errors = []
+        self.threads = []
+        self._lock = Lock()
+        self._received = 0
+        self._started_at = 0.0
+        self._last_rate = 0.0
+        self._part = None
+        self._state = {}
+
+    @staticmethod
+    def is_worth_it(stream: 'Stream', max_connections: int) -> bool:
+        """Check if the stream is big enough
+        to be downloaded by segments."""
+        return max_connections > 1 and (stream.filesize or 0) >= MIN_SEGMENTED_SIZE
+
+    def download(self, output_path: str, filename: str = None) -> str:
+        """Download the stream into the output_path folder,
+        the file gets the filename, or the stream's default one.
+        :returns: the path to the downloaded file.
+        :raises: the first error that occurred in any of
+        the connections, the finished ranges are kept then."""
+        file_path = os.path.join(output_path, filename or self.stream.default_filename)
+        size = self.stream.filesize
+        if os.path.isfile(file_path) and os.path.getsize(file_path) == size:
+            return file_path
+        self._part = PartFile(file_path, self.stream)
+        self._state = self._part.load()
+        if self._state.get('chunk_size') != self.chunk_size:
+            self._part.remove()
+            self._state = {'chunk_size': self.chunk_size, 'done': []}
+        if not os.path.isfile(self._part.part_path):
+            with open(self._part.part_path, 'wb') as file:
+                preallocate(file, size)
+        self._part.save(self._state)
+        done = set(self._state['done'])
+        self.progress.begin(size, sum(min(self.chunk_size, size - i) for i in done))
+        for start in range(0, size, self.chunk_size):
+            if start not in done:
+                self.chunks.put((start, min(start + self.chunk_size, size) - 1))
+        self._started_at = time()
+        self._add_connection(self._part.part_path)
+        self._add_connection(self._part.part_path)
+        joined = 0
+        while joined < len(self.threads):
+            self.threads[joined].join()
+            joined += 1
+        if self.errors:
+            raise self.errors[0]
+        self._part.finish()
+        return file_path
+
+    def _add_connection(self, file_path: str) -> None:
+        """Start one more thread fetching byte ranges."""
+        with self._lock:
+            if len(self.threads) >= self.max_connections or self.chunks.empty():
+                return
+            thread = Thread(target=self._fetch_chunks, args=(file_path,), daemon=True)
+            self.threads.append(thread)
+        thread.start()
+
+    def _fetch_chunks(self, file_path: str) -> None:
+        """Take byte ranges from the queue until it is empty
+        and write each of them at its offset."""
+        with open(file_path, 'r+b') as file:
+            while not self.errors:
+                try:
+                    start, end = self.chunks.get_nowait()
+                except Empty:
+                    return
+                try:
+                    self._fetch_range(file, start, end)
+                except Exception as e:
+                    self.errors.append(e)
+                    return
+                self._mark_done(start)
+                self._adapt(file_path)
+
+    def _fetch_range(self, file, start: int, end: int) -> None:
+        """Request bytes from start to end (inclusive)
+        and write them at the start offset."""
+        with open_range(self.stream.url, start, end, self.timeout) as response:
+            file.seek(start)
+            while data := response.read(READ_SIZE):
+                file.write(data)
+                with self._lock:
+                    self._received += len(data)
+                self.throttle.consume(len(data))
+                self.progress.advance(len(data))
+        file.flush()
+
+    def _mark_done(self, start: int) -> None:
+        """Remember in the sidecar that the range
+        beginning at start is written."""
+        with self._lock:
+            self._state['done'].append(start)
+            self._part.save(self._state)
+
+    def _adapt(self, file_path: str) -> None:
+        """Open another connection if the throughput
+        grew noticeably since the previous one was opened."""
+        with self._lock:
+            rate = self._received / max(time() - self._started_at, 1e-3)
+            grows = rate > self._last_rate * 1.1
+            if grows:
+                self._last_rate = rate
+        if grows:
+            self._add_connection(file_path)
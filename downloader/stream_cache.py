@@ -0,0 +1,140 @@
+import os
+import json
+from threading import Lock
+from time import time
+from typing import TYPE_CHECKING
+from urllib.parse import urlparse, parse_qs
+
+from links import get_video_id
+
+if TYPE_CHECKING:
+    from pytube import YouTube
+    from pytube.streams import Stream
+
+
+DEFAULT_CACHE_LOCATION = 'stream_cache'
+DEFAULT_CACHE_SIZE = 16 * 1024 * 1024
+# signed urls are dropped this many seconds before they expire,
+# so a cached stream does not expire in the middle of a download
+EXPIRY_MARGIN = 30 * 60
+
+
+class CachedVideo:
+    """Stands in for pytube.YouTube when the video's
+    streams are taken from the cache. Only the attributes
+    the downloader uses are provided."""
+
+    def __init__(self, video_id: str, entry: dict) -> None:
+        from pytube.monostate import Monostate
+        from pytube.query import StreamQuery
+        from pytube.streams import Stream
+        self.video_id = video_id
+        self.title = entry['title']
+        monostate = Monostate(on_progress=None, on_complete=None, title=self.title)
+        self.streams = StreamQuery([Stream(i, monostate) for i in entry['streams']])
+
+
+class StreamCache:
+    """A persistent cache of resolved stream lists.
+    Every video is kept in its own json file named after
+    the video id. An entry lives until the signed urls in it
+    expire; when the files take more than max_size bytes,
+    the least recently used ones are removed."""
+
+    def __init__(self, location: str = DEFAULT_CACHE_LOCATION,
+                 max_size: int = DEFAULT_CACHE_SIZE) -> None:
+        self.location = location
+        self.max_size = max_size
+        self._lock = Lock()
+        os.makedirs(self.location, exist_ok=True)
+
+    def get(self, url: str) -> [CachedVideo, None]:
+        """Get the cached streams of the video the url leads to.
+        :returns: None, if the video is not cached or its
+        entry expired."""
+        if (video_id := get_video_id(url)) is None:
+            return None
+        path = self._build_path(video_id)
+        with self._lock:
+            try:
+                with open(path) as file:
+                    entry = json.load(file)
+            except (OSError, ValueError):
+                return None
+            if entry.get('expires', 0) < time():
+                os.remove(path)
+                return None
+            os.utime(path)
+        return CachedVideo(video_id, entry)
+
+    def put(self, video: 'YouTube') -> None:
+        """Save the resolved streams of the video.
+        The video's streams should be already fetched."""
+        streams = [self._describe(i) for i in video.streams]
+        expires = min((self._get_expiry(i['url']) for i in streams), default=0)
+        if expires - EXPIRY_MARGIN < time():
+            return
+        entry = {'title': video.title,
+                 'expires': expires - EXPIRY_MARGIN,
+                 'streams': streams}
+        path = self._build_path(video.video_id)
+        with self._lock:
+            try:
+                with open(path + '.tmp', 'w') as file:
+                    json.dump(entry, file)
+                os.replace(path + '.tmp', path)
+                self._evict()
+            except OSError:
+                pass  # the cache only saves time, a failed write costs nothing
+
+    def invalidate(self, url: str) -> None:
+        """Remove the entry of the video, for example
+        when its urls turned out to be rejected."""
+        if (video_id := get_video_id(url)) is None:
+            return
+        path = self._build_path(video_id)
+        with self._lock:
+            if os.path.exists(path):
+                os.remove(path)
+
+    @staticmethod
+    def _describe(stream: 'Stream') -> dict:
+        """Turn a Stream into the dict pytube builds it from.
+        Resolution and bitrates are not saved, pytube
+        takes them from the itag."""
+        description = {'url': stream.url,
+                       'itag': stream.itag,
+                       'mimeType': f'{stream.mime_type}; codecs="{", ".join(stream.codecs)}"',
+                       'is_otf': stream.is_otf,
+                       'bitrate': stream.bitrate,
+                       # the size pytube got with the manifest, the filesize
+                       # property would send a HEAD request if it is unknown
+                       'contentLength': getattr(stream, '_filesize', 0) or 0}
+        if fps := getattr(stream, 'fps', None):
+            description['fps'] = fps
+        return description
+
+    @staticmethod
+    def _get_expiry(url: str) -> int:
+        """Get the unix time the signed url expires at."""
+        expire = parse_qs(urlparse(url).query).get('expire', ['0'])[0]
+        return int(expire) if expire.isdigit() else 0
+
+    def _build_path(self, video_id: str) -> str:
+        """Build the path of the video's cache file."""
+        return os.path.join(self.location, video_id + '.json')
+
+    def _evict(self) -> None:
+        """Remove the least recently used entries
+        until the cache fits in max_size."""
+        entries = []
+        for name in os.listdir(self.location):
+            if name.endswith('.json'):
+                stat = os.stat(os.path.join(self.location, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_size:
+                break
+            os.remove(os.path.join(self.location, name))
+            total -= size
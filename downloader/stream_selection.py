@@ -0,0 +1,181 @@
+import re
+from collections import namedtuple
+from typing import Iterable, TYPE_CHECKING
+
+from progress import format_size
+
+if TYPE_CHECKING:
+    from pytube.streams import Stream
+
+
+# a resolution as YouTube writes it, with an optional
+# frame rate: 720p, 2160p60 (or just 720 and 1080p 60)
+RESOLUTION_PATTERN = re.compile(r'^(\d+)p?(?:\s*(\d+))?$')
+# a bitrate, such as 1500K or 2.5M; unlike a size or a byte
+# rate the suffixes are decimal, as kbit/s are on YouTube
+BITRATE_PATTERN = re.compile(r'^(\d+(?:\.\d+)?)([KMG]?)(?:BPS|BIT/S)?$')
+BITRATE_UNITS = {'': 1, 'K': 1000, 'M': 1000 ** 2, 'G': 1000 ** 3}
+
+# what the chosen stream may be at most, None for no limit:
+# the height in pixels, the frame rate, the bitrate in bits
+# per second and the size of the file in bytes (the budget)
+Target = namedtuple('Target', 'height fps bitrate budget')
+Target.__new__.__defaults__ = (None, None, None, None)
+
+# the chosen stream, and whether it is the one asked for
+Selection = namedtuple('Selection', 'stream exact')
+
+
+def parse_resolution(resolution: str) -> tuple:
+    """Turn a resolution like '720p' or '2160p60'
+    into the height and the frame rate (None, if
+    it was not given). An empty one is (None, None).
+    :raises: ValueError, if the resolution is malformed."""
+    if not (resolution := resolution.strip().lower()):
+        return None, None
+    if not (match := RESOLUTION_PATTERN.match(resolution)):
+        raise ValueError(f'"{resolution}" is not a valid resolution.')
+    height, fps = match.groups()
+    return int(height), int(fps) if fps else None
+
+
+def parse_bitrate(bitrate: str) -> int:
+    """Turn a bitrate like '1500K' or '2.5M' into
+    bits per second, 0 means no limit.
+    :raises: ValueError, if the bitrate is malformed."""
+    if not (match := BITRATE_PATTERN.match(bitrate.strip().upper())):
+        raise ValueError(f'"{bitrate}" is not a valid bitrate.')
+    return int(float(match.group(1)) * BITRATE_UNITS[match.group(2)])
+
+
+def get_target(options: dict) -> Target:
+    """Build the Target of a job from its options:
+    preferred_resolution, fps, bitrate and maxsize.
+    A malformed resolution is left out of the target."""
+    try:
+        height, fps = parse_resolution(options.get('preferred_resolution') or '')
+    except ValueError:
+        height = fps = None
+    return Target(height, options.get('fps') or fps,
+                  options.get('bitrate') or None, options.get('maxsize') or None)
+
+
+def get_height(stream: 'Stream') -> int:
+    """Get the height of a video stream, 0 if it has none."""
+    return int(stream.resolution[:-1]) if stream.resolution else 0
+
+
+def get_size(*streams: ['Stream', None]) -> [int, None]:
+    """Get the size of the file made of the streams,
+    None if there are none of them."""
+    if not (streams := [stream for stream in streams if stream is not None]):
+        return None
+    return sum(stream.filesize for stream in streams)
+
+
+def get_ladder(streams: Iterable['Stream'], adaptive: bool = False) -> list:
+    """Get the video streams with sound (or, if adaptive,
+    the video-only ones, mp4 if there are any), the best one
+    first: by the height, the frame rate, then the bitrate.
+    Selecting goes down the ladder until a stream fits."""
+    if adaptive:
+        candidates = [stream for stream in streams
+                      if stream.is_adaptive and stream.includes_video_track and get_height(stream)]
+        candidates = [stream for stream in candidates if stream.subtype == 'mp4'] or candidates
+    else:
+        candidates = [stream for stream in streams if stream.is_progressive and get_height(stream)]
+    return sorted(candidates,
+                  key=lambda stream: (get_height(stream), getattr(stream, 'fps', 0),
+                                      stream.bitrate or 0),
+                  reverse=True)
+
+
+def get_adaptive_audio(streams: Iterable['Stream']) -> ['Stream', None]:
+    """Get the audio-only stream with the highest bitrate
+    to go with an adaptive video, mp4 if there is one."""
+    candidates = [stream for stream in streams
+                  if stream.includes_audio_track and not stream.includes_video_track]
+    candidates = [stream for stream in candidates if stream.subtype == 'mp4'] or candidates
+    return max(candidates, key=lambda stream: stream.bitrate or 0, default=None)
+
+
+def fits(stream: 'Stream', target: Target, reserved: int = 0) -> bool:
+    """Tell whether the stream is within the target. The size
+    is checked last, it may take a request to the server.
+    :param reserved: the bytes of the budget already taken,
+                such as by the audio of an adaptive video."""
+    return not ((target.height and get_height(stream) > target.height)
+                or (target.fps and getattr(stream, 'fps', 0) > target.fps)
+                or (target.bitrate and (stream.bitrate or 0) > target.bitrate)
+                or (target.budget and stream.filesize + reserved > target.budget))
+
+
+def select_stream(streams: Iterable['Stream'], target: Target = Target()) -> Selection:
+    """Choose the best stream at or below the target, so
+    a batch asking for 480p does not download 1080p. If the
+    asked resolution is missing, the next rung down the ladder
+    is taken; if no stream fits at all, the smallest one.
+    :returns: Selection with None, if the video has no streams
+    with sound; it is exact if the stream has the asked
+    resolution (and frame rate) and fits the limits."""
+    return _climb_down(get_ladder(streams), target)
+
+
+def select_adaptive(streams: Iterable['Stream'], target: Target = Target()) -> tuple:
+    """Choose the best video-only stream at or below the target
+    the same way select_stream does, and the audio to go with it.
+    They reach higher resolutions than the streams with sound,
+    but have to be muxed into one file after downloading.
+    :returns: a tuple of two: Selection of the video and the
+    audio stream. If the video has no adaptive streams, or none
+    of them fits but a stream with sound does, the selection
+    of select_stream and None."""
+    audio = get_adaptive_audio(streams)
+    if audio is None or not (ladder := get_ladder(streams, adaptive=True)):
+        return select_stream(streams, target), None
+    reserved = audio.filesize if target.budget else 0
+    if not fits((selection := _climb_down(ladder, target, reserved)).stream, target, reserved):
+        progressive = select_stream(streams, target)
+        if progressive.stream is not None and fits(progressive.stream, target):
+            return progressive, None
+    return selection, audio
+
+
+def _climb_down(ladder: list, target: Target, reserved: int = 0) -> Selection:
+    """Take the first stream of the ladder within the target."""
+    if not ladder:
+        return Selection(None, False)
+    stream = next((stream for stream in ladder if fits(stream, target, reserved)), None)
+    if stream is None:
+        return Selection(ladder[-1], False)
+    exact = ((not target.height or get_height(stream) == target.height)
+             and (not target.fps or getattr(stream, 'fps', 0) == target.fps))
+    return Selection(stream, exact)
+
+
+def describe_target(target: Target) -> str:
+    """Describe the target, such as '720p, 30fps, at most 200.0 MB'."""
+    parts = []
+    if target.height:
+        parts.append(f'{target.height}p')
+    if target.fps:
+        parts.append(f'{target.fps}fps')
+    if target.bitrate:
+        parts.append(f'{target.bitrate / 1000:g} kbit/s')
+    if target.budget:
+        parts.append(f'at most {format_size(target.budget)}')
+    return ', '.join(parts) or 'the best stream'
+
+
+def describe_stream(stream: ['Stream', None]) -> str:
+    """Describe the stream, such as '720p, 30fps, 2000 kbit/s'."""
+    if stream is None:
+        return 'no stream'
+    if not stream.resolution:
+        return stream.abr or f'itag {stream.itag}'
+    parts = [stream.resolution]
+    if fps := getattr(stream, 'fps', None):
+        parts.append(f'{fps}fps')
+    if stream.bitrate:
+        parts.append(f'{stream.bitrate / 1000:g} kbit/s')
+    return ', '.join(parts)
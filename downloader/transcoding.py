@@ -0,0 +1,202 @@
+import os
+from concurrent.futures import Future
+from subprocess import Popen, PIPE, DEVNULL, run
+from threading import Lock
+from time import time
+from typing import Callable, TYPE_CHECKING
+
+from bandwidth import Throttle
+from progress import JobProgress
+from resumable import CHUNK_SIZE, READ_SIZE, open_range
+
+if TYPE_CHECKING:
+    from pytube.streams import Stream
+
+
+class ConversionError(RuntimeError):
+    ...
+
+
+def get_ffmpeg_binary() -> str:
+    """Get the ffmpeg executable moviepy is configured with
+    (the one downloaded by imageio_ffmpeg, unless the
+    FFMPEG_BINARY environment variable says otherwise)."""
+    from moviepy.config import get_setting
+    return get_setting('FFMPEG_BINARY')
+
+
+def build_mp3_encoder_command(part_location: str) -> list:
+    """Build the ffmpeg command encoding the audio
+    it reads from stdin into an mp3 file."""
+    return [get_ffmpeg_binary(), '-y', '-hide_banner', '-loglevel', 'error',
+            '-i', 'pipe:0', '-vn', '-acodec', 'libmp3lame', '-ar', '44100',
+            '-f', 'mp3', part_location]
+
+
+def convert_to_mp3(mp4_location: str, mp3_location: str) -> float:
+    """Convert a downloaded mp4 file with no frames to mp3
+    and remove the mp4. Meant to be run in a worker process
+    of a ProcessPoolExecutor, so encoding does not hold
+    the GIL of the downloading threads.
+    :returns: how many seconds the conversion took.
+    :raises: ConversionError, if moviepy failed."""
+    from moviepy.editor import AudioFileClip
+    ts = time()
+    try:
+        audio = AudioFileClip(mp4_location)
+        audio.write_audiofile(mp3_location, logger=None)
+        audio.close()
+    except Exception as e:
+        raise ConversionError(os.path.basename(mp3_location), str(e))
+    os.remove(mp4_location)
+    return time() - ts
+
+
+class ConverterPool:
+    """A process pool the conversions are handed to,
+    started on the first submitted one, so a session
+    that never converts a downloaded file does not
+    import the executor or spawn the worker processes."""
+
+    def __init__(self, workers: int = None) -> None:
+        """:param workers: the amount of worker processes,
+                    the amount of CPUs by default."""
+        self.workers = workers
+        self._executor = None
+        self._lock = Lock()
+
+    def submit(self, function: Callable, *args) -> Future:
+        """Run the function in a worker process,
+        start the pool if it was not started yet."""
+        with self._lock:
+            if self._executor is None:
+                from concurrent.futures import ProcessPoolExecutor
+                self._executor = ProcessPoolExecutor(self.workers)
+            return self._executor.submit(function, *args)
+
+    def shutdown(self, cancel_futures: bool = False) -> None:
+        """Wait for the submitted conversions and
+        stop the worker processes, if they were started.
+        :param cancel_futures: True to cancel the
+                    conversions that did not start yet."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(cancel_futures=cancel_futures)
+
+    def __enter__(self) -> 'ConverterPool':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.shutdown()
+
+
+def remux(source: str, target: str) -> str:
+    """Copy the audio of the source file into another
+    container without re-encoding it, remove the source.
+    The container is chosen by the target extension.
+    :returns: the path to the new file.
+    :raises: ConversionError, if ffmpeg failed."""
+    container = {'.opus': 'opus', '.m4a': 'ipod'}.get(os.path.splitext(target)[1], 'mp4')
+    _copy_streams(['-i', source, '-vn', '-c:a', 'copy', '-f', container], target)
+    os.remove(source)
+    return target
+
+
+def mux(video: str, audio: str, target: str) -> str:
+    """Put the video track of one file and the audio track
+    of another into an mp4 file without re-encoding them,
+    remove both sources. It takes about as long as copying
+    the files, so it is run right after downloading them.
+    :returns: the path to the new file.
+    :raises: ConversionError, if ffmpeg failed."""
+    _copy_streams(['-i', video, '-i', audio, '-map', '0:v:0', '-map', '1:a:0',
+                   '-c', 'copy', '-f', 'mp4'], target)
+    os.remove(video)
+    os.remove(audio)
+    return target
+
+
+def _copy_streams(arguments: list, target: str) -> None:
+    """Run ffmpeg with the arguments, writing into a '.part'
+    file that is renamed to the target once ffmpeg succeeded.
+    :raises: ConversionError, if ffmpeg failed."""
+    part_location = target + '.part'
+    result = run([get_ffmpeg_binary(), '-y', '-hide_banner', '-loglevel', 'error',
+                  *arguments, part_location], stdout=DEVNULL, stderr=PIPE)
+    if result.returncode:
+        if os.path.exists(part_location):
+            os.remove(part_location)
+        raise ConversionError(os.path.basename(target),
+                              result.stderr.decode(errors='replace').strip())
+    os.replace(part_location, target)
+
+
+class StreamingTranscoder:
+    """Convert an audio stream to mp3 while it is downloaded.
+    The downloaded bytes are written straight into the stdin
+    of an ffmpeg process, so encoding goes at the same time as
+    the transfer and no intermediate mp4 file is written.
+    YouTube audio-only streams are fragmented mp4 (or webm),
+    which ffmpeg can read from a pipe."""
+
+    def __init__(self, stream: 'Stream', mp3_location: str, chunk_size: int = CHUNK_SIZE,
+                 timeout: int = 30, throttle: Throttle = None,
+                 progress: JobProgress = None) -> None:
+        """:param stream: pytube Stream with the audio.
+        :param mp3_location: the path of the mp3 file to create.
+        :param throttle: the bandwidth limit of the download,
+                    only the process-wide one by default.
+        :param progress: JobProgress to count the received bytes in."""
+        self.stream = stream
+        self.mp3_location = mp3_location
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.throttle = throttle or Throttle()
+        self.progress = progress or JobProgress()
+
+    def transcode(self) -> str:
+        """Download and convert the stream.
+        The mp3 is written as '.part' first and renamed
+        only after ffmpeg finished successfully.
+        :returns: the path to the mp3 file.
+        :raises: ConversionError, if ffmpeg failed."""
+        part_location = self.mp3_location + '.part'
+        encoder = Popen(build_mp3_encoder_command(part_location),
+                        stdin=PIPE, stdout=DEVNULL, stderr=PIPE)
+        try:
+            self._feed(encoder)
+        except BrokenPipeError:
+            pass  # ffmpeg exited early, its stderr tells why
+        except BaseException:
+            encoder.kill()
+            encoder.wait()
+            self._remove(part_location)
+            raise
+        finally:
+            if not encoder.stdin.closed:
+                encoder.stdin.close()
+        error = encoder.stderr.read().decode(errors='replace').strip()
+        if encoder.wait():
+            self._remove(part_location)
+            raise ConversionError(os.path.basename(self.mp3_location), error)
+        os.replace(part_location, self.mp3_location)
+        return self.mp3_location
+
+    def _feed(self, encoder: Popen) -> None:
+        """Write the stream into the encoder's stdin range by range."""
+        size = self.stream.filesize
+        self.progress.begin(size)
+        for start in range(0, size, self.chunk_size):
+            end = min(start + self.chunk_size, size) - 1
+            with open_range(self.stream.url, start, end, self.timeout) as response:
+                while data := response.read(READ_SIZE):
+                    encoder.stdin.write(data)
+                    self.throttle.consume(len(data))
+                    self.progress.advance(len(data))
+
+    @staticmethod
+    def _remove(location: str) -> None:
+        """Remove the unfinished mp3, if ffmpeg created it."""
+        if os.path.exists(location):
+            os.remove(location)